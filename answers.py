@@ -0,0 +1,121 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from linkgraph import url_to_title
+from masking import PARENTHETICAL_RE, convert
+from page_cache import canonical_page_url
+
+# 比較時に無視する文字（空白・区切り記号）
+IGNORED_CHARS_RE = re.compile(r'[\s_・･\-‐－―〜~、。,.!?！？「」『』"\'`]')
+# ローマ字の長音の揺れ（toukyou / tokyo など）
+LONG_VOWEL_RE = re.compile(r'([aiueo])\1|ou')
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize_answer(text):
+    """回答を比較用の形に揃える
+
+    全角・半角を統一（NFKC）し、大文字小文字・カタカナとひらがなの違いと
+    空白・区切り記号を無視する。
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = text.translate(_KATAKANA_TO_HIRAGANA)
+    return IGNORED_CHARS_RE.sub('', text)
+
+
+def _collapse_long_vowels(romaji):
+    return LONG_VOWEL_RE.sub(lambda match: match.group()[0], romaji)
+
+
+def answer_variants(title):
+    """記事タイトルに対して正解とみなす表記を正規化済みの集合で返す
+
+    タイトルそのもの、括弧部分を除いたタイトル、そのひらがな（カタカナ）表記、
+    ローマ字表記（長音を省略した表記を含む）。
+    """
+    variants = {title}
+    match = PARENTHETICAL_RE.match(title)
+    base = match.group(1) if match else title
+    variants.add(base)
+    hiragana, romaji = convert(base)
+    variants.update([hiragana, romaji, _collapse_long_vowels(romaji.replace(' ', ''))])
+    return frozenset(filter(None, map(normalize_answer, variants)))
+
+
+class AnswerIndex:
+    """ページURLごとの正解表記の索引
+
+    コーパスのページは build() で事前に登録しておき、回答の判定はURLでの
+    辞書引きと集合の所属判定だけで行う。未登録のURLは初回の判定時に
+    URLのタイトルから作成し、max_extra 件までLRUで保持する。
+    """
+
+    def __init__(self, max_extra=10000):
+        self.max_extra = max_extra
+        self._entries = {}  # 正規化したURL -> (タイトル, 正解表記の集合)
+        self._extra = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, urls):
+        """URLの一覧を索引に登録する（登録済みのURLは飛ばす）"""
+        for url in urls:
+            key = canonical_page_url(url)
+            if key in self._entries:
+                continue
+            entry = self._make_entry(url)
+            if entry:
+                self._entries[key] = entry
+
+    def add_title(self, url, title):
+        """ページに表示されたタイトル（URLと異なる場合がある）も正解として登録する"""
+        key = canonical_page_url(url)
+        entry = self._lookup(key, url)
+        variants = answer_variants(title)
+        self._store(key, (title, entry[1] | variants if entry else variants))
+
+    def title_of(self, url):
+        """正解として表示するタイトル"""
+        entry = self._lookup(canonical_page_url(url), url)
+        return entry[0] if entry else ''
+
+    def is_correct(self, url, answer):
+        entry = self._lookup(canonical_page_url(url), url)
+        return entry is not None and normalize_answer(answer) in entry[1]
+
+    def _make_entry(self, url):
+        title = url_to_title(url)
+        if not title:
+            return None
+        return title, answer_variants(title)
+
+    def _lookup(self, key, url):
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            entry = self._extra.get(key)
+            if entry is not None:
+                self._extra.move_to_end(key)
+                return entry
+        entry = self._make_entry(url)
+        if entry:
+            self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        if key in self._entries:
+            self._entries[key] = entry
+            return
+        with self._lock:
+            self._extra[key] = entry
+            self._extra.move_to_end(key)
+            while len(self._extra) > self.max_extra:
+                self._extra.popitem(last=False)
+
+    def stats(self):
+        return {'indexed': len(self._entries), 'extra': len(self._extra)}
@@ -0,0 +1,84 @@
+"""プレイヤーがゴールするたびの順位計算について、旧来の全員ソートと順位表への挿入を比較するベンチマーク
+
+旧来の処理はゴールのたびにゴール済みの全員を集めて (移動回数, ゴール時間) で並べ直し、
+list.index で順位を求め、全員の finished を見て終了判定をしていた。
+新しい処理は GameState.finish_player() で順位表に二分探索で挿入し、終了判定は人数の比較で行う。
+
+使い方: python bench/bench_leaderboard.py [--players 10 100 1000] [--repeat N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import GameState  # noqa: E402
+
+BROADCAST_SIZE = 10
+
+
+def _new_game(player_count):
+    player_ids = [f'player{i:05d}' for i in range(player_count)]
+    game_state = GameState('https://ja.wikipedia.org/wiki/雨', 'https://ja.wikipedia.org/wiki/日本',
+                           player_ids, started_at=0.0)
+    rng = random.Random(player_count)
+    for player_id in player_ids:
+        game_state.player_states[player_id].moves = rng.randint(1, 30)
+    order = player_ids[:]
+    rng.shuffle(order)
+    return game_state, order
+
+
+def legacy_finish_all(game_state, order):
+    """変更前の handle_player_move と同じ順位計算を全員分行う"""
+    for finish_time, player_id in enumerate(order, 1):
+        state = game_state.player_states[player_id]
+        state.finished = True
+        state.finish_time = float(finish_time)
+        all(s.finished for s in game_state.player_states.values())
+        finished_player_ids = [p_id for p_id, s in game_state.player_states.items() if s.finished]
+        finished_player_ids.sort(key=lambda p_id: (
+            game_state.player_states[p_id].moves,
+            game_state.player_states[p_id].finish_time
+        ))
+        finished_player_ids.index(player_id) + 1
+
+
+def leaderboard_finish_all(game_state, order):
+    """順位表を使った順位計算を全員分行う（player_finished で送る上位の取得を含む）"""
+    for finish_time, player_id in enumerate(order, 1):
+        game_state.finish_player(player_id, float(finish_time))
+        game_state.leaderboard.top(BROADCAST_SIZE)
+        game_state.all_finished()
+
+
+def _best_of(func, player_count, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        game_state, order = _new_game(player_count)
+        start = time.perf_counter()
+        func(game_state, order)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # 1回のゴールあたりの平均時間と、全員がゴールするまでの合計時間を表示する
+    print(f"{'players':>8}{'legacy/event(us)':>18}{'board/event(us)':>18}{'legacy total(ms)':>18}"
+          f"{'board total(ms)':>18}")
+    for player_count in args.players:
+        legacy_time = _best_of(legacy_finish_all, player_count, args.repeat)
+        board_time = _best_of(leaderboard_finish_all, player_count, args.repeat)
+        print(f"{player_count:>8}{legacy_time / player_count * 1e6:>18.1f}"
+              f"{board_time / player_count * 1e6:>18.1f}{legacy_time * 1000:>18.2f}{board_time * 1000:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""「当てる」モードのタイトル隠しについて、旧来の3回置換とサニタイズ中のマスキングを比較するベンチマーク
+
+旧来の処理はリクエストごとにkakasiで変換し、HTML全体に str.replace を3回かける。
+新しい処理は変換結果をメモ化し、サニタイズと同じ走査の中でテキストだけを置き換える
+（テキストノードを区切り文字で連結し、表記ごとに1回だけ str.replace をかける）。
+1リクエスト分の時間は2つの処理を交互に実行して測り、隣り合った実行どうしの時間の比の中央値も表示する。
+
+使い方: python bench/bench_masking.py [--repeat N]
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pykakasi import kakasi  # noqa: E402
+
+from bench.fixtures import load_fixtures  # noqa: E402
+from masking import title_mask  # noqa: E402
+from sanitizer import PageSanitizer, mask_text_nodes, sanitize_html  # noqa: E402
+
+kks = kakasi()
+
+HREF_RE = re.compile(r'href="([^"]*)"')
+TEXT_NODE_RE = re.compile(r'>([^<]+)<')
+
+
+def legacy_replace(html, title_text):
+    """変更前の render_page() の置換部分（kakasi変換と全体への3回の str.replace）"""
+    original_text = title_text
+    replaced_text = "X" * len(original_text)
+    aresult = re.match(r"(.+?)_\(.+\)", original_text)
+    if aresult:
+        original_text = aresult.group(1)
+    kksresult = kks.convert(original_text)
+    hiratext = ''.join([item['hira'] for item in kksresult])
+    romazitext = ' '.join([item['hepburn'] for item in kksresult])
+    html = html.replace(original_text, replaced_text)
+    html = html.replace(hiratext, "X" * len(hiratext))
+    html = html.replace(romazitext, "X" * len(romazitext))
+    return html
+
+
+def single_pass_replace(text_nodes, title_text):
+    """新しい処理の置換部分（テキストノードだけをまとめて置換。エスケープを含む）"""
+    return mask_text_nodes(text_nodes, title_mask(title_text))
+
+
+def legacy_mask(content):
+    """変更前の render_page() と同じ処理（比較用）"""
+    sanitizer = PageSanitizer(mask_title=True)
+    html = sanitizer.sanitize(content)
+    return legacy_replace(html, sanitizer.title_text)
+
+
+def single_pass_mask(content):
+    return sanitize_html(content, mask_title=True)[0]
+
+
+def _corrupted_links(html):
+    """タイトルの置換で壊れたリンク（hrefにXの連続を含むもの）の数"""
+    return sum(1 for href in HREF_RE.findall(html) if 'XX' in href or href.endswith('X'))
+
+
+def _best_of(func, repeat, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _compare(legacy, single, repeat, *args):
+    """2つの処理を交互に実行し、(legacy の最短時間, single の最短時間, 時間の比 single/legacy の中央値) を返す
+
+    隣り合った実行どうしの比の中央値を使い、実行中の負荷の変化が片方だけに偏らないようにする。
+    """
+    legacy_times, single_times = [], []
+    for i in range(repeat):
+        order = ((legacy, legacy_times), (single, single_times))
+        for func, times in (order if i % 2 == 0 else order[::-1]):
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+    ratio = statistics.median(s / l for l, s in zip(legacy_times, single_times))
+    return min(legacy_times), min(single_times), ratio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=11)
+    args = parser.parse_args()
+
+    # 置換部分だけの時間と、サニタイズを含めた1リクエスト分の時間を表示する
+    print(f"{'fixture':<12}{'size(KB)':>10}{'replace legacy(ms)':>20}{'replace single(ms)':>20}"
+          f"{'total legacy(ms)':>18}{'total single(ms)':>18}{'single/legacy':>15}  broken links (legacy/single)")
+    for name, content in load_fixtures().items():
+        sanitizer = PageSanitizer(mask_title=True)
+        html = sanitizer.sanitize(content)
+        title_text = sanitizer.title_text
+        text_nodes = TEXT_NODE_RE.findall(html)
+        title_mask(title_text)  # 2回目以降のリクエストと同じく変換結果がメモ化された状態で計測する
+        legacy_replace_time = _best_of(legacy_replace, args.repeat, html, title_text)
+        new_replace_time = _best_of(single_pass_replace, args.repeat, text_nodes, title_text)
+        legacy_time, new_time, ratio = _compare(legacy_mask, single_pass_mask, args.repeat, content)
+        broken = f"{_corrupted_links(legacy_mask(content))}/{_corrupted_links(single_pass_mask(content))}"
+        print(f"{name:<12}{len(content.encode('utf-8')) / 1024:>10.0f}{legacy_replace_time * 1000:>20.2f}"
+              f"{new_replace_time * 1000:>20.2f}{legacy_time * 1000:>18.1f}{new_time * 1000:>18.1f}"
+              f"{ratio:>15.3f}  {broken}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""ページ処理（/proxy と extract_wiki_links）の段階別の時間とピークメモリを測るベンチマーク
+
+フィクスチャの記事をスタブのWikipedia（bench/stub_wikipedia.py）から返し、
+WIKIGAME_UPSTREAM_BASE_URL でアプリの取得先をスタブに向けるので、ネットワークには接続しない。
+
+各段階の時間:
+- fetch:     スタブからの取得とデコード（upstream.get(...).text）
+- parse:     HTMLParser でのトークン分割のみ
+- sanitize:  「当てる」モードの PageSanitizer の走査で、ハンドラ（handle_starttag など）にかかった時間
+             （UI部品の削除とタイトル隠しの時間を除く）
+- chrome:    UI部品の判定（_is_chrome()）と、削除するdivの中のトークンを読み飛ばすハンドラの時間
+- mask:      「当てる」モードのタイトル隠し（テキストノードをまとめて隠す処理と属性値の置換）
+- serialize: 出力の連結とUTF-8へのエンコード
+- links:     extract_wiki_links()（取得を含む）
+- proxy:     キャッシュを空にした状態での /proxy のリクエスト全体
+sanitize / chrome / mask は、同じ1回の走査の中でそれぞれの処理に入った時刻と出た時刻を記録して直接測る
+（入れ子になった処理の時間は内側の段階にだけ数える）。計測のための呼び出しの分だけ走査全体は遅くなる。
+links と proxy とピークメモリの計測では取得した応答の検証子（upstream_validators）も消すので、304での再検証ではなく
+毎回本文を取得する。
+ピークメモリは tracemalloc で測った「当てる」モードの render_page() と extract_wiki_links() の大きい方。
+
+使い方: python bench/bench_pipeline.py [--repeat N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import load_fixtures  # noqa: E402
+from bench.stub_wikipedia import StubWikipedia  # noqa: E402
+from sanitizer import PageSanitizer, create_sanitizer  # noqa: E402
+
+STAGES = ['fetch', 'parse', 'sanitize', 'chrome', 'mask', 'serialize', 'links', 'proxy']
+
+
+TIMED_STAGES = ('sanitize', 'chrome', 'mask')
+HANDLERS = ('handle_starttag', 'handle_startendtag', 'handle_endtag', 'handle_data', 'handle_comment',
+            'handle_decl', 'handle_pi', 'unknown_decl', '_flush_text')
+
+
+class _StageTimer:
+    """段階ごとの時間を、入れ子になった処理の時間を除いて積算する"""
+
+    def __init__(self):
+        self.totals = dict.fromkeys(TIMED_STAGES, 0.0)
+        self._stack = []
+        self._since = 0.0
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            self.totals[self._stack[-1]] += now - self._since
+        self._stack.append(stage)
+        self._since = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.totals[self._stack.pop()] += now - self._since
+        self._since = now
+
+
+class _TimedMask:
+    """TitleMask.mask() の時間を mask に数えるラッパー"""
+
+    def __init__(self, title_mask, timer):
+        self._title_mask = title_mask
+        self._timer = timer
+        self.min_length = title_mask.min_length
+
+    def mask(self, text):
+        self._timer.enter('mask')
+        try:
+            return self._title_mask.mask(text)
+        finally:
+            self._timer.exit()
+
+
+def _timed(method, stage=None):
+    """stage を指定しない場合は、削除するdivの中なら chrome、それ以外は sanitize に数える"""
+    def timed(self, *args):
+        self._timer.enter(stage or ('chrome' if self._skip_depth else 'sanitize'))
+        try:
+            return method(self, *args)
+        finally:
+            self._timer.exit()
+    return timed
+
+
+class _TimingSanitizer(PageSanitizer):
+    """走査の中の段階ごとの時間を測るサニタイザ"""
+
+    def __init__(self, timer, title_mask):
+        super().__init__(mask_title=True, title_mask=_TimedMask(title_mask, timer) if title_mask else None)
+        self._timer = timer
+
+    _is_chrome = _timed(PageSanitizer._is_chrome, 'chrome')
+    _mask_pending_text = _timed(PageSanitizer._mask_pending_text, 'mask')
+
+
+for _name in HANDLERS:
+    setattr(_TimingSanitizer, _name, _timed(getattr(PageSanitizer, _name)))
+
+
+def _stage_timings(content, repeat):
+    """sanitize / chrome / mask の時間を repeat 回測り、段階ごとの最短時間を返す"""
+    best = dict.fromkeys(TIMED_STAGES, float('inf'))
+    title_mask = create_sanitizer(content, mask_title=True).title_mask
+    for _ in range(repeat):
+        timer = _StageTimer()
+        _TimingSanitizer(timer, title_mask).sanitize(content)
+        for stage, total in timer.totals.items():
+            best[stage] = min(best[stage], total)
+    return best
+
+
+def _tokenize(content):
+    parser = HTMLParser(convert_charrefs=True)
+    parser.feed(content)
+    parser.close()
+
+
+class _RecordingSanitizer(PageSanitizer):
+    """隠す対象になったテキストノードを記録するサニタイザ（マスキングだけの時間を測る比較用）"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.masked_texts = []
+
+    def _mask_pending_text(self):
+        self.masked_texts.extend(self._masked_texts)
+        super()._mask_pending_text()
+
+
+def _walk(content):
+    sanitizer = PageSanitizer()
+    sanitizer.feed(content)
+    sanitizer.close()
+    return sanitizer
+
+
+def _serialize(sanitizer):
+    return ''.join(sanitizer._out).encode('utf-8')
+
+
+def _best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(app_main, client, title, content, repeat):
+    url = f'https://ja.wikipedia.org/wiki/{title}'
+    walked = _walk(content)
+
+    def links_uncached():
+        app_main.upstream_validators.clear()
+        app_main.extract_wiki_links(url)
+
+    def proxy_uncached():
+        app_main.page_cache.clear()
+        app_main.upstream_validators.clear()
+        client.get('/proxy', query_string={'url': url}, headers={'Accept-Encoding': 'identity'}).get_data()
+
+    timings = {
+        'fetch': _best_of(lambda: app_main.upstream.get(url).text, repeat),
+        'parse': _best_of(lambda: _tokenize(content), repeat),
+        **_stage_timings(content, repeat),
+        'serialize': _best_of(lambda: _serialize(walked), repeat),
+        'links': _best_of(links_uncached, repeat),
+        'proxy': _best_of(proxy_uncached, repeat)
+    }
+    peaks = []
+    for func in (lambda: app_main.render_page(url, 'guessing'), lambda: app_main.extract_wiki_links(url)):
+        app_main.upstream_validators.clear()
+        peaks.append(_peak_memory(func))
+    peak = max(peaks)
+    return timings, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    with StubWikipedia(fixtures) as stub:
+        os.environ['WIKIGAME_UPSTREAM_BASE_URL'] = stub.base_url
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main as app_main
+        client = app_main.app.test_client()
+
+        print(f"{'fixture':<12}{'size(KB)':>9}" + ''.join(f'{stage:>10}' for stage in STAGES) + f"{'peak(KB)':>10}")
+        print(f"{'':<21}" + ''.join(f"{'(ms)':>10}" for _ in STAGES))
+        for title, content in fixtures.items():
+            timings, peak = _measure(app_main, client, title, content, args.repeat)
+            print(f"{title:<12}{len(content.encode('utf-8')) / 1024:>9.0f}"
+                  + ''.join(f'{timings[stage] * 1000:>10.2f}' for stage in STAGES)
+                  + f'{peak / 1024:>10.0f}')
+        print(f"stub requests: {stub.requests} (304: {stub.not_modified})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""/proxy の応答の大きさと最初の1バイトまでの時間（TTFB）を、圧縮・ストリーミングの有無で比較するベンチマーク
+
+スタブのWikipedia（bench/stub_wikipedia.py）を取得先にしたアプリをプロセス内のHTTPサーバーで動かし、
+http.client で実際にリクエストを送って測る。
+- buffered: 変更前の /proxy と同じく、全体を加工してから無圧縮で一度に返す（比較用のルート）
+- stream:   キャッシュに無いページをサニタイズしながら送る（無圧縮 / gzip / br）
+- cached:   キャッシュ済みのページ（圧縮済みの本文をそのまま返す）
+br は brotli パッケージがインストールされている場合のみ測る。
+
+計測の前に、iter_sanitize() の出力が sanitize() と一致するか（区切りをまたぐタイトルも隠されるか）を
+両モードで確かめ、一致しない場合は終了する。小さな記事ではすべての区切りの大きさを、
+フィクスチャでは2のべき乗の大きさを確かめる。
+
+使い方: python bench/bench_proxy_compression.py [--repeat N]
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import generate_article, load_fixtures  # noqa: E402
+from bench.stub_wikipedia import StubWikipedia  # noqa: E402
+from sanitizer import create_sanitizer, sanitize_html  # noqa: E402
+
+# 区切りの大きさをすべて確かめる小さな記事（複数文字のタイトルが区切りをまたぐ場合を含める）
+CHECK_ARTICLE = generate_article('東京都', 1)
+
+
+def _chunk_sizes(length):
+    """2のべき乗の区切りの大きさ（記事全体を1回で読む大きさまで）"""
+    sizes = []
+    size = 1
+    while size < length * 2:
+        sizes.append(size)
+        size *= 2
+    return sizes
+
+
+def check_streaming(content, chunk_sizes):
+    """iter_sanitize() の出力が sanitize() と異なる (モード, 区切りの大きさ) のリストを返す"""
+    mismatches = []
+    for mask_title in (False, True):
+        expected = sanitize_html(content, mask_title=mask_title)[0]
+        for chunk_size in chunk_sizes:
+            streamed = ''.join(create_sanitizer(content, mask_title=mask_title).iter_sanitize(content, chunk_size))
+            if streamed != expected:
+                mismatches.append(('guessing' if mask_title else 'navigation', chunk_size))
+    return mismatches
+
+
+def _request(port, path, encoding):
+    """(TTFB, 全体の時間, 受信した本文のバイト数) を返す"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        start = time.perf_counter()
+        conn.request('GET', path, headers={'Accept-Encoding': encoding})
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - start
+        rest = response.read()
+        total = time.perf_counter() - start
+        if response.status != 200:
+            raise RuntimeError(f'{path}: {response.status}')
+        return ttfb, total, len(first) + len(rest)
+    finally:
+        conn.close()
+
+
+def _best_of(measure, repeat):
+    results = [measure() for _ in range(repeat)]
+    return min(r[0] for r in results), min(r[1] for r in results), results[0][2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    checks = [('check', CHECK_ARTICLE, range(1, len(CHECK_ARTICLE) + 1))]
+    checks += [(title, content, _chunk_sizes(len(content))) for title, content in fixtures.items()]
+    for title, content, chunk_sizes in checks:
+        mismatches = check_streaming(content, chunk_sizes)
+        if mismatches:
+            sys.exit(f'{title}: ストリーミングの出力が sanitize() と一致しません {mismatches[:10]}')
+    print('iter_sanitize() == sanitize(): ok\n')
+
+    with StubWikipedia(fixtures) as stub:
+        os.environ['WIKIGAME_UPSTREAM_BASE_URL'] = stub.base_url
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main as app_main
+        from werkzeug.serving import make_server
+        from compression import supported_encodings
+
+        @app_main.app.route('/bench/proxy-buffered')
+        def proxy_buffered():
+            """変更前の /proxy と同じ返し方（比較用）"""
+            from flask import request
+            return app_main.render_page(request.args['url'], request.args.get('mode', 'navigation'))[0]
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app_main.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        def cold(path, encoding):
+            def measure():
+                app_main.page_cache.clear()
+                return _request(port, path, encoding)
+            return measure
+
+        print(f"{'fixture':<10}{'variant':<18}{'bytes(KB)':>10}{'ratio':>8}{'ttfb(ms)':>10}{'total(ms)':>11}")
+        for title in fixtures:
+            query = urlencode({'url': f'https://ja.wikipedia.org/wiki/{title}'})
+            proxy_path = f'/proxy?{query}'
+            cases = [('buffered', cold(f'/bench/proxy-buffered?{query}', 'identity'))]
+            for encoding in ('identity',) + supported_encodings():
+                cases.append((f'stream {encoding}', cold(proxy_path, encoding)))
+            for encoding in ('identity',) + supported_encodings():
+                cases.append((f'cached {encoding}', lambda encoding=encoding: _request(port, proxy_path, encoding)))
+            baseline = None
+            for name, measure in cases:
+                ttfb, total, size = _best_of(measure, args.repeat)
+                baseline = baseline or size
+                print(f"{title:<10}{name:<18}{size / 1024:>10.1f}{size / baseline:>8.2f}"
+                      f"{ttfb * 1000:>10.1f}{total * 1000:>11.1f}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""旧来の2回パースのBeautifulSoup処理と、1回走査のsanitizerを比較するベンチマーク
+
+使い方: python bench/bench_sanitizer.py [--repeat N]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from bench.fixtures import load_fixtures  # noqa: E402
+from sanitizer import sanitize_html  # noqa: E402
+
+
+def legacy_sanitize(content):
+    """変更前の proxy() と同じ処理（比較用）"""
+    content = content.replace('href="/w/', 'href="https://ja.wikipedia.org/w/')
+    content = content.replace('href="/static/', 'href="https://ja.wikipedia.org/static/')
+    soup = BeautifulSoup(content, 'html.parser')
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    for tag in soup.find_all(True):
+        attrs_to_remove = []
+        for attr_name, attr_value in tag.attrs.items():
+            if attr_name.lower().startswith('on'):
+                attrs_to_remove.append(attr_name)
+            elif attr_name.lower() in ['href', 'src', 'action', 'formaction'] and \
+                 isinstance(attr_value, str) and attr_value.lower().startswith('javascript:'):
+                attrs_to_remove.append(attr_name)
+        for attr_name in attrs_to_remove:
+            del tag[attr_name]
+    for a_tag in soup.find_all('a', href=True):
+        if a_tag['href'].startswith('/wiki/'):
+            a_tag['href'] = f"https://ja.wikipedia.org{a_tag['href']}"
+    content = str(soup)
+    soup_for_removal = BeautifulSoup(content, 'html.parser')
+    for class_name in ['vector-header-container', 'mw-footer-container', 'vector-page-toolbar', 'mw-editsection']:
+        for div in soup_for_removal.find_all('div', class_=class_name):
+            div.decompose()
+    for div in soup_for_removal.find_all('div', id='p-lang-btn'):
+        div.decompose()
+    return str(soup_for_removal)
+
+
+def _attr_value(name, value):
+    if isinstance(value, list):
+        value = ' '.join(value)
+    # BeautifulSoupは出力時に meta charset を小文字に書き換える
+    return value.lower() if name == 'charset' else value
+
+
+def _signature(html):
+    """出力の同等性比較用に、表示テキストと属性の集合を取り出す"""
+    soup = BeautifulSoup(html, 'html.parser')
+    text = re.sub(r'\s+', ' ', soup.get_text()).strip()
+    tags = sorted(
+        (tag.name, tuple(sorted((k, _attr_value(k, v)) for k, v in tag.attrs.items())))
+        for tag in soup.find_all(True)
+    )
+    return text, tags
+
+
+def _best_of(func, content, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'fixture':<12}{'size(KB)':>10}{'legacy(ms)':>12}{'single(ms)':>12}{'speedup':>9}  equivalent")
+    for name, content in load_fixtures().items():
+        legacy_html = legacy_sanitize(content)
+        new_html, _ = sanitize_html(content)
+        equivalent = _signature(legacy_html) == _signature(new_html)
+        legacy_time = _best_of(legacy_sanitize, content, args.repeat)
+        new_time = _best_of(sanitize_html, content, args.repeat)
+        print(f"{name:<12}{len(content.encode('utf-8')) / 1024:>10.0f}{legacy_time * 1000:>12.1f}"
+              f"{new_time * 1000:>12.1f}{legacy_time / new_time:>8.1f}x  {equivalent}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""状態ストア（メモリ / Redis）の1イベントあたりの処理時間と、複数ワーカーでの整合性を確認するベンチマーク
+
+ワーカープロセスを RedisStore のインスタンスで模擬し、同じゲームの別々のプレイヤーの移動を
+複数のワーカー・スレッドから同時に処理する。ルームごとのロックが効いていれば、
+最後に読み直したゲーム状態の移動回数の合計が処理したイベント数と一致する。
+
+--redis-url を省略すると fakeredis（pip install fakeredis）のサーバーをプロセス内で使う。
+
+使い方: python bench/bench_state_store.py [--redis-url redis://localhost:6379/15] [--events N]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import GameState, Room  # noqa: E402
+from state_store import MemoryStore, RedisStore  # noqa: E402
+
+ROOM_ID = 'bench0001'
+START_URL = 'https://ja.wikipedia.org/wiki/雨'
+TARGET_URL = 'https://ja.wikipedia.org/wiki/日本'
+
+
+def _client_factory(redis_url):
+    if redis_url:
+        import redis
+        return lambda: redis.Redis.from_url(redis_url)
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit('fakeredis が必要です（pip install fakeredis）。または --redis-url を指定してください')
+    server = fakeredis.FakeServer()
+    return lambda: fakeredis.FakeRedis(server=server)
+
+
+def _setup(store, player_ids):
+    rooms = store.mapping('rooms', Room, locked=True)
+    game_states = store.mapping('game_states', GameState, locked=True)
+    room = Room(ROOM_ID, 'bench', player_ids[0])
+    for player_id in player_ids:
+        room.add_player(player_id, player_id)
+    rooms[ROOM_ID] = room
+    game_states[ROOM_ID] = GameState(START_URL, TARGET_URL, player_ids, started_at=time.time())
+    store.flush()
+
+
+def _move_events(store, player_id, count):
+    """main.handle_player_move と同じ読み書きを count 回行う"""
+    rooms = store.mapping('rooms', Room, locked=True)
+    game_states = store.mapping('game_states', GameState, locked=True)
+    for i in range(count):
+        rooms[ROOM_ID]
+        game_state = game_states[ROOM_ID]
+        game_state.player_states[player_id].move_to(f'https://ja.wikipedia.org/wiki/記事{i}')
+        game_state.version += 1
+        store.flush()
+
+
+def _run(stores, players_per_worker, events):
+    player_ids = [f'player{w}-{p}' for w in range(len(stores)) for p in range(players_per_worker)]
+    _setup(stores[0], player_ids)
+    threads = []
+    for w, store in enumerate(stores):
+        for p in range(players_per_worker):
+            threads.append(threading.Thread(target=_move_events, args=(store, f'player{w}-{p}', events)))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    game_state = stores[0].mapping('game_states', GameState, locked=True)[ROOM_ID]
+    total_moves = sum(state.moves for state in game_state.player_states.values())
+    stores[0].flush()
+    return elapsed, len(threads) * events, total_moves, game_state.version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--redis-url')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--players', type=int, default=4, help='ワーカーごとのプレイヤー（スレッド）数')
+    parser.add_argument('--events', type=int, default=200, help='プレイヤーごとの移動回数')
+    args = parser.parse_args()
+
+    make_client = _client_factory(args.redis_url)
+    if args.redis_url:
+        make_client().delete('wikigame:rooms', 'wikigame:game_states')
+
+    print(f"{'backend':<10}{'workers':>8}{'events':>8}{'per event(us)':>15}{'moves':>8}{'version':>9}  consistent")
+    results = [('memory', 1, _run([MemoryStore()], args.players, args.events))]
+    stores = [RedisStore(client=make_client()) for _ in range(args.workers)]
+    results.append(('redis', args.workers, _run(stores, args.players, args.events)))
+    for backend, workers, (elapsed, events, moves, version) in results:
+        print(f"{backend:<10}{workers:>8}{events:>8}{elapsed / events * 1e6:>15.1f}{moves:>8}{version:>9}"
+              f"  {'yes' if moves == version == events else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
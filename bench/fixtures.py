@@ -0,0 +1,135 @@
+"""ベンチマーク用のWikipedia記事フィクスチャ
+
+bench/fixtures/ に保存済みの記事HTML（*.html）があればそれを使い、
+無い場合はVector 2022スキンと同じ構造の記事HTMLを決定的に生成する。
+
+ネットワークに接続できる環境で実行すると、実際の記事を bench/fixtures/ に保存する。
+
+使い方: python bench/fixtures.py [タイトル ...]（省略時は 雨 東京都 日本）
+"""
+import argparse
+import os
+import random
+import sys
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 生成する記事の名前と段落数（小・中央値・日本のような巨大記事）
+GENERATED_SIZES = {
+    '雨': 15,
+    '東京都': 120,
+    '日本': 900,
+}
+
+_WORDS = ['日本', '東京', '歴史', '文化', '経済', '政治', '地理', '人口', '言語', '宗教',
+          '江戸時代', '明治', '天皇', '国会', '北海道', '沖縄県', '太平洋', '富士山']
+
+
+def _section(rng, title, index):
+    links = '、'.join(
+        f'<a href="/wiki/{word}" title="{word}">{word}</a>' for word in rng.sample(_WORDS, 5)
+    )
+    return (
+        f'<div class="mw-heading mw-heading2"><h2 id="s{index}">節{index}</h2>'
+        f'<span class="mw-editsection"><span class="mw-editsection-bracket">[</span>'
+        f'<a href="/w/index.php?title={title}&amp;action=edit&amp;section={index}" title="節を編集">編集</a>'
+        f'<span class="mw-editsection-bracket">]</span></span></div>\n'
+        f'<p>{title}（にほん）は{links}などと関係がある。{title}の{rng.choice(_WORDS)}は'
+        f'<a href="/wiki/{rng.choice(_WORDS)}_(曖昧さ回避)" title="x">ここ</a>を参照 &amp; 注記'
+        f'<sup id="cite_ref-{index}" class="reference"><a href="#cite_note-{index}">[{index}]</a></sup>。</p>\n'
+        f'<figure typeof="mw:File/Thumb"><a href="/wiki/ファイル:{index}.jpg" class="mw-file-description">'
+        f'<img src="//upload.wikimedia.org/{index}.jpg" decoding="async" width="220" height="147" '
+        f'onerror="this.remove()"></a><figcaption>{title}の写真</figcaption></figure>\n'
+    )
+
+
+def generate_article(title, sections, seed=0):
+    """Vector 2022スキンに近い構造の記事HTMLを生成する"""
+    rng = random.Random(seed)
+    body = ''.join(_section(rng, title, i) for i in range(sections))
+    return f'''<!DOCTYPE html>
+<html class="client-nojs vector-feature-language-in-header-enabled" lang="ja" dir="ltr">
+<head>
+<meta charset="UTF-8">
+<title>{title} - Wikipedia</title>
+<script>document.documentElement.className="client-js";RLCONF={{"wgTitle":"{title}"}};</script>
+<script>(RLQ=window.RLQ||[]).push(function(){{mw.loader.impl(function(){{return["<div>"]}});}});</script>
+<link rel="stylesheet" href="/w/load.php?lang=ja&amp;modules=skins.vector.styles&amp;only=styles&amp;skin=vector-2022">
+<style>.mw-parser-output .hatnote{{font-style:italic}}</style>
+<meta property="og:title" content="{title} - Wikipedia">
+<link rel="icon" href="/static/favicon/wikipedia.ico">
+</head>
+<body class="skin-vector skin-vector-search-vue mediawiki ltr sitedir-ltr mw-hide-empty-elt ns-0 ns-subject page-{title}">
+<a class="mw-jump-link" href="#bodyContent">コンテンツにスキップ</a>
+<div class="vector-header-container">
+<header class="vector-header mw-header"><div class="vector-header-start"><a href="/wiki/メインページ" class="mw-logo">Wikipedia</a></div>
+<div class="vector-header-end"><div id="p-search" class="vector-search-box"><form action="/w/index.php" id="searchform"><input type="search" name="search" onfocus="x()"></form></div></div></header>
+</div>
+<div class="mw-page-container">
+<div class="mw-page-container-inner">
+<div class="vector-sitenotice-container"><div id="siteNotice"></div></div>
+<div class="vector-column-start"><div class="vector-main-menu-container"><nav id="mw-panel"><a href="/wiki/特別:おまかせ表示">おまかせ表示</a></nav></div></div>
+<div class="mw-content-container">
+<main id="content" class="mw-body">
+<header class="mw-body-header vector-page-titlebar">
+<h1 id="firstHeading" class="firstHeading mw-first-heading"><span class="mw-page-title-main">{title}</span></h1>
+<div id="p-lang-btn" class="vector-dropdown mw-portlet mw-portlet-lang"><a href="javascript:void(0)" class="mw-interlanguage-selector">言語</a></div>
+</header>
+<div class="vector-page-toolbar"><div class="vector-page-toolbar-container"><nav><a href="/wiki/ノート:{title}" rel="discussion">ノート</a></nav></div></div>
+<div id="bodyContent" class="vector-body">
+<div id="mw-content-text" class="mw-body-content"><div class="mw-content-ltr mw-parser-output" lang="ja" dir="ltr">
+<p><b>{title}</b>（にほん、nihon）は、本記事の主題である。</p>
+{body}
+<div class="mw-editsection">[編集]</div>
+<!-- NewPP limit report -->
+</div></div>
+<div id="catlinks" class="catlinks"><a href="/wiki/Category:{title}">カテゴリ</a></div>
+</div>
+</main>
+</div>
+<div class="mw-footer-container"><footer id="footer" class="mw-footer"><ul><li>最終更新</li></ul></footer></div>
+</div>
+</div>
+<script>(RLQ=window.RLQ||[]).push(function(){{mw.config.set({{"wgBackendResponseTime":120}});}});</script>
+</body>
+</html>
+'''
+
+
+def load_fixtures():
+    """{名前: HTML} の辞書を返す"""
+    fixtures = {}
+    if os.path.isdir(FIXTURE_DIR):
+        for name in sorted(os.listdir(FIXTURE_DIR)):
+            if name.endswith('.html'):
+                with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+                    fixtures[name[:-len('.html')]] = f.read()
+    if not fixtures:
+        for seed, (title, sections) in enumerate(GENERATED_SIZES.items()):
+            fixtures[title] = generate_article(title, sections, seed=seed)
+    return fixtures
+
+
+def save_fixtures(titles):
+    """ja.wikipedia.org から記事を取得して bench/fixtures/<タイトル>.html に保存する"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from upstream import UpstreamClient
+
+    client = UpstreamClient()
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    try:
+        for title in titles:
+            response = client.get(f'https://ja.wikipedia.org/wiki/{title}')
+            response.raise_for_status()
+            path = os.path.join(FIXTURE_DIR, f'{title}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(response.text)
+            print(f"{title}: {len(response.content) / 1024:.0f}KB -> {path}")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('titles', nargs='*', default=list(GENERATED_SIZES))
+    save_fixtures(parser.parse_args().titles)
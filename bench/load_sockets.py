@@ -0,0 +1,261 @@
+"""Socket.IOのイベントの負荷試験（ルーム数を増やしたときのスループット・往復時間・サーバーのメモリ）
+
+スタブのWikipedia（bench/stub_wikipedia.py）を取得先にしたサーバーを別プロセスで起動し、
+python-socketio の AsyncClient でプレイヤーを模擬する。ルームごとに
+create_room → join_room →（toggle_ready → start_game → player_move × moves → player_give_up
+→ ゴールへの player_move → reset_room）× rounds の順にイベントを送る。
+
+各イベントはackを要求して送り、ハンドラーが処理を終えてackが返るまでの時間を往復時間とする。
+--rooms の段階ごとにルームを追加し（作成済みのルームと接続は維持する）、その段階で送った
+イベントのスループット、往復時間の p50/p95/p99、エラー数、サーバーのRSS（/proc から取得）を表示する。
+
+クライアントには aiohttp が必要（pip install "python-socketio[asyncio_client]"）。
+1万ルームでは数万の接続を張るため、サーバーは --async-mode eventlet か gevent で動かし、
+ファイルディスクリプタの上限（ulimit -n）を十分に上げておくこと。
+--url を指定すると起動済みのサーバーに接続する（RSSは --server-pid を指定した場合のみ表示）。
+
+使い方: python bench/load_sockets.py [--rooms 10,100,1000,10000] [--players 2] [--moves 5] [--rounds 1]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TARGET_URL = 'https://ja.wikipedia.org/wiki/日本'
+MOVE_URLS = ['https://ja.wikipedia.org/wiki/雨', 'https://ja.wikipedia.org/wiki/東京都']
+PERCENTILES = (50, 95, 99)
+
+
+def serve(host, port):
+    """負荷試験用のサーバー（main.py の起動処理からデバッグモードを除いたもの）"""
+    import main as app_main  # WIKIGAME_ASYNC_MODE に応じたモンキーパッチを最初に行う
+
+    app_main.random_page_pool.start()
+    for task in (app_main.build_answer_index, app_main.link_store_maintenance, app_main.lobby_broadcaster,
+                 app_main.room_sweeper_loop, app_main.spectator_broadcaster):
+        app_main.socketio.start_background_task(task)
+    app_main.socketio.run(app_main.app, host=host, port=port, debug=False, use_reloader=False,
+                          log_output=False, allow_unsafe_werkzeug=True)
+
+
+def _raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'サーバーが終了しました（終了コード {process.returncode}）')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit('サーバーが起動しませんでした')
+
+
+def _rss_mb(pid):
+    """プロセスのRSS（MB）。取得できない場合は None"""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+class LoadStats:
+    """イベントごとの往復時間とエラー数"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """段階ごとに集計し直す（プレイヤーは同じインスタンスに記録し続ける）"""
+        self.latencies = {}  # イベント名 -> 往復時間（秒）のリスト
+        self.errors = 0
+        self.timeouts = 0
+
+    def record(self, event, elapsed):
+        self.latencies.setdefault(event, []).append(elapsed)
+
+    def all_latencies(self):
+        return sorted(value for values in self.latencies.values() for value in values)
+
+    def events(self):
+        return sum(len(values) for values in self.latencies.values())
+
+
+class Player:
+    """1人のプレイヤー（Socket.IOの接続1本）"""
+
+    def __init__(self, stats):
+        import socketio
+        self.stats = stats
+        self.room_id = None
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.client.on('room_created', self._on_room_created)
+        self.client.on('error', self._on_error)
+
+    async def _on_room_created(self, data):
+        self.room_id = data['room_id']
+
+    async def _on_error(self, data):
+        self.stats.errors += 1
+
+    async def connect(self, url):
+        await self.client.connect(url, transports=['websocket'])
+
+    async def call(self, event, data=None, timeout=30):
+        import socketio
+        start = time.perf_counter()
+        try:
+            await self.client.call(event, data, timeout=timeout)
+        except socketio.exceptions.TimeoutError:
+            self.stats.timeouts += 1
+            return
+        self.stats.record(event, time.perf_counter() - start)
+
+
+async def _open_room(url, players, stats):
+    """ルームを作成して全員を参加させ、(ルームID, プレイヤーのリスト) を返す"""
+    clients = [Player(stats) for _ in range(players)]
+    for client in clients:
+        await client.connect(url)
+    host = clients[0]
+    await host.call('create_room', {'username': 'host', 'tournament': players > 4, 'max_players': players})
+    for i, client in enumerate(clients[1:], 1):
+        await client.call('join_room', {'room_id': host.room_id, 'username': f'player{i}'})
+    return host.room_id, clients
+
+
+async def _play_round(room_id, clients, moves):
+    """1ゲーム分のイベントを送り、ゲームを終了させてからリセットする"""
+    import asyncio
+    host, guests = clients[0], clients[1:]
+    for guest in guests:
+        await guest.call('toggle_ready')
+    await host.call('start_game')
+
+    async def wander(client):
+        for i in range(moves):
+            await client.call('player_move', {'url': MOVE_URLS[i % len(MOVE_URLS)]})
+
+    await asyncio.gather(*(wander(client) for client in clients))
+    for guest in guests:
+        await guest.call('player_give_up', {'room_id': room_id})
+    await host.call('player_move', {'url': TARGET_URL})
+    await host.call('reset_room', {'room_id': room_id})
+
+
+async def _bounded(semaphore, coroutine):
+    async with semaphore:
+        return await coroutine
+
+
+async def _run(args, url, server_pid):
+    import asyncio
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rooms = []
+    stats = LoadStats()
+    print(f"{'rooms':>7}{'clients':>9}{'events':>9}{'events/s':>10}"
+          + ''.join(f"{f'p{p}(ms)':>10}" for p in PERCENTILES)
+          + f"{'errors':>8}{'timeouts':>9}{'rss(MB)':>9}")
+    for target in args.rooms:
+        stats.reset()
+        start = time.perf_counter()
+        rooms += await asyncio.gather(*(
+            _bounded(semaphore, _open_room(url, args.players, stats))
+            for _ in range(max(target - len(rooms), 0))
+        ))
+        for _ in range(args.rounds):
+            await asyncio.gather(*(
+                _bounded(semaphore, _play_round(room_id, clients, args.moves)) for room_id, clients in rooms
+            ))
+        elapsed = time.perf_counter() - start
+        latencies = stats.all_latencies()
+        rss = _rss_mb(server_pid)
+        print(f"{len(rooms):>7}{len(rooms) * args.players:>9}{stats.events():>9}{stats.events() / elapsed:>10.0f}"
+              + ''.join(f'{_percentile(latencies, p) * 1000:>10.1f}' for p in PERCENTILES)
+              + f"{stats.errors:>8}{stats.timeouts:>9}{'n/a' if rss is None else f'{rss:.0f}':>9}")
+
+    print(f"\nper event ({len(rooms)} rooms):")
+    print(f"{'event':<16}{'count':>8}" + ''.join(f"{f'p{p}(ms)':>10}" for p in PERCENTILES))
+    for event, values in stats.latencies.items():
+        values.sort()
+        print(f"{event:<16}{len(values):>8}" + ''.join(f'{_percentile(values, p) * 1000:>10.1f}' for p in PERCENTILES))
+
+    for _, clients in rooms:
+        for client in clients:
+            await client.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', default='10,100,1000,10000', help='段階ごとのルーム数（カンマ区切り）')
+    parser.add_argument('--players', type=int, default=2, help='ルームあたりのプレイヤー数')
+    parser.add_argument('--moves', type=int, default=5, help='1ゲームでのプレイヤーごとの移動回数')
+    parser.add_argument('--rounds', type=int, default=1, help='段階ごとに各ルームで遊ぶゲーム数')
+    parser.add_argument('--concurrency', type=int, default=200, help='同時に進めるルーム数の上限')
+    parser.add_argument('--async-mode', default='eventlet', help='サーバーの WIKIGAME_ASYNC_MODE')
+    parser.add_argument('--url', help='起動済みのサーバーのURL（省略時はスタブを使うサーバーを起動する）')
+    parser.add_argument('--server-pid', type=int, help='--url のサーバーのPID（RSSの表示用）')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=5500, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    _raise_fd_limit()
+
+    if args.serve:
+        serve('127.0.0.1', args.port)
+        return
+
+    import asyncio
+    args.rooms = [int(n) for n in args.rooms.split(',') if n.strip()]
+    if args.url:
+        asyncio.run(_run(args, args.url, args.server_pid))
+        return
+
+    from bench.stub_wikipedia import StubWikipedia
+    with StubWikipedia() as stub:
+        port = _free_port()
+        env = dict(os.environ, WIKIGAME_UPSTREAM_BASE_URL=stub.base_url, WIKIGAME_ASYNC_MODE=args.async_mode)
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                                  env=env, stdout=subprocess.DEVNULL)
+        try:
+            _wait_for_port(port, server)
+            print(f"server pid={server.pid} async_mode={args.async_mode} players/room={args.players} "
+                  f"moves={args.moves} rounds={args.rounds}")
+            asyncio.run(_run(args, f'http://127.0.0.1:{port}', server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""複数のルームで同時に移動イベントを送り、最終状態に矛盾が無いかを確認するストレステスト
+
+ルームごとに players 人のプレイヤーを用意し、全員がスレッドから同時に moves 回移動してから目標ページに到達する。
+すべてのイベントを処理した後、プレイヤーごとの移動回数・ゲーム状態のバージョン・順位表・
+game_finished の送信回数が送ったイベントと一致するかを確認する。
+
+--stripes 0 を指定するとルームごとのロックを無効にして比較できる。
+
+使い方: python bench/stress_rooms.py [--rooms N] [--players N] [--moves N] [--stripes N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+START_URL = 'https://ja.wikipedia.org/wiki/雨'
+TARGET_URL = 'https://ja.wikipedia.org/wiki/日本'
+
+
+def _received(client, name):
+    return [message for message in client.get_received() if message['name'] == name]
+
+
+def _setup_room(main, players):
+    """ルームを作成して全員を参加させ、ゲームを開始する"""
+    clients = [main.socketio.test_client(main.app) for _ in range(players)]
+    host = clients[0]
+    host.emit('create_room', {'username': 'host', 'tournament': True, 'max_players': players})
+    room_id = _received(host, 'room_created')[0]['args'][0]['room_id']
+    for i, client in enumerate(clients[1:], 1):
+        client.emit('join_room', {'room_id': room_id, 'username': f'player{i}'})
+        client.emit('toggle_ready')
+    host.emit('start_game')
+    for client in clients:
+        client.get_received()
+    return room_id, clients
+
+
+def _play(client, moves, barrier):
+    barrier.wait()
+    for i in range(moves):
+        client.emit('player_move', {'url': f'https://ja.wikipedia.org/wiki/記事{i}'})
+    client.emit('player_move', {'url': TARGET_URL})
+
+
+def _check_room(main, room_id, clients, moves):
+    """ルームの最終状態の矛盾を文字列のリストで返す"""
+    problems = []
+    game_state = main.game_states[room_id]
+    room = main.rooms[room_id]
+    players = len(clients)
+    for player_id, state in game_state.player_states.items():
+        if state.moves != moves + 1:
+            problems.append(f'{player_id}: moves={state.moves}')
+        if len(state.path) != min(moves + 2, state.max_path_length):
+            problems.append(f'{player_id}: path={len(state.path)}')
+    if game_state.version != players * (moves + 1):
+        problems.append(f'version={game_state.version} (expected {players * (moves + 1)})')
+    if len(game_state.leaderboard) != players or not game_state.finished or room.status != 'finished':
+        problems.append(f'leaderboard={len(game_state.leaderboard)} finished={game_state.finished}')
+    finished_events = len(_received(clients[0], 'game_finished'))
+    if finished_events != 1:
+        problems.append(f'game_finished sent {finished_events} times')
+    main.state_store.flush()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--moves', type=int, default=50)
+    parser.add_argument('--stripes', type=int, default=64, help='ロックのストライプ数（0 でロック無し）')
+    args = parser.parse_args()
+
+    os.environ['WIKIGAME_STATE_LOCK_STRIPES'] = str(args.stripes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main as app_main
+    # ネットワークに接続しないよう、スタートページと最短手数の計算を差し替える
+    app_main.random_page_pool.pop = lambda fallback=True: START_URL
+    app_main.solve_optimal_moves = lambda room_id, game_state: None
+    # スレッドの切り替えを頻繁にして競合を起こりやすくする
+    sys.setswitchinterval(1e-6)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rooms = [_setup_room(app_main, args.players) for _ in range(args.rooms)]
+        barrier = threading.Barrier(args.rooms * args.players)
+        threads = [
+            threading.Thread(target=_play, args=(client, args.moves, barrier))
+            for _, clients in rooms for client in clients
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    events = len(threads) * (args.moves + 1)
+    problems = {room_id: _check_room(app_main, room_id, clients, args.moves) for room_id, clients in rooms}
+    broken = {room_id: p for room_id, p in problems.items() if p}
+    print(f"stripes={args.stripes} rooms={args.rooms} players/room={args.players} events={events} "
+          f"time={elapsed:.2f}s ({events / elapsed:.0f} events/s)")
+    print(f"lock stats: {app_main.state_store.stats()}")
+    if broken:
+        print(f"inconsistent rooms: {len(broken)}/{len(rooms)}")
+        for room_id, room_problems in list(broken.items())[:5]:
+            print(f"  {room_id}: {', '.join(room_problems[:3])}")
+        sys.exit(1)
+    print(f"all {len(rooms)} rooms consistent")
+
+
+if __name__ == '__main__':
+    main()
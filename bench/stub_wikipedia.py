@@ -0,0 +1,166 @@
+"""フィクスチャの記事HTMLを返すスタブのWikipediaサーバー
+
+/wiki/<タイトル> にフィクスチャ（bench/fixtures.py の load_fixtures()）の記事を返す。
+記事には ETag / Last-Modified を付け、条件付きリクエストで変わっていなければ304を返す。
+/w/api.php はアプリが使うクエリ（ランダム記事・リンク・被リンク・opensearch）だけを
+フィクスチャの記事の間で答え、それ以外は404を返す。
+ベンチマークからはプロセス内で起動して使い、単体で起動した場合は
+WIKIGAME_UPSTREAM_BASE_URL にこのサーバーを指定してアプリをオフラインで動かせる。
+
+使い方: python bench/stub_wikipedia.py [--port 8765] [--latency 秒]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import load_fixtures  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-Aliveの接続プールをアプリと同じように使う
+
+    def do_GET(self):
+        stub = self.server.stub
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        if stub.latency:
+            time.sleep(stub.latency)
+        with stub.lock:
+            stub.requests += 1
+        if path.startswith('/wiki/') and path[len('/wiki/'):] in stub.pages:
+            body = stub.pages[path[len('/wiki/'):]]
+            etag = f'"{zlib.crc32(body):08x}"'
+            # Wikipediaと同じく検証子を付け、条件付きリクエストには304を返す
+            headers = {'ETag': etag, 'Last-Modified': stub.last_modified}
+            if self.headers.get('If-None-Match') == etag or \
+               (not self.headers.get('If-None-Match') and self.headers.get('If-Modified-Since') == stub.last_modified):
+                with stub.lock:
+                    stub.not_modified += 1
+                self._send(304, b'', None, headers)
+            else:
+                self._send(200, body, 'text/html; charset=UTF-8', headers)
+            return
+        result = stub.api(parse_qs(parts.query)) if path == '/w/api.php' else None
+        if result is None:
+            self._send(404, b'not found', 'text/plain; charset=utf-8')
+        else:
+            self._send(200, json.dumps(result, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubWikipedia:
+    """フィクスチャを返すHTTPサーバー（port=0 の場合は空いているポートを使う）"""
+
+    def __init__(self, fixtures=None, host='127.0.0.1', port=0, latency=0.0):
+        fixtures = load_fixtures() if fixtures is None else fixtures
+        # 応答ごとにエンコードしないよう、あらかじめバイト列にしておく
+        self.pages = {title: html.encode('utf-8') for title, html in fixtures.items()}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.last_modified = formatdate(usegmt=True)
+        self._random_titles = itertools.cycle(sorted(self.pages))
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self._thread = None
+
+    @staticmethod
+    def page_url(title):
+        return f'https://ja.wikipedia.org/wiki/{title}'
+
+    def api(self, query):
+        """MediaWiki APIの応答を返す（未対応のクエリは None）"""
+        def param(name):
+            return query.get(name, [''])[0]
+
+        titles = [title for title in param('titles').split('|') if title]
+        # フィクスチャの記事はお互いにリンクしているものとして扱う
+        others = [{'ns': 0, 'title': title} for title in sorted(self.pages)]
+        if param('action') == 'opensearch':
+            matched = [title for title in sorted(self.pages) if title.startswith(param('search'))]
+            return [param('search'), matched, ['' for _ in matched], [self.page_url(t) for t in matched]]
+        if param('generator') == 'random':
+            with self.lock:
+                chosen = [next(self._random_titles) for _ in range(int(param('grnlimit') or 10))]
+            return {'query': {'pages': {
+                str(i): {'pageid': i, 'ns': 0, 'title': title, 'fullurl': self.page_url(title),
+                         'length': len(self.pages[title])}
+                for i, title in enumerate(chosen, 1)
+            }}}
+        if param('prop') == 'links':
+            return {'query': {'pages': [
+                {'ns': 0, 'title': title, 'links': [o for o in others if o['title'] != title]}
+                for title in titles
+            ]}}
+        if param('prop') == 'linkshere':
+            return {'query': {'pages': [
+                {'ns': 0, 'title': title, 'linkshere': [o for o in others if o['title'] != title]}
+                for title in titles
+            ]}}
+        return None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='応答ごとに加える遅延（秒）')
+    args = parser.parse_args()
+
+    stub = StubWikipedia(host=args.host, port=args.port, latency=args.latency)
+    print(f"serving {len(stub.pages)} pages at {stub.base_url}/wiki/ ({', '.join(stub.pages)})")
+    print(f"WIKIGAME_UPSTREAM_BASE_URL={stub.base_url} python main.py")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import zlib
+
+try:
+    import brotli  # 任意（pip install brotli）。無い場合はgzipだけを使う
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 11 は圧縮率が高いが、初回の送信では時間がかかりすぎる
+
+
+def supported_encodings():
+    """優先する順の対応しているContent-Encoding"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encodings):
+    """Accept-Encoding（werkzeugの request.accept_encodings）から使う圧縮方式を選ぶ（圧縮しない場合は None）"""
+    for encoding in supported_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = StreamCompressor(encoding)
+    return compressor.compress(data, flush=False) + compressor.finish()
+
+
+class StreamCompressor:
+    """少しずつ送る本文を圧縮する（compress() ごとにフラッシュして、その時点までを送れるようにする）"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush=True):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + (self._compressor.flush() if flush else b'')
+        return self._compressor.compress(data) + (self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else b'')
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class RenderedPage:
+    """プロキシ済みページ（UTF-8の本文・タイトル・ETag）と、圧縮方式ごとの圧縮済みの本文"""
+
+    __slots__ = ('body', 'title', 'etag', 'variants')
+
+    def __init__(self, body, title, etag, variants=None):
+        self.body = body
+        self.title = title
+        self.etag = etag
+        self.variants = dict(variants or {})  # 圧縮方式 -> 圧縮済みの本文
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(data) for data in self.variants.values())
+
+    def variant(self, encoding):
+        """圧縮済みの本文を返す。まだ無い場合は圧縮して保存し、(本文, 新しく作ったか) を返す"""
+        data = self.variants.get(encoding)
+        if data is not None:
+            return data, False
+        data = self.variants[encoding] = compress(self.body, encoding)
+        return data, True
+
+    def etag_for(self, encoding):
+        return self.etag_for_encoding(self.etag, encoding)
+
+    @staticmethod
+    def etag_for_encoding(etag, encoding):
+        """表現（圧縮方式）ごとに異なる強いETag"""
+        return f'{etag}-{encoding}' if encoding else etag
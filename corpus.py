@@ -0,0 +1,127 @@
+import math
+import os
+import random
+import threading
+import time
+
+
+class _Deck:
+    """コーパスを重複なしで一巡するための山札
+
+    開始位置とコーパスサイズと互いに素な歩幅だけを持つので、
+    ルームごとに順列を保持するよりメモリが少なくて済む。
+    """
+
+    __slots__ = ('size', 'start', 'stride', 'drawn')
+
+    def __init__(self, size):
+        self.size = size
+        self.start = random.randrange(size)
+        self.stride = 1
+        if size > 2:
+            while True:
+                self.stride = random.randrange(1, size)
+                if math.gcd(self.stride, size) == 1:
+                    break
+        self.drawn = 0
+
+    def next_index(self):
+        index = (self.start + self.drawn * self.stride) % self.size
+        self.drawn += 1
+        return index
+
+
+class CorpusRegistry:
+    """難易度別のページURL一覧（gamedata/{difficulty}.txt）を保持するレジストリ
+
+    起動時に一度だけ読み込み、重複を除いた安全なURLだけをタプルとして保持する。
+    ファイルの更新時刻が変わった場合は次のアクセス時に自動で再読み込みする。
+    """
+
+    def __init__(self, directory, difficulties, url_filter=None, check_interval=2.0):
+        self.directory = directory
+        self.difficulties = tuple(difficulties)
+        self.url_filter = url_filter
+        self.check_interval = check_interval  # 更新時刻を確認する間隔（秒）
+        self._corpora = {}  # difficulty -> (mtime, タプル)
+        self._checked_at = {}
+        self._decks = {}  # key -> {difficulty: _Deck}
+        self._lock = threading.Lock()
+        for difficulty in self.difficulties:
+            self._load(difficulty)
+
+    def _path(self, difficulty):
+        return os.path.join(self.directory, f'{difficulty}.txt')
+
+    def _load(self, difficulty):
+        path = self._path(difficulty)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._corpora.pop(difficulty, None)
+            self._checked_at[difficulty] = time.monotonic()
+            return
+        with open(path, 'r', encoding='utf-8') as file:
+            urls = [line.strip() for line in file if line.strip()]
+        if self.url_filter:
+            valid_urls = [url for url in urls if self.url_filter(url)]
+            if len(valid_urls) != len(urls):
+                print(f"{path}: 無効なURLを{len(urls) - len(valid_urls)}件除外しました")
+            urls = valid_urls
+        # 重複を除いて保持する（一巡するまで同じページが出ないようにするため）
+        self._corpora[difficulty] = (mtime, tuple(dict.fromkeys(urls)))
+        self._checked_at[difficulty] = time.monotonic()
+
+    def _refresh(self, difficulty):
+        now = time.monotonic()
+        if now - self._checked_at.get(difficulty, 0) < self.check_interval:
+            return
+        self._checked_at[difficulty] = now
+        try:
+            mtime = os.stat(self._path(difficulty)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        current = self._corpora.get(difficulty)
+        if current is None or current[0] != mtime:
+            self._load(difficulty)
+
+    def get(self, difficulty):
+        """URLのタプルを返す。ファイルが存在しない場合は None"""
+        if difficulty not in self.difficulties:
+            return None
+        with self._lock:
+            self._refresh(difficulty)
+            corpus = self._corpora.get(difficulty)
+        return corpus[1] if corpus else None
+
+    def sample(self, difficulty, key=None):
+        """ランダムにURLを1件選ぶ
+
+        key（ルームIDなど）を指定すると、そのkeyではコーパスを一巡するまで
+        同じURLを返さない。ファイルが無いか空の場合は None。
+        """
+        urls = self.get(difficulty)
+        if not urls:
+            return None
+        if key is None:
+            return random.choice(urls)
+        with self._lock:
+            decks = self._decks.setdefault(key, {})
+            deck = decks.get(difficulty)
+            # 一巡した場合やコーパスのサイズが変わった場合は山札を作り直す
+            if deck is None or deck.size != len(urls) or deck.drawn >= deck.size:
+                deck = decks[difficulty] = _Deck(len(urls))
+            return urls[deck.next_index()]
+
+    def release(self, key):
+        """keyに紐づく山札を破棄する（ルーム削除時に呼ぶ）"""
+        with self._lock:
+            self._decks.pop(key, None)
+
+    def prune(self, live_keys):
+        """live_keys に無いkeyの山札を破棄し、破棄した件数を返す"""
+        with self._lock:
+            stale = [key for key in self._decks if key not in live_keys]
+            for key in stale:
+                del self._decks[key]
+        return len(stale)
@@ -0,0 +1,484 @@
+"""Wikipediaのダンプファイルから記事間リンクストアを作成するコマンドラインツール
+
+ネットワークには一切接続せず、ローカルのダンプファイルだけを読み込む。
+作成したファイルは main.py の WIKIGAME_LINK_STORE_PATH に指定して使う。
+
+使い方:
+    # pages-articles XML（.xml / .xml.bz2 / .xml.gz）から作成
+    python ingest_dump.py --xml jawiki-latest-pages-articles.xml.bz2 -o data/linkgraph.wgls
+
+    # SQLダンプ（page / redirect / pagelinks、新形式では linktarget も）から作成
+    python ingest_dump.py --page jawiki-latest-page.sql.gz --redirect jawiki-latest-redirect.sql.gz \\
+        --pagelinks jawiki-latest-pagelinks.sql.gz --linktarget jawiki-latest-linktarget.sql.gz \\
+        -o data/linkgraph.wgls
+"""
+import argparse
+import bz2
+import gzip
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import deque
+
+from linkstore import IN_KNOWN, OUT_KNOWN, write_link_store
+
+CHUNK_PAGES = 500  # XMLモードで1つのワーカーにまとめて渡すページ数
+READ_CHUNK_EDGES = 1 << 20  # 一時ファイルから一度に読み込むリンク数
+
+# [[リンク先#節|表示名]] のリンク先部分
+WIKILINK_RE = re.compile(r'\[\[\s*([^\[\]\|#<>{}\n]+?)\s*(?:#[^\]\|]*)?(?:\|[^\]]*)?\]\]')
+# 標準名前空間以外への接頭辞（日本語版の名前空間名と別名）
+NAMESPACE_PREFIXES = frozenset(name.lower() for name in [
+    'Media', 'メディア', 'Special', '特別', 'Talk', 'ノート', 'User', '利用者', 'User talk', '利用者‐会話',
+    'Wikipedia', 'Project', 'WP', 'Wikipedia talk', 'Wikipedia‐ノート', 'File', 'Image', 'ファイル', '画像',
+    'File talk', 'ファイル‐ノート', 'MediaWiki', 'MediaWiki talk', 'MediaWiki‐ノート', 'Template', 'Template talk',
+    'Template‐ノート', 'Help', 'ヘルプ', 'Help talk', 'Help‐ノート', 'Category', 'カテゴリ', 'Category talk',
+    'Category‐ノート', 'Portal', 'Portal talk', 'Portal‐ノート', 'プロジェクト', 'プロジェクト‐ノート',
+    'Module', 'モジュール', 'Module talk', 'モジュール‐ノート', 'Draft', 'Draft talk',
+    'wikt', 'wiktionary', 'commons', 'meta', 'species', 'b', 'n', 'q', 's', 'v', 'voy', 'mw', 'd', 'wikidata',
+])
+
+
+def normalize_title(title):
+    """リンク先の表記を記事タイトルの形式（先頭大文字・空白区切り）に揃える"""
+    title = ' '.join(title.replace('_', ' ').split())
+    if not title:
+        return None
+    return title[0].upper() + title[1:]
+
+
+def is_article_link(target):
+    """標準名前空間の記事へのリンクかどうか"""
+    if target.startswith(':'):
+        return False
+    prefix, colon, _ = target.partition(':')
+    if not colon:
+        return True
+    # 言語間リンク（en:Japan など）は「Re:ゼロ」のような記事名と区別できないため、
+    # ここでは除外せず、存在しない記事として解決時に落とす
+    return prefix.strip().lower() not in NAMESPACE_PREFIXES
+
+
+def extract_links(text):
+    """ウィキテキストから記事へのリンク先タイトルを取り出す"""
+    links = []
+    for match in WIKILINK_RE.finditer(text):
+        target = match.group(1)
+        if is_article_link(target):
+            title = normalize_title(target)
+            if title:
+                links.append(title)
+    return links
+
+
+def _extract_links_chunk(pages):
+    return [(title, extract_links(text)) for title, text in pages]
+
+
+def open_dump(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class Progress:
+    """処理件数と速度を定期的に表示する"""
+
+    def __init__(self, label, interval=5.0):
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.started_at = time.monotonic()
+        self._reported_at = self.started_at
+
+    def add(self, count=1):
+        self.count += count
+        now = time.monotonic()
+        if now - self._reported_at >= self.interval:
+            self._reported_at = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        suffix = ' (完了)' if final else ''
+        print(f"[{self.label}] {self.count:,} 件 {elapsed:.1f}秒 {self.count / elapsed:,.0f} 件/秒{suffix}",
+              file=sys.stderr, flush=True)
+
+
+class GraphBuilder:
+    """記事IDを割り当て、出リンクを一時ファイルに書き出してCSRを組み立てる
+
+    出リンクは記事IDの昇順に追加する必要がある（ダンプの並び順をそのまま使う）。
+    """
+
+    def __init__(self, tmp_dir=None):
+        self.titles = []
+        self.ids = {}
+        self.is_redirect = bytearray()
+        self.redirects = {}  # リダイレクト元ID -> リダイレクト先タイトル
+        self._edges = tempfile.TemporaryFile(dir=tmp_dir)
+        self.out_offsets = array('Q', [0])
+        self.in_degree = None
+        self._buffer = array('I')
+
+    def add_title(self, title, redirect=False):
+        node_id = self.ids.get(title)
+        if node_id is None:
+            node_id = self.ids[title] = len(self.titles)
+            self.titles.append(title)
+            self.is_redirect.append(1 if redirect else 0)
+        return node_id
+
+    def resolve_redirects(self):
+        """リダイレクト先をIDに変換する（二重リダイレクトも辿る）"""
+        resolved = {}
+        for source_id, target_title in self.redirects.items():
+            target_id = self.ids.get(target_title)
+            seen = {source_id}
+            while target_id is not None and self.is_redirect[target_id] and target_id not in seen:
+                seen.add(target_id)
+                next_title = self.redirects.get(target_id)
+                target_id = self.ids.get(next_title) if isinstance(next_title, str) else None
+            if target_id is not None and not self.is_redirect[target_id]:
+                resolved[source_id] = target_id
+        self.redirects = resolved
+        self.in_degree = array('I', bytes(4 * len(self.titles)))
+
+    def resolve(self, title):
+        """タイトルを記事IDに変換する。リダイレクトは転送先に置き換え、存在しない記事は None"""
+        node_id = self.ids.get(title)
+        if node_id is None:
+            return None
+        return self.redirects.get(node_id, node_id)
+
+    def set_outlinks(self, node_id, target_ids):
+        """node_id の出リンクを確定させる（前回から間が空いた記事はリンク無しとして扱う）"""
+        while len(self.out_offsets) <= node_id:
+            self.out_offsets.append(self.out_offsets[-1])
+        targets = sorted(set(target_ids) - {node_id})
+        self._buffer.extend(targets)
+        for target_id in targets:
+            self.in_degree[target_id] += 1
+        self.out_offsets.append(self.out_offsets[-1] + len(targets))
+        if len(self._buffer) >= READ_CHUNK_EDGES:
+            self._flush()
+
+    def _flush(self):
+        self._buffer.tofile(self._edges)
+        self._buffer = array('I')
+
+    def _read_out_targets(self):
+        self._edges.seek(0)
+        while True:
+            chunk = array('I')
+            try:
+                chunk.fromfile(self._edges, READ_CHUNK_EDGES)
+            except EOFError:
+                pass
+            if not chunk:
+                break
+            yield chunk
+
+    def write(self, output_path):
+        self._flush()
+        n_titles = len(self.titles)
+        while len(self.out_offsets) <= n_titles:
+            self.out_offsets.append(self.out_offsets[-1])
+        n_edges = self.out_offsets[-1]
+
+        print(f"逆リンクを構築中（{n_titles:,} 記事, {n_edges:,} リンク）", file=sys.stderr, flush=True)
+        in_offsets = array('Q', [0])
+        for degree in self.in_degree:
+            in_offsets.append(in_offsets[-1] + degree)
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_path))) as in_file:
+            in_file.truncate(max(n_edges * 4, 4))
+            with mmap.mmap(in_file.fileno(), max(n_edges * 4, 4)) as mapped:
+                in_targets = memoryview(mapped).cast('I')
+                cursor = array('Q', in_offsets[:-1])
+                source_id = 0
+                edge_index = 0
+                for chunk in self._read_out_targets():
+                    for target_id in chunk:
+                        while self.out_offsets[source_id + 1] <= edge_index:
+                            source_id += 1
+                        in_targets[cursor[target_id]] = source_id
+                        cursor[target_id] += 1
+                        edge_index += 1
+                in_chunks = [in_targets[:n_edges]]
+
+                encoded = [title.encode('utf-8') for title in self.titles]
+                title_offsets = array('Q', [0])
+                for data in encoded:
+                    title_offsets.append(title_offsets[-1] + len(data))
+                title_order = array('I', sorted(range(n_titles), key=encoded.__getitem__))
+                flags = bytes([OUT_KNOWN | IN_KNOWN]) * n_titles
+                redirect_src = array('I', sorted(self.redirects))
+                redirect_dst = array('I', (self.redirects[source] for source in redirect_src))
+                write_link_store(output_path, title_offsets, encoded, title_order, flags,
+                                 (self.out_offsets, self._read_out_targets()), (in_offsets, in_chunks),
+                                 (redirect_src, redirect_dst))
+                for chunk in in_chunks:
+                    chunk.release()
+                in_targets.release()
+        self._edges.close()
+
+
+# --- pages-articles XML ---
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_xml_pages(path, with_text):
+    """XMLダンプから標準名前空間のページを (タイトル, リダイレクト先, 本文) で順に返す"""
+    with open_dump(path) as file:
+        title = namespace = redirect = text = None
+        for event, element in ET.iterparse(file, events=('end',)):
+            name = _local_name(element.tag)
+            if name == 'title':
+                title = element.text
+            elif name == 'ns':
+                namespace = element.text
+            elif name == 'redirect':
+                redirect = element.get('title')
+            elif name == 'text' and with_text:
+                text = element.text or ''
+            elif name == 'page':
+                if namespace == '0' and title:
+                    yield title, redirect, text
+                title = namespace = redirect = text = None
+                element.clear()
+            elif name in ('revision', 'siteinfo'):
+                element.clear()
+
+
+def ingest_xml(path, builder, workers):
+    # 1回目: 記事タイトルとリダイレクトを集めてIDを割り当てる
+    progress = Progress('XML 1/2 タイトル')
+    for title, redirect, _ in iter_xml_pages(path, with_text=False):
+        node_id = builder.add_title(title, redirect=bool(redirect))
+        if redirect:
+            builder.redirects[node_id] = normalize_title(redirect.split('#', 1)[0])
+        progress.add()
+    progress.report(final=True)
+    builder.resolve_redirects()
+
+    # 2回目: 本文からリンクを取り出す（複数プロセスで並列に解析）
+    progress = Progress('XML 2/2 リンク')
+
+    def chunks():
+        chunk = []
+        for title, redirect, text in iter_xml_pages(path, with_text=True):
+            if redirect:
+                continue
+            chunk.append((title, text))
+            if len(chunk) >= CHUNK_PAGES:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    for results in _bounded_map(_extract_links_chunk, chunks(), workers):
+        for title, links in results:
+            builder.set_outlinks(builder.ids[title], [target_id for target_id in map(builder.resolve, links)
+                                                       if target_id is not None])
+        progress.add(len(results))
+    progress.report(final=True)
+
+
+# --- SQLダンプ ---
+
+SQL_TOKEN_RE = re.compile(r"\(|\)|'(?:[^'\\]|\\.)*'|[^,()'\s]+")
+SQL_ESCAPE_RE = re.compile(r'\\(.)')
+SQL_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def _sql_value(token):
+    if token.startswith("'"):
+        return SQL_ESCAPE_RE.sub(lambda m: SQL_ESCAPES.get(m.group(1), m.group(1)), token[1:-1])
+    if token == 'NULL':
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        return token
+
+
+def parse_insert_rows(line):
+    """INSERT INTO ... VALUES (...),(...); の行から値のタプルを順に返す"""
+    start = line.find(' VALUES ')
+    if not line.startswith('INSERT INTO') or start < 0:
+        return
+    row = None
+    for match in SQL_TOKEN_RE.finditer(line, start + len(' VALUES ')):
+        token = match.group()
+        if token == '(':
+            row = []
+        elif token == ')':
+            if row is not None:
+                yield tuple(row)
+            row = None
+        elif row is not None:
+            row.append(_sql_value(token))
+
+
+def _parse_page_line(line):
+    # page_id, page_namespace, page_title, page_is_redirect, ...
+    return [(row[0], row[2], row[3]) for row in parse_insert_rows(line) if row[1] == 0]
+
+
+def _parse_redirect_line(line):
+    # rd_from, rd_namespace, rd_title, ...
+    return [(row[0], row[2]) for row in parse_insert_rows(line) if row[1] == 0]
+
+
+def _parse_linktarget_line(line):
+    # lt_id, lt_namespace, lt_title
+    return [(row[0], row[2]) for row in parse_insert_rows(line) if row[1] == 0]
+
+
+def _parse_pagelinks_line(line):
+    # 新形式: pl_from, pl_from_namespace, pl_target_id
+    # 旧形式: pl_from, pl_namespace, pl_title, pl_from_namespace
+    rows = []
+    for row in parse_insert_rows(line):
+        if len(row) == 3:
+            if row[1] == 0:
+                rows.append((row[0], row[2]))
+        elif row[1] == 0 and row[3] == 0:
+            rows.append((row[0], row[2]))
+    return rows
+
+
+def _iter_sql_lines(path):
+    with open_dump(path) as file:
+        for raw_line in file:
+            if raw_line.startswith(b'INSERT INTO'):
+                yield raw_line.decode('utf-8', errors='replace')
+
+
+def _sql_title(title):
+    return title.replace('_', ' ')
+
+
+def ingest_sql(page_path, redirect_path, pagelinks_path, linktarget_path, builder, workers):
+    # page: 標準名前空間の記事に page_id 順でIDを割り当てる
+    progress = Progress('SQL page')
+    page_ids = {}  # page_id -> 記事ID
+    for rows in _bounded_map(_parse_page_line, _iter_sql_lines(page_path), workers):
+        for page_id, title, is_redirect in rows:
+            page_ids[page_id] = builder.add_title(_sql_title(title), redirect=bool(is_redirect))
+        progress.add(len(rows))
+    progress.report(final=True)
+
+    if redirect_path:
+        progress = Progress('SQL redirect')
+        for rows in _bounded_map(_parse_redirect_line, _iter_sql_lines(redirect_path), workers):
+            for page_id, title in rows:
+                node_id = page_ids.get(page_id)
+                if node_id is not None:
+                    builder.redirects[node_id] = _sql_title(title)
+            progress.add(len(rows))
+        progress.report(final=True)
+    builder.resolve_redirects()
+
+    # 新形式の pagelinks はリンク先を linktarget のIDで持つ
+    link_targets = None
+    if linktarget_path:
+        progress = Progress('SQL linktarget')
+        link_targets = {}
+        for rows in _bounded_map(_parse_linktarget_line, _iter_sql_lines(linktarget_path), workers):
+            for target_id, title in rows:
+                node_id = builder.resolve(_sql_title(title))
+                if node_id is not None:
+                    link_targets[target_id] = node_id
+            progress.add(len(rows))
+        progress.report(final=True)
+
+    # pagelinks は pl_from（page_id）の順に並んでいるので、記事ごとにまとめて確定させる
+    progress = Progress('SQL pagelinks')
+    current_source = None
+    current_targets = []
+    for rows in _bounded_map(_parse_pagelinks_line, _iter_sql_lines(pagelinks_path), workers):
+        for page_id, target in rows:
+            source_id = page_ids.get(page_id)
+            if source_id is None or builder.is_redirect[source_id]:
+                continue
+            if source_id != current_source:
+                if current_source is not None:
+                    builder.set_outlinks(current_source, current_targets)
+                    progress.add()
+                if source_id < len(builder.out_offsets) - 1:
+                    raise ValueError(f'{pagelinks_path} が pl_from の順に並んでいません')
+                current_source, current_targets = source_id, []
+            if link_targets is not None:
+                target_id = link_targets.get(target)
+            else:
+                target_id = builder.resolve(_sql_title(target))
+            if target_id is not None:
+                current_targets.append(target_id)
+    if current_source is not None:
+        builder.set_outlinks(current_source, current_targets)
+        progress.add()
+    progress.report(final=True)
+
+
+def _bounded_map(func, items, workers):
+    """func を複数プロセスで実行し、入力順に結果を返す
+
+    同時に処理中の件数を制限して、入力を先読みしすぎてメモリを使い切らないようにする。
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(pool.apply_async(func, (item,)))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--xml', help='pages-articles のXMLダンプ')
+    parser.add_argument('--page', help='page テーブルのSQLダンプ')
+    parser.add_argument('--redirect', help='redirect テーブルのSQLダンプ')
+    parser.add_argument('--pagelinks', help='pagelinks テーブルのSQLダンプ')
+    parser.add_argument('--linktarget', help='linktarget テーブルのSQLダンプ（新形式の pagelinks の場合）')
+    parser.add_argument('-o', '--output', default=os.path.join('data', 'linkgraph.wgls'), help='出力するリンクストア')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='解析に使うプロセス数')
+    parser.add_argument('--tmp-dir', help='一時ファイルの置き場所')
+    args = parser.parse_args(argv)
+
+    if not args.xml and not (args.page and args.pagelinks):
+        parser.error('--xml か、--page と --pagelinks を指定してください')
+
+    started_at = time.monotonic()
+    builder = GraphBuilder(tmp_dir=args.tmp_dir)
+    if args.xml:
+        ingest_xml(args.xml, builder, args.workers)
+    else:
+        ingest_sql(args.page, args.redirect, args.pagelinks, args.linktarget, builder, args.workers)
+    builder.write(args.output)
+
+    elapsed = time.monotonic() - started_at
+    n_articles = len(builder.titles) - sum(builder.is_redirect)
+    print(f"{args.output} を作成しました: {n_articles:,} 記事, {len(builder.redirects):,} リダイレクト, "
+          f"{builder.out_offsets[-1]:,} リンク, {elapsed:.1f}秒 ({n_articles / max(elapsed, 1e-9):,.0f} 記事/秒)",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """ゴール（脱落・ギブアップを含む）したプレイヤーの順位表
+
+    移動回数が少ない順、同じ場合はゴール時間が早い順に並べる。
+    ゴールのたびに二分探索で挿入するので、全員分を並べ直す必要はない。
+    """
+
+    def __init__(self):
+        self._entries = []  # (移動回数, ゴール時間, プレイヤーID) の昇順
+        self._keys = {}  # プレイヤーID -> _entries 内のキー
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, player_id):
+        return player_id in self._keys
+
+    def add(self, player_id, moves, finish_time):
+        """プレイヤーを順位表に加え、その順位（1始まり）を返す"""
+        self.remove(player_id)
+        key = (moves, finish_time, player_id)
+        self._keys[player_id] = key
+        insort(self._entries, key)
+        return self.rank(player_id)
+
+    def remove(self, player_id):
+        key = self._keys.pop(player_id, None)
+        if key is not None:
+            del self._entries[bisect_left(self._entries, key)]
+
+    def rank(self, player_id):
+        """順位（1始まり）。順位表に無いプレイヤーは None"""
+        key = self._keys.get(player_id)
+        if key is None:
+            return None
+        return bisect_left(self._entries, key) + 1
+
+    def top(self, count=None):
+        """上位 count 人のプレイヤーIDを順位順に返す（count を省略すると全員）"""
+        entries = self._entries if count is None else self._entries[:count]
+        return [player_id for _, _, player_id in entries]
@@ -0,0 +1,256 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote, quote
+
+from page_cache import PageCache
+
+API_BATCH_SIZE = 50  # MediaWiki APIで一度に指定できるタイトル数の上限
+
+
+def url_to_title(url):
+    """WikipediaのURLから記事タイトルを取り出す（取り出せない場合は None）"""
+    path = unquote(urlparse(url).path)
+    if not path.startswith('/wiki/'):
+        return None
+    title = path[len('/wiki/'):].replace('_', ' ')
+    return title or None
+
+
+def title_to_url(title, language='ja'):
+    """記事タイトルからWikipediaのURLを作る"""
+    return f"https://{language}.wikipedia.org/wiki/{quote(title.replace(' ', '_'))}"
+
+
+class LinkGraph:
+    """記事間リンクの隣接リストをリンクストアに蓄積しながら取得する
+
+    outlinks() はページから出ているリンク、inlinks() はページへのリンク元を
+    記事IDで返す。ストアに無いページだけを50件ずつまとめてMediaWiki APIで取得し、
+    複数のバッチは max_workers 個まで並行して取得する。
+    """
+
+    def __init__(self, http_get, store, language='ja', max_workers=8):
+        self.http_get = http_get  # http_get(url, params=...) -> Response
+        self.store = store
+        self.api_url = f'https://{language}.wikipedia.org/w/api.php'
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='linkgraph')
+
+    def id_of(self, title):
+        return self.store.id_of(title, create=True)
+
+    def title_of(self, node_id):
+        return self.store.title_of(node_id)
+
+    def resolve(self, title):
+        """記事IDをリダイレクトを解決して返す（存在しない記事の場合は None）
+
+        ストアに無いタイトルはAPIで存在を確かめ、Wikipediaが返したタイトルだけをストアに登録する。
+        """
+        node_id = self.store.id_of(title)
+        if node_id is None:
+            node_id = self._fetch_page_id(title)
+            if node_id is None:
+                return None
+        return self.canonical(node_id)
+
+    def store_outlinks(self, title, linked_titles):
+        """取得済みのリンク一覧（/api/page-links などの結果）をストアに登録する"""
+        self.store.set_outlinks(self.id_of(title), [self.id_of(linked) for linked in linked_titles])
+
+    def outlinks(self, node_ids):
+        """{記事ID: リンク先IDの列} を返す"""
+        return self._lookup(node_ids, self.store.outlinks, self.store.set_outlinks, self._fetch_outlinks)
+
+    def inlinks(self, node_ids):
+        """{記事ID: リンク元IDの列} を返す"""
+        return self._lookup(node_ids, self.store.inlinks, self.store.set_inlinks, self._fetch_inlinks)
+
+    def canonical(self, node_id):
+        return self.store.redirect_target(node_id)
+
+    def _lookup(self, node_ids, get_links, set_links, fetch):
+        result = {}
+        missing = []
+        for node_id in node_ids:
+            links = get_links(node_id)
+            if links is None:
+                missing.append(self.title_of(node_id))
+            else:
+                result[node_id] = links
+        batches = [missing[i:i + API_BATCH_SIZE] for i in range(0, len(missing), API_BATCH_SIZE)]
+        for fetched in self._executor.map(fetch, batches):
+            for title, linked in fetched.items():
+                node_id = self.id_of(title)
+                set_links(node_id, [self.id_of(linked_title) for linked_title in linked])
+                result[node_id] = get_links(node_id)
+        return result
+
+    def _query(self, params):
+        """continueを辿りながらクエリ結果のページ一覧を順に返す"""
+        params = dict(params, action='query', format='json', formatversion=2)
+        while True:
+            response = self.http_get(self.api_url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            yield from data.get('query', {}).get('pages', [])
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+
+    def _fetch_page_id(self, title):
+        response = self.http_get(self.api_url, params={'action': 'query', 'format': 'json', 'formatversion': 2,
+                                                       'titles': title, 'redirects': 1})
+        response.raise_for_status()
+        query = response.json().get('query', {})
+        pages = query.get('pages', [])
+        if len(pages) != 1 or pages[0].get('missing') or pages[0].get('invalid'):
+            return None
+        node_id = self.id_of(pages[0]['title'])
+        for redirect in query.get('redirects', []):
+            self.store.set_redirect(self.id_of(redirect['from']), node_id)
+        return node_id
+
+    def _fetch_outlinks(self, titles):
+        links = {title: set() for title in titles}
+        for page in self._query({'titles': '|'.join(titles), 'prop': 'links',
+                                 'plnamespace': 0, 'pllimit': 'max'}):
+            if page['title'] in links:
+                links[page['title']].update(link['title'] for link in page.get('links', []))
+        return links
+
+    def _fetch_inlinks(self, titles):
+        links = {title: set() for title in titles}
+        redirect_sources = {}
+        for page in self._query({'titles': '|'.join(titles), 'prop': 'linkshere', 'lhnamespace': 0,
+                                 'lhprop': 'title|redirect', 'lhlimit': 'max'}):
+            if page['title'] not in links:
+                continue
+            for link in page.get('linkshere', []):
+                if link.get('redirect'):
+                    # リダイレクト経由のリンクは、リダイレクト先への直接リンクとして扱う
+                    self.store.set_redirect(self.id_of(link['title']), self.id_of(page['title']))
+                    redirect_sources[link['title']] = page['title']
+                else:
+                    links[page['title']].add(link['title'])
+        if redirect_sources:
+            redirect_titles = list(redirect_sources)
+            for i in range(0, len(redirect_titles), API_BATCH_SIZE):
+                for redirect, sources in self._fetch_inlinks(redirect_titles[i:i + API_BATCH_SIZE]).items():
+                    links[redirect_sources[redirect]].update(sources)
+        return links
+
+
+class ShortestPathSolver:
+    """双方向幅優先探索で2記事間の最短クリック数を求める
+
+    小さい方の探索フロンティアから1段ずつ展開し、両側の探索が出会った時点で終了する。
+    探索の深さ・時間に上限を設け、結果はメモ化する。
+    """
+
+    def __init__(self, graph, max_depth=6, time_budget=10.0, max_frontier=5000, cache_ttl=3600):
+        self.graph = graph
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.max_frontier = max_frontier  # これより大きいフロンティアは展開しない
+        self.results = PageCache(max_bytes=8 * 1024 * 1024, ttl=cache_ttl)
+
+    def solve(self, start_title, target_title):
+        """最短経路を探索する
+
+        戻り値は {'found', 'distance', 'path', 'complete'} の辞書。
+        complete が False の場合は上限に達したため探索を打ち切っている。
+        """
+        # リダイレクトは転送先の記事として探索する（前向きの探索で出会う記事はすべて転送先のため）
+        start = self.graph.resolve(start_title)
+        target = self.graph.resolve(target_title)
+        if start is None or target is None:
+            return self._result(None, True)
+        key = (start, target)
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached
+        path_ids, complete = self._search(start, target)
+        path = [self.graph.title_of(node_id) for node_id in path_ids] if path_ids else None
+        result = self._result(path, complete)
+        if result['found'] or result['complete']:
+            self.results.set(key, result)
+        return result
+
+    def _search(self, start, target):
+        """記事IDで探索し、(経路のIDリスト または None, 探索を完了したか) を返す"""
+        started_at = time.monotonic()
+        if start == target:
+            return [start], True
+
+        forward_parents = {start: None}
+        backward_parents = {target: None}
+        forward_frontier = [start]
+        backward_frontier = [target]
+        depth = 0
+
+        while forward_frontier and backward_frontier and depth < self.max_depth:
+            if time.monotonic() - started_at > self.time_budget:
+                return None, False
+            expand_forward = len(forward_frontier) <= len(backward_frontier)
+            frontier = forward_frontier if expand_forward else backward_frontier
+            if len(frontier) > self.max_frontier:
+                return None, False
+
+            if expand_forward:
+                adjacency = self.graph.outlinks(frontier)
+                parents, others = forward_parents, backward_parents
+            else:
+                adjacency = self.graph.inlinks(frontier)
+                parents, others = backward_parents, forward_parents
+
+            next_frontier = []
+            meeting = None
+            for node_id in frontier:
+                for neighbor in adjacency.get(node_id, ()):
+                    if expand_forward:
+                        neighbor = self.graph.canonical(neighbor)
+                    if neighbor in parents:
+                        continue
+                    parents[neighbor] = node_id
+                    next_frontier.append(neighbor)
+                    if neighbor in others:
+                        meeting = neighbor
+                        break
+                if meeting is not None:
+                    break
+            depth += 1
+
+            if meeting is not None:
+                return self._build_path(meeting, forward_parents, backward_parents), True
+            if expand_forward:
+                forward_frontier = next_frontier
+            else:
+                backward_frontier = next_frontier
+
+        # 深さの上限に達した場合は「見つからなかった」ことが確定しない
+        exhausted = not forward_frontier or not backward_frontier
+        return None, exhausted
+
+    @staticmethod
+    def _build_path(meeting, forward_parents, backward_parents):
+        path = []
+        node = meeting
+        while node is not None:
+            path.append(node)
+            node = forward_parents[node]
+        path.reverse()
+        node = backward_parents[meeting]
+        while node is not None:
+            path.append(node)
+            node = backward_parents[node]
+        return path
+
+    @staticmethod
+    def _result(path, complete):
+        return {
+            'found': path is not None,
+            'distance': len(path) - 1 if path else None,
+            'path': path,
+            'complete': complete
+        }
@@ -0,0 +1,349 @@
+import heapq
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+MAGIC = b'WGLS'
+VERSION = 1
+# magic, version, タイトル数, タイトルblobのバイト数, 出リンク数, 入リンク数, リダイレクト数
+HEADER = struct.Struct('<4sIQQQQQ')
+
+# ノードごとのフラグ（リンク一覧を取得済みかどうか）
+OUT_KNOWN = 1
+IN_KNOWN = 2
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _section_layout(n_titles, blob_size, n_out, n_in, n_redirects):
+    """ヘッダー直後から並ぶ各セクションの {名前: (開始位置, バイト数)} を返す"""
+    sizes = [
+        ('title_offsets', (n_titles + 1) * 8),
+        ('title_blob', blob_size),
+        ('title_order', n_titles * 4),
+        ('flags', n_titles),
+        ('out_offsets', (n_titles + 1) * 8),
+        ('out_targets', n_out * 4),
+        ('in_offsets', (n_titles + 1) * 8),
+        ('in_targets', n_in * 4),
+        ('redirect_src', n_redirects * 4),
+        ('redirect_dst', n_redirects * 4),
+    ]
+    layout = {}
+    offset = _align(HEADER.size)
+    for name, size in sizes:
+        layout[name] = (offset, size)
+        offset = _align(offset + size)
+    return layout
+
+
+def _write_section(file, start, chunks):
+    file.seek(start)
+    for chunk in chunks:
+        file.write(chunk)
+
+
+def write_link_store(path, title_offsets, title_chunks, title_order, flags, out_csr, in_csr, redirects):
+    """リンクストアのファイルを書き出す
+
+    title_offsets: タイトルblob内の各タイトルの開始位置（IDの順、末尾に全体の長さ）
+    title_chunks: UTF-8のタイトルを連結したblobを分割したもの
+    title_order: タイトルのUTF-8バイト順に並べたIDの配列
+    flags: IDごとのフラグ
+    out_csr, in_csr: (オフセット配列, IDの配列を分割したもののリスト)
+    redirects: (リダイレクト元IDの昇順配列, リダイレクト先IDの配列)
+    一時ファイルに書いてから置き換えるので、読み込み中のプロセスには影響しない。
+    """
+    n_titles = len(title_offsets) - 1
+    out_offsets, out_chunks = out_csr
+    in_offsets, in_chunks = in_csr
+    redirect_src, redirect_dst = redirects
+    layout = _section_layout(n_titles, title_offsets[-1], out_offsets[-1], in_offsets[-1], len(redirect_src))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, n_titles, title_offsets[-1], out_offsets[-1],
+                               in_offsets[-1], len(redirect_src)))
+        _write_section(file, layout['title_offsets'][0], [array('Q', title_offsets)])
+        _write_section(file, layout['title_blob'][0], title_chunks)
+        _write_section(file, layout['title_order'][0], [array('I', title_order)])
+        _write_section(file, layout['flags'][0], [bytes(flags)])
+        _write_section(file, layout['out_offsets'][0], [array('Q', out_offsets)])
+        _write_section(file, layout['out_targets'][0], out_chunks)
+        _write_section(file, layout['in_offsets'][0], [array('Q', in_offsets)])
+        _write_section(file, layout['in_targets'][0], in_chunks)
+        _write_section(file, layout['redirect_src'][0], [array('I', redirect_src)])
+        _write_section(file, layout['redirect_dst'][0], [array('I', redirect_dst)])
+        end, size = layout['redirect_dst']
+        file.truncate(_align(end + size))
+    os.replace(tmp_path, path)
+
+
+class _BaseFile:
+    """mmapしたリンクストアファイルの各セクション（空のストアも表せる）"""
+
+    def __init__(self, path=None):
+        self.mtime = None
+        self.n_titles = 0
+        self.title_offsets = array('Q', [0])
+        self.title_blob = b''
+        self.title_order = array('I')
+        self.flags = b''
+        self.out_offsets = self.in_offsets = array('Q', [0])
+        self.out_targets = self.in_targets = array('I')
+        self.redirect_src = self.redirect_dst = array('I')
+        self.file_bytes = 0
+        if path:
+            self._map(path)
+
+    def _map(self, path):
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_titles, blob_size, n_out, n_in, n_redirects = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} はリンクストアのファイルではありません')
+        layout = _section_layout(n_titles, blob_size, n_out, n_in, n_redirects)
+        view = memoryview(mapped)
+
+        def section(name, fmt=None):
+            start, length = layout[name]
+            data = view[start:start + length]
+            return data.cast(fmt) if fmt else data
+
+        self.mtime = stat.st_mtime_ns
+        self.file_bytes = stat.st_size
+        self.n_titles = n_titles
+        self.title_offsets = section('title_offsets', 'Q')
+        self.title_blob = section('title_blob')
+        self.title_order = section('title_order', 'I')
+        self.flags = section('flags')
+        self.out_offsets = section('out_offsets', 'Q')
+        self.out_targets = section('out_targets', 'I')
+        self.in_offsets = section('in_offsets', 'Q')
+        self.in_targets = section('in_targets', 'I')
+        self.redirect_src = section('redirect_src', 'I')
+        self.redirect_dst = section('redirect_dst', 'I')
+
+    def title_bytes(self, node_id):
+        return bytes(self.title_blob[self.title_offsets[node_id]:self.title_offsets[node_id + 1]])
+
+    def find(self, key):
+        """UTF-8のタイトルをタイトル順の索引から二分探索する"""
+        low, high = 0, self.n_titles
+        while low < high:
+            middle = (low + high) // 2
+            node_id = self.title_order[middle]
+            current = self.title_bytes(node_id)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return node_id
+        return None
+
+    def links(self, node_id, flag):
+        if node_id >= self.n_titles or not self.flags[node_id] & flag:
+            return None
+        if flag == OUT_KNOWN:
+            return self.out_targets[self.out_offsets[node_id]:self.out_offsets[node_id + 1]]
+        return self.in_targets[self.in_offsets[node_id]:self.in_offsets[node_id + 1]]
+
+    def redirect(self, node_id):
+        src = self.redirect_src
+        low, high = 0, len(src)
+        while low < high:
+            middle = (low + high) // 2
+            if src[middle] < node_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(src) and src[low] == node_id:
+            return self.redirect_dst[low]
+        return None
+
+
+class LinkStore:
+    """記事タイトルを整数IDに割り当て、リンクをCSR形式で保持するストア
+
+    保存済みの部分はファイルをmmapで読み込むため、再起動や複数ワーカープロセスの
+    間でもOSのページキャッシュを共有でき、Pythonオブジェクトを作らずに済む。
+    実行中に取得したリンクはメモリ上の差分に追加し、save() でファイルに統合する。
+    IDは追加順に割り当てるので、保存しても既存のIDは変わらない。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._base = _BaseFile(path if path and os.path.exists(path) else None)
+        self._reset_overlay()
+
+    def _reset_overlay(self):
+        self._new_titles = []  # ファイルに無い、新しく割り当てたIDのタイトル
+        self._new_ids = {}  # タイトル -> 新規ID
+        self._out = {}  # ID -> array('I')
+        self._in = {}
+        self._redirects = {}  # リダイレクト元ID -> リダイレクト先ID
+
+    def __len__(self):
+        return self._base.n_titles + len(self._new_titles)
+
+    @property
+    def dirty(self):
+        return bool(self._new_titles or self._out or self._in or self._redirects)
+
+    def id_of(self, title, create=False):
+        """タイトルのIDを返す。未登録の場合は create=True なら新規に割り当て、それ以外は None"""
+        node_id = self._new_ids.get(title)
+        if node_id is not None:
+            return node_id
+        node_id = self._base.find(title.encode('utf-8'))
+        if node_id is not None or not create:
+            return node_id
+        with self._lock:
+            node_id = self._new_ids.get(title)
+            if node_id is None:
+                node_id = len(self)
+                self._new_titles.append(title)
+                self._new_ids[title] = node_id
+            return node_id
+
+    def title_of(self, node_id):
+        base = self._base
+        if node_id < base.n_titles:
+            return base.title_bytes(node_id).decode('utf-8')
+        return self._new_titles[node_id - base.n_titles]
+
+    def outlinks(self, node_id):
+        """リンク先IDの列を返す。まだ取得していない場合は None"""
+        links = self._out.get(node_id)
+        return links if links is not None else self._base.links(node_id, OUT_KNOWN)
+
+    def inlinks(self, node_id):
+        """リンク元IDの列を返す。まだ取得していない場合は None"""
+        links = self._in.get(node_id)
+        return links if links is not None else self._base.links(node_id, IN_KNOWN)
+
+    def set_outlinks(self, node_id, target_ids):
+        links = array('I', sorted(set(target_ids)))
+        with self._lock:
+            self._out[node_id] = links
+
+    def set_inlinks(self, node_id, source_ids):
+        links = array('I', sorted(set(source_ids)))
+        with self._lock:
+            self._in[node_id] = links
+
+    def redirect_target(self, node_id):
+        """リダイレクトページならリダイレクト先のID、そうでなければ node_id を返す"""
+        target = self._redirects.get(node_id)
+        if target is None:
+            target = self._base.redirect(node_id)
+        return node_id if target is None else target
+
+    def set_redirect(self, source_id, target_id):
+        with self._lock:
+            self._redirects[source_id] = target_id
+
+    def _merged_csr(self, flag, overlay):
+        """ファイル上のCSRと差分をまとめる。変更の無いIDの範囲は配列をまとめてコピーする"""
+        base = self._base
+        offsets, targets = (base.out_offsets, base.out_targets) if flag == OUT_KNOWN \
+            else (base.in_offsets, base.in_targets)
+        n_titles = len(self)
+        merged_offsets = array('Q', [0])
+        chunks = []
+        position = 0
+        node_id = 0
+        for changed_id in sorted(overlay) + [n_titles]:
+            base_end = min(changed_id, base.n_titles)
+            if node_id < base_end:
+                start, end = offsets[node_id], offsets[base_end]
+                if end > start:
+                    chunks.append(targets[start:end])
+                shift = position - start
+                merged_offsets.extend(offsets[i] + shift for i in range(node_id + 1, base_end + 1))
+                position += end - start
+                node_id = base_end
+            # 新規IDでリンクが未取得のもの
+            while node_id < changed_id:
+                merged_offsets.append(position)
+                node_id += 1
+            if changed_id < n_titles:
+                links = overlay[changed_id]
+                chunks.append(links)
+                position += len(links)
+                merged_offsets.append(position)
+                node_id += 1
+        return merged_offsets, chunks
+
+    def save(self, path=None):
+        """差分をファイルに統合して保存し、保存したファイルを開き直す"""
+        path = path or self.path
+        if not path:
+            raise ValueError('保存先のパスが指定されていません')
+        with self._lock:
+            base = self._base
+            new_encoded = [title.encode('utf-8') for title in self._new_titles]
+
+            title_offsets = array('Q', base.title_offsets)
+            for data in new_encoded:
+                title_offsets.append(title_offsets[-1] + len(data))
+            title_chunks = [base.title_blob] + new_encoded
+
+            # 既存のタイトル順の索引に新規タイトルをマージする
+            new_order = sorted(range(base.n_titles, len(self)), key=lambda node_id: new_encoded[node_id - base.n_titles])
+            title_order = array('I', heapq.merge(
+                base.title_order, new_order,
+                key=lambda node_id: base.title_bytes(node_id) if node_id < base.n_titles
+                else new_encoded[node_id - base.n_titles]))
+
+            flags = bytearray(base.flags) + bytearray(len(new_encoded))
+            for node_id in self._out:
+                flags[node_id] |= OUT_KNOWN
+            for node_id in self._in:
+                flags[node_id] |= IN_KNOWN
+
+            redirects = dict(zip(base.redirect_src, base.redirect_dst))
+            redirects.update(self._redirects)
+            redirect_src = array('I', sorted(redirects))
+            redirect_dst = array('I', (redirects[source] for source in redirect_src))
+
+            write_link_store(path, title_offsets, title_chunks, title_order, flags,
+                             self._merged_csr(OUT_KNOWN, self._out), self._merged_csr(IN_KNOWN, self._in),
+                             (redirect_src, redirect_dst))
+            # 古いmmapは参照が無くなった時点で閉じられる
+            self._base = _BaseFile(path)
+            self._reset_overlay()
+            self.path = path
+
+    def reload_if_changed(self):
+        """他のプロセスがファイルを更新していて、未保存の差分が無ければ開き直す"""
+        if not self.path or self.dirty or not os.path.exists(self.path):
+            return False
+        if os.stat(self.path).st_mtime_ns == self._base.mtime:
+            return False
+        with self._lock:
+            self._base = _BaseFile(self.path)
+        return True
+
+    def stats(self):
+        base = self._base
+        return {
+            'titles': len(self),
+            'stored_titles': base.n_titles,
+            'stored_out_edges': len(base.out_targets),
+            'stored_in_edges': len(base.in_targets),
+            'pending_titles': len(self._new_titles),
+            'pending_outlinks': len(self._out),
+            'pending_inlinks': len(self._in),
+            'file_bytes': base.file_bytes
+        }
@@ -0,0 +1,76 @@
+import threading
+
+
+def room_summary(room):
+    """ロビーの一覧に表示するルームの要約"""
+    return {
+        'id': room.id,
+        'name': room.name,
+        'host': room.host,
+        'player_count': len(room.players),
+        'max_players': room.max_players,
+        'status': room.status,
+        'tournament': room.tournament,
+        'game_mode': room.settings.game_mode,
+        'difficulty': room.settings.difficulty
+    }
+
+
+def is_joinable(room):
+    return room.status == 'waiting' and len(room.players) < room.max_players
+
+
+class LobbyIndex:
+    """参加できるルームの索引
+
+    ルームの作成・参加・退出・開始・リセット・設定変更のたびに update() で更新し、
+    一覧の取得では全ルームを走査せずに索引だけを引く。
+    前回の送信以降の変更はルームごとにまとめておき、take_changes() で差分として取り出す。
+    """
+
+    def __init__(self, entries=None):
+        self._entries = {} if entries is None else entries  # ルームID -> 要約（状態ストアのマッピングも可）
+        self._changes = {}  # ルームID -> 要約（一覧から消えた場合は None）
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, room):
+        """ルームの変更を反映する（参加できなくなったルームは一覧から外す）"""
+        if not is_joinable(room):
+            self.remove(room.id)
+            return
+        summary = room_summary(room)
+        if self._entries.get(room.id) == summary:
+            return
+        self._entries[room.id] = summary
+        with self._lock:
+            self._changes[room.id] = summary
+
+    def remove(self, room_id):
+        if self._entries.pop(room_id, None) is None:
+            return
+        with self._lock:
+            self._changes[room_id] = None
+
+    def list(self, offset=0, limit=50, game_mode=None, difficulty=None):
+        """条件に合うルームを (総数, そのページの要約のリスト) で返す"""
+        # update()/remove() は索引のロックを取らずに書き換えるため、走査はその時点の写しに対して行う
+        matched = [
+            summary for summary in list(self._entries.values())
+            if (game_mode is None or summary['game_mode'] == game_mode)
+            and (difficulty is None or summary['difficulty'] == difficulty)
+        ]
+        return len(matched), matched[offset:offset + limit]
+
+    def take_changes(self):
+        """前回以降の変更を {'updated': [...], 'removed': [...]} で取り出す（変更が無ければ None）"""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        if not changes:
+            return None
+        return {
+            'updated': [summary for summary in changes.values() if summary is not None],
+            'removed': [room_id for room_id, summary in changes.items() if summary is None]
+        }
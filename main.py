@@ -1,35 +1,190 @@
-from flask import Flask, request, render_template, jsonify, session
+import os
+
+# 非同期モード（threading / eventlet / gevent）
+# eventlet・geventの場合は、requestsなどが使うソケットを他のモジュールより先にパッチして
+# Wikipediaへの通信待ちでSocketIOのイベント処理が止まらないようにする
+ASYNC_MODE = os.environ.get('WIKIGAME_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, Response, request, render_template, jsonify, session
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
-import requests
+from socketio import packet as sio_packet
+import functools
 import random
 import uuid
 from bs4 import BeautifulSoup
-from collections import defaultdict
 import time
 import html
-import re
-import os
 from urllib.parse import urlparse
-from pykakasi import kakasi  # 日本語をローマ字に変換するライブラリ
-
-# kakasiの初期化
-kks = kakasi()
+from page_cache import PageCache, canonical_page_url, content_etag
+from sanitizer import create_sanitizer, sanitize_html
+from compression import RenderedPage, StreamCompressor, negotiate_encoding
+from upstream import UpstreamBusy, UpstreamClient
+from random_pool import RandomPagePool
+from corpus import CorpusRegistry
+from answers import AnswerIndex
+from models import GameState, PlayerState, Room, WireJSON
+from state_store import StateLockTimeout, create_state_store
+from lobby import LobbyIndex
+from sweeper import RoomSweeper
+from spectators import SpectatorFeed, spectator_channel, spectator_snapshot
+from linkgraph import LinkGraph, ShortestPathSolver, url_to_title, title_to_url
+from linkstore import LinkStore
+from metrics import BYTE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'wiki-game-secret-key'  # セッション用の秘密鍵
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
 
-# ゲームルーム管理
-rooms = {}
+# /metrics で公開する計測値（ホットパスでは数えるだけにし、ルーム数やキャッシュの統計は出力時に求める）
+metrics = MetricsRegistry(prefix='wikigame_')
+UPSTREAM_SECONDS = metrics.histogram('upstream_request_seconds', 'Wikipediaへのリクエストの時間（呼び出し元ごと）', ['site'])
+UPSTREAM_ERRORS = metrics.counter('upstream_errors_total', 'Wikipediaへのリクエストの失敗数（例外・5xx応答）', ['site'])
+SOCKET_EVENT_SECONDS = metrics.histogram('socket_event_seconds', 'SocketIOイベントのハンドラーの処理時間', ['event'])
+EMIT_BYTES = metrics.histogram('emit_payload_bytes', '送信したSocketIOイベントのペイロードの大きさ', ['event'],
+                               buckets=BYTE_BUCKETS)
+CONNECTED_CLIENTS = metrics.gauge('connected_clients', '接続中のSocketIOクライアント数')
+
+class MeteredPacket(sio_packet.Packet):
+    """クライアントに送るパケットの大きさを記録する Packet（ルーム宛ての送信でもエンコードは1回）
+
+    メッセージキューに流す通知などはJSONモジュールで直接エンコードされるので数えない。
+    """
+
+    def encode(self):
+        encoded = super().encode()
+        if self.packet_type in (sio_packet.EVENT, sio_packet.BINARY_EVENT):
+            event = self.data[0]  # イベントは [イベント名, 引数...]
+        elif self.packet_type in (sio_packet.ACK, sio_packet.BINARY_ACK):
+            event = 'ack'
+        else:
+            return encoded
+        # バイナリを含む場合は [パケット, 添付データ...] になる。ensure_ascii のため文字数 = バイト数
+        EMIT_BYTES.labels(event).observe(len(encoded[0] if isinstance(encoded, list) else encoded))
+        return encoded
+
+def observe_upstream(site, seconds, ok):
+    UPSTREAM_SECONDS.labels(site).observe(seconds)
+    if not ok:
+        UPSTREAM_ERRORS.labels(site).inc()
+
+# 複数のワーカープロセスで動かす場合はRedisなどのメッセージキューを指定する（例: redis://localhost:6379/0）
+MESSAGE_QUEUE = os.environ.get('WIKIGAME_MESSAGE_QUEUE') or None
+# ルーム情報などはモデルごとにキャッシュしたJSONを使って送信する
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, json=WireJSON,
+                    serializer=MeteredPacket, message_queue=MESSAGE_QUEUE)
+
+def socket_event(message):
+    """ハンドラーの処理時間を計測する socketio.on
+
+    ルームのロックを時間内に取れなかった場合は、変更を書き戻さずにロックを解放してイベントを失敗させる。
+    """
+    observe = SOCKET_EVENT_SECONDS.labels(message).observe
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            except StateLockTimeout as e:
+                state_store.discard()
+                print(f"{message}: {e}")
+                emit('error', {'message': 'ルームが混み合っています。もう一度お試しください'})
+            finally:
+                observe(time.perf_counter() - start)
+        return socketio.on(message)(timed)
+    return decorator
+
+# ルーム・ゲーム状態の保存先（memory または redis://...）
+state_store = create_state_store(os.environ.get('WIKIGAME_STATE_STORE', 'memory'),
+                                 lock_stripes=int(os.environ.get('WIKIGAME_STATE_LOCK_STRIPES', 64)),
+                                 lock_ttl=float(os.environ.get('WIKIGAME_STATE_LOCK_TTL', 30)))
+# ゲームルーム管理（同じルームIDのルームとゲーム状態はまとめてロックされる）
+rooms = state_store.mapping('rooms', Room, locked=True)
 # プレイヤー管理（player_id -> 部屋ID）
-player_rooms = {}
+player_rooms = state_store.mapping('player_rooms')
 # ゲーム状態管理
-game_states = defaultdict(dict)
+game_states = state_store.mapping('game_states', GameState, locked=True)
+
+# 参加できるルームの索引（複数プロセスの場合は状態ストアで共有する）
+lobby = LobbyIndex(state_store.mapping('lobby'))
+LOBBY_CHANNEL = 'lobby'  # ロビーの更新通知を受け取るSocketIOのルーム
+LOBBY_PAGE_SIZE = int(os.environ.get('WIKIGAME_LOBBY_PAGE_SIZE', 50))
+LOBBY_PUSH_INTERVAL = float(os.environ.get('WIKIGAME_LOBBY_PUSH_INTERVAL', 1))  # 秒
+
+# 操作の無いルームを削除するまでの時間（秒、0 で無効）と確認の間隔
+ROOM_TTLS = {
+    'waiting': int(os.environ.get('WIKIGAME_ROOM_TTL_WAITING', 3600)),
+    'playing': int(os.environ.get('WIKIGAME_ROOM_TTL_PLAYING', 7200)),
+    'finished': int(os.environ.get('WIKIGAME_ROOM_TTL_FINISHED', 900))
+}
+ROOM_SWEEP_INTERVAL = int(os.environ.get('WIKIGAME_ROOM_SWEEP_INTERVAL', 60))
+# 観戦者にプレイヤーの変化をまとめて送る間隔（秒）
+SPECTATOR_TICK = float(os.environ.get('WIKIGAME_SPECTATOR_TICK', 0.25))
+spectator_feed = SpectatorFeed()
+# 1プレイヤーあたりに保持する経路の長さの上限
+PlayerState.max_path_length = int(os.environ.get('WIKIGAME_MAX_PATH_LENGTH', 1000))
+
+@app.teardown_request
+def flush_state_store(exc):
+    """リクエスト・SocketIOのイベントの終了時に、変更した状態を保存先に書き戻す"""
+    state_store.flush()
+
+# ルームの定員（トーナメントルームは作成時に定員を指定できる）
+ROOM_MAX_PLAYERS = int(os.environ.get('WIKIGAME_ROOM_MAX_PLAYERS', 4))
+TOURNAMENT_MAX_PLAYERS = int(os.environ.get('WIKIGAME_TOURNAMENT_MAX_PLAYERS', 1000))
+# player_finished で送る上位プレイヤーの人数
+LEADERBOARD_BROADCAST_SIZE = int(os.environ.get('WIKIGAME_LEADERBOARD_BROADCAST_SIZE', 10))
 
 ALLOWED_DOMAIN = "wikipedia.org"
 
+# プロキシ済みページのキャッシュ設定（環境変数で上書き可能）
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('WIKIGAME_PAGE_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+PAGE_CACHE_TTL = int(os.environ.get('WIKIGAME_PAGE_CACHE_TTL', 600))  # 秒
+page_cache = PageCache(max_bytes=PAGE_CACHE_MAX_BYTES, ttl=PAGE_CACHE_TTL)
+# 加工済みページのブラウザでのキャッシュ期間（秒）。期限後はETagで再検証する
+PROXY_MAX_AGE = int(os.environ.get('WIKIGAME_PROXY_MAX_AGE', 60))
+PROXY_CACHE_CONTROL = f'public, max-age={PROXY_MAX_AGE}, must-revalidate' if PROXY_MAX_AGE > 0 else 'no-cache'
+# 加工済みページをgzip / brotli（インストールされている場合）で圧縮して返すか
+PROXY_COMPRESSION = os.environ.get('WIKIGAME_PROXY_COMPRESSION', '1') == '1'
+# キャッシュに無いページをサニタイズしながら送るときの1回あたりの入力の文字数
+PROXY_STREAM_CHUNK = int(os.environ.get('WIKIGAME_PROXY_STREAM_CHUNK', 64 * 1024))
+# Wikipediaの応答の本文と検証子（ETag / Last-Modified）。加工済みページの期限切れ後は条件付きリクエストで再検証する
+upstream_validators = PageCache(
+    max_bytes=int(os.environ.get('WIKIGAME_UPSTREAM_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=int(os.environ.get('WIKIGAME_UPSTREAM_CACHE_TTL', 24 * 60 * 60))
+)
+# URL -> 表示タイトルの索引（プロキシとリンク抽出の結果から登録する）
+title_cache = PageCache(max_bytes=int(os.environ.get('WIKIGAME_TITLE_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+                        ttl=24 * 60 * 60)
+
+# ランダムページのプール設定
+RANDOM_POOL_SIZE = int(os.environ.get('WIKIGAME_RANDOM_POOL_SIZE', 50))
+RANDOM_POOL_LOW_WATER = int(os.environ.get('WIKIGAME_RANDOM_POOL_LOW_WATER', 10))
+RANDOM_POOL_MIN_BYTES = int(os.environ.get('WIKIGAME_RANDOM_POOL_MIN_BYTES', 0))  # これより短い記事は除外
+RANDOM_POOL_SKIP_DISAMBIGUATION = os.environ.get('WIKIGAME_RANDOM_POOL_SKIP_DISAMBIGUATION', '1') == '1'
+
+# Wikipediaへのリクエストは全てこのクライアント（接続プール共有）を経由する
+upstream = UpstreamClient(
+    pool_maxsize=int(os.environ.get('WIKIGAME_UPSTREAM_POOL_SIZE', 32)),
+    connect_timeout=float(os.environ.get('WIKIGAME_UPSTREAM_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.environ.get('WIKIGAME_UPSTREAM_READ_TIMEOUT', 10)),
+    retries=int(os.environ.get('WIKIGAME_UPSTREAM_RETRIES', 2)),
+    max_concurrency=int(os.environ.get('WIKIGAME_UPSTREAM_MAX_CONCURRENCY', 0)) or None,
+    queue_timeout=float(os.environ.get('WIKIGAME_UPSTREAM_QUEUE_TIMEOUT', 10)),
+    # 取得先をスタブサーバーなどに差し替える場合に指定する（ゲーム内のURLはWikipediaのまま）
+    base_url=os.environ.get('WIKIGAME_UPSTREAM_BASE_URL') or None,
+    observe=observe_upstream,
+    validators=upstream_validators if upstream_validators.max_bytes > 0 else None
+)
+
 def is_safe_url(url):
     """指定されたURLが安全なWikipediaのURLか検証する"""
     if not url:
@@ -48,14 +203,41 @@ def is_safe_url(url):
 def get_random_wikipedia_page(language='ja'):
     """ランダムなWikipediaページのURLを取得"""
     base_url = f'https://{language}.wikipedia.org/wiki/特別:おまかせ表示'
-    response = requests.get(base_url, allow_redirects=True)
+    response = upstream.get(base_url, allow_redirects=True, site='random_page')
     return response.url
 
+def fetch_random_pages(count, language='ja'):
+    """MediaWiki APIでランダムな標準名前空間の記事URLをまとめて取得"""
+    params = {
+        'action': 'query',
+        'generator': 'random',
+        'grnnamespace': 0,
+        'grnlimit': min(max(count, 10), 50),  # 除外される分を見込んで多めに取得（APIの上限は50件）
+        'prop': 'info|pageprops',
+        'inprop': 'url',
+        'ppprop': 'disambiguation',
+        'format': 'json'
+    }
+    response = upstream.get(f'https://{language}.wikipedia.org/w/api.php', params=params, site='random_page')
+    response.raise_for_status()
+    pages = response.json().get('query', {}).get('pages', {}).values()
+
+    urls = []
+    for page in pages:
+        # 曖昧さ回避ページとスタブ（本文が短すぎるページ）を除外
+        if RANDOM_POOL_SKIP_DISAMBIGUATION and 'disambiguation' in page.get('pageprops', {}):
+            continue
+        if page.get('length', 0) < RANDOM_POOL_MIN_BYTES:
+            continue
+        url = page.get('fullurl')
+        if is_safe_url(url):
+            urls.append(url)
+    return urls
+
 def extract_wiki_links(url):
     """指定されたWikipediaページのリンクを抽出"""
     try:
-        response = requests.get(url)
-        from bs4 import BeautifulSoup
+        response = upstream.get(url, site='page_links', revalidate=True)
         soup = BeautifulSoup(response.text, 'html.parser')
         
         # メインコンテンツ内のWikipediaリンクを抽出
@@ -70,12 +252,68 @@ def extract_wiki_links(url):
                 # 特殊ページを除外
                 if ':' not in full_url:
                     links.append(full_url)
+                    # リンクのtitle属性はリンク先の記事タイトル（check-target用に記録）
+                    remember_title(full_url, a.get('title'))
         
         return list(set(links))
     except Exception as e:
         print(f"リンク抽出エラー: {e}")
         return []
 
+# 難易度別のページ一覧（起動時に読み込み、ファイル更新時は自動で再読み込み）
+DIFFICULTIES = ['easy', 'medium', 'hard']
+corpus = CorpusRegistry(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gamedata'),
+    DIFFICULTIES,
+    url_filter=is_safe_url
+)
+
+# 「当てる」モードの正解表記の索引（コーパスのページは起動時にバックグラウンドで作成）
+answer_index = AnswerIndex()
+
+def build_answer_index():
+    for difficulty in DIFFICULTIES:
+        answer_index.build(corpus.get(difficulty) or ())
+
+# 記事間リンクのストア（mmapしたファイルをワーカープロセス間で共有）と最短経路ソルバー
+LINK_STORE_PATH = os.environ.get(
+    'WIKIGAME_LINK_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'linkgraph.wgls')
+)
+LINK_STORE_SAVE_INTERVAL = int(os.environ.get('WIKIGAME_LINK_STORE_SAVE_INTERVAL', 300))  # 秒
+link_store = LinkStore(LINK_STORE_PATH)
+link_graph = LinkGraph(
+    functools.partial(upstream.get, site='link_graph'),
+    link_store,
+    max_workers=int(os.environ.get('WIKIGAME_LINK_FETCH_WORKERS', 8))
+)
+path_solver = ShortestPathSolver(
+    link_graph,
+    max_depth=int(os.environ.get('WIKIGAME_SOLVER_MAX_DEPTH', 6)),
+    time_budget=float(os.environ.get('WIKIGAME_SOLVER_TIME_BUDGET', 10))
+)
+
+def link_store_maintenance():
+    """取得したリンクを定期的にファイルへ保存し、他のプロセスの保存結果を読み込む"""
+    while True:
+        socketio.sleep(LINK_STORE_SAVE_INTERVAL)
+        try:
+            if link_store.dirty:
+                link_store.save()
+            else:
+                link_store.reload_if_changed()
+        except Exception as e:
+            print(f"リンクストア保存エラー: {e}")
+
+# 事前取得したランダムページのプール
+random_page_pool = RandomPagePool(
+    fetch_random_pages,
+    get_random_wikipedia_page,
+    size=RANDOM_POOL_SIZE,
+    low_water=RANDOM_POOL_LOW_WATER,
+    spawn=socketio.start_background_task
+)
+
 @app.route('/')
 def index():
     """新しいトップページ"""
@@ -86,6 +324,46 @@ def wikipedia_game():
     """シングルプレイヤー Wikipedia ゲームページ"""
     return render_template('wikipedia_game.html')
 
+CHECK_TARGET_BATCH_LIMIT = 200  # バッチ判定で一度に受け付けるURL数
+
+def remember_title(url, title):
+    """URLの表示タイトルを索引に登録する"""
+    if title:
+        title_cache.set(canonical_page_url(url), title)
+
+def resolve_page_title(url):
+    """URLの表示タイトルを返す（通信はせず、索引に無ければURLから求める）"""
+    return title_cache.get(canonical_page_url(url)) or url_to_title(url) or ''
+
+def canonical_page_title(url):
+    """リダイレクトを解決した記事タイトル（リンクストアに記録済みのリダイレクトのみ）"""
+    title = resolve_page_title(url)
+    node_id = link_store.id_of(title) if title else None
+    if node_id is None:
+        return title
+    return link_store.title_of(link_store.redirect_target(node_id))
+
+def target_check_result(current_url, target_url):
+    from urllib.parse import unquote
+    current_path = unquote(urlparse(current_url).path)
+    target_path = unquote(urlparse(target_url).path)
+
+    # パスが一致するか（大文字小文字を無視）、リダイレクトを解決して同じ記事ならゴール
+    # （記事ではないページはタイトルが空になるため、タイトルでの比較は両方が記事の場合に限る）
+    is_target = current_path.lower() == target_path.lower()
+    if not is_target:
+        current_title = canonical_page_title(current_url)
+        target_title = canonical_page_title(target_url)
+        is_target = bool(current_title and target_title) and current_title == target_title
+
+    title = resolve_page_title(current_url)
+    return {
+        'is_target': is_target,
+        'current_path': current_path,
+        'target_path': target_path,
+        'title': f"{title} - Wikipedia" if title else ''
+    }
+
 @app.route('/api/check-target')
 def check_target():
     """目標ページに到達したかチェック"""
@@ -94,37 +372,38 @@ def check_target():
 
     if not is_safe_url(current_url) or not is_safe_url(target_url):
         return jsonify({'error': '無効なURLです。WikipediaのURLを指定してください。'}), 400
-    
-    # URLからパス部分を抽出してデコード
-    from urllib.parse import urlparse, unquote
-    current_path = unquote(urlparse(current_url).path)
-    target_path = unquote(urlparse(target_url).path)
-    
-    # パスが一致するかチェック（大文字小文字を無視）
-    is_target = current_path.lower() == target_path.lower()
-    
-    print(f"比較: {current_path} vs {target_path} = {is_target}")
-    
-    # タイトル取得（オプション）
-    title = ""
-    try:
-        response = requests.get(current_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title = soup.title.string if soup.title else ""
-    except:
-        pass
-    
-    return jsonify({
-        'is_target': is_target,
-        'current_path': current_path,
-        'target_path': target_path,
-        'title': title
-    })
+
+    return jsonify(target_check_result(current_url, target_url))
+
+@app.route('/api/check-target/batch', methods=['POST'])
+def check_target_batch():
+    """複数のページについて目標ページに到達したかをまとめてチェック
+
+    リクエスト: {"target": URL, "current": [URL, ...]}
+    """
+    data = request.get_json(silent=True) or {}
+    target_url = data.get('target', 'https://ja.wikipedia.org/wiki/日本')
+    current_urls = data.get('current')
+
+    if not isinstance(current_urls, list) or not is_safe_url(target_url):
+        return jsonify({'error': 'target と current（URLの配列）を指定してください。'}), 400
+    if len(current_urls) > CHECK_TARGET_BATCH_LIMIT:
+        return jsonify({'error': f'一度にチェックできるのは{CHECK_TARGET_BATCH_LIMIT}件までです。'}), 400
+
+    results = []
+    for current_url in current_urls:
+        if not isinstance(current_url, str) or not is_safe_url(current_url):
+            results.append({'current': current_url, 'error': '無効なURLです。'})
+            continue
+        result = target_check_result(current_url, target_url)
+        result['current'] = current_url
+        results.append(result)
+    return jsonify({'target': target_url, 'results': results})
 
 @app.route('/api/random-page')
 def random_page():
     """ランダムなWikipediaページを取得"""
-    url = get_random_wikipedia_page()
+    url = random_page_pool.pop()
     return jsonify({'url': url})
 
 @app.route('/api/difficulty-page')
@@ -133,34 +412,24 @@ def difficulty_page():
     difficulty = request.args.get('difficulty', 'easy')
     
     # 有効な難易度チェック
-    valid_difficulties = ['easy', 'medium', 'hard']
-    if difficulty not in valid_difficulties:
+    if difficulty not in DIFFICULTIES:
         return jsonify({'error': '無効な難易度です。easy, medium, hardのいずれかを指定してください。'}), 400
     
     try:
-        # 難易度ファイルのパス
-        file_path = os.path.join('gamedata', f'{difficulty}.txt')
-        
+        urls = corpus.get(difficulty)
+
         # ファイルが存在するかチェック
-        if not os.path.exists(file_path):
+        if urls is None:
             return jsonify({'error': f'{difficulty}.txtファイルが見つかりません。'}), 404
-        
-        # ファイルからランダムにURLを選択
-        with open(file_path, 'r', encoding='utf-8') as file:
-            urls = [line.strip() for line in file if line.strip()]
-            
+
         if not urls:
             return jsonify({'error': f'{difficulty}.txtファイルが空です。'}), 404
-            
-        # ランダムに1つ選択
-        selected_url = random.choice(urls)
-        
-        # URLの安全性チェック
-        if not is_safe_url(selected_url):
-            return jsonify({'error': '無効なURLが含まれています。'}), 400
-            
+
+        # ランダムに1つ選択（読み込み時にURLの安全性チェック済み）
+        selected_url = corpus.sample(difficulty)
+
         return jsonify({'url': selected_url})
-        
+
     except Exception as e:
         return jsonify({'error': f'ファイル読み込みエラー: {str(e)}'}), 500
 
@@ -186,7 +455,7 @@ def search_wikipedia():
             'format': 'json'
         }
         
-        response = requests.get(search_url, params=params, timeout=5)
+        response = upstream.get(search_url, params=params, timeout=5, site='search')
         response.raise_for_status()
         
         data = response.json()
@@ -219,118 +488,204 @@ def page_links():
     if not is_safe_url(url):
         return jsonify({'error': '無効なURLです。WikipediaのURLを指定してください。'}), 400
     links = extract_wiki_links(url)
+    # 取得したリンクは最短経路探索用のリンクキャッシュにも登録しておく
+    title = url_to_title(url)
+    if title and links:
+        link_graph.store_outlinks(title, filter(None, map(url_to_title, links)))
     return jsonify({'links': links})
 
+@app.route('/api/shortest-path')
+def shortest_path():
+    """2つのページ間の最短クリック数と経路を求める"""
+    from_url = request.args.get('from')
+    to_url = request.args.get('to', 'https://ja.wikipedia.org/wiki/日本')
+    if not is_safe_url(from_url) or not is_safe_url(to_url):
+        return jsonify({'error': '無効なURLです。WikipediaのURLを指定してください。'}), 400
+
+    start_title = url_to_title(from_url)
+    target_title = url_to_title(to_url)
+    if not start_title or not target_title:
+        return jsonify({'error': '記事のURLを指定してください。'}), 400
+
+    try:
+        result = path_solver.solve(start_title, target_title)
+    except Exception as e:
+        print(f"最短経路探索エラー: {e}")
+        return jsonify({'error': f'最短経路の探索に失敗しました: {str(e)}'}), 502
+
+    return jsonify({
+        'found': result['found'],
+        'distance': result['distance'],
+        'path': [title_to_url(title) for title in result['path']] if result['path'] else [],
+        'complete': result['complete']
+    })
+
+def fetch_page(url):
+    """プロキシするWikipediaページのHTMLを取得する（保存済みの応答はETag / Last-Modifiedで再検証する）"""
+    response = upstream.get(url, site='proxy', revalidate=True)
+    # リトライしても失敗した場合はエラーページをキャッシュしないよう例外にする
+    if response.status_code >= 500:
+        response.raise_for_status()
+    return response.text
+
+def render_page(url, game_mode):
+    """Wikipediaページを取得し、ゲーム表示用に加工したHTMLを返す
+
+    戻り値は (HTML, ページタイトル) のタプル。タイトルが見つからなかった場合は None。
+    """
+    # スクリプト・危険な属性・不要なUI部品の削除とリンクの絶対URL化を1回の走査で行う
+    # 「当てる」モードでは本文中のタイトルもサニタイズと同じ走査で隠す
+    return sanitize_html(fetch_page(url), mask_title=(game_mode == 'guessing'))
+
+def cache_rendered_page(url, game_mode, cache_key, page):
+    page_cache.set(cache_key, page, size=page.size)
+    remember_title(url, page.title)
+    # 表示されたタイトル（リダイレクト先など）も正解として受け付ける
+    if page.title and game_mode == 'guessing':
+        answer_index.add_title(url, page.title)
+
+def proxy_headers(response, encoding):
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = PROXY_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+def page_etag(content, game_mode):
+    """加工済みページの強いETag
+
+    加工結果は取得したHTMLとモードだけで決まるので、加工を終える前（送り始める前）に求められる。
+    """
+    return content_etag(f'{game_mode}\n{content}'.encode('utf-8'))
+
+def stream_page(url, game_mode, cache_key, encoding):
+    """取得したページをサニタイズしながら少しずつ（圧縮して）送り、送り終えたらキャッシュに保存する"""
+    # 取得の失敗はストリームを始める前にエラー応答にする
+    content = fetch_page(url)
+    etag = page_etag(content, game_mode)
+    sanitizer = create_sanitizer(content, mask_title=(game_mode == 'guessing'))
+
+    def generate():
+        parts = []
+        compressed = []
+        compressor = StreamCompressor(encoding) if encoding else None
+        for html_part in sanitizer.iter_sanitize(content, PROXY_STREAM_CHUNK):
+            data = html_part.encode('utf-8')
+            parts.append(data)
+            if compressor:
+                data = compressor.compress(data)
+                compressed.append(data)
+            if data:
+                yield data
+        if compressor:
+            data = compressor.finish()
+            compressed.append(data)
+            yield data
+        body = b''.join(parts)
+        # 送った圧縮済みの本文も、次回からそのまま返せるように保存する
+        variants = {encoding: b''.join(compressed)} if encoding else None
+        cache_rendered_page(url, game_mode, cache_key, RenderedPage(body, sanitizer.title_text, etag, variants))
+
+    response = proxy_headers(Response(generate(), content_type='text/html; charset=utf-8'), encoding)
+    # make_conditional が Content-Length を求めるために本文を読み切らないようにする
+    response.implicit_sequence_conversion = False
+    response.set_etag(RenderedPage.etag_for_encoding(etag, encoding))
+    # ブラウザが同じ内容を持っていれば、加工せずに304を返す
+    return response.make_conditional(request)
+
+def send_rendered_page(page, cache_key, encoding):
+    """キャッシュ済みのページを返す（ブラウザが同じ内容を持っていれば304で本文を省く）"""
+    body = page.body
+    if encoding:
+        body, created = page.variant(encoding)
+        # 圧縮済みの本文の分もキャッシュの大きさに数える（入りきらない場合は圧縮済みの本文を保存しない）
+        if created and not page_cache.resize(cache_key, page, page.size):
+            page.variants.pop(encoding, None)
+    response = proxy_headers(Response(body, content_type='text/html; charset=utf-8'), encoding)
+    response.set_etag(page.etag_for(encoding))
+    return response.make_conditional(request)
+
 @app.route('/proxy')
 def proxy():
     """ウェブページをプロキシ"""
     url = request.args.get('url')
     game_mode = request.args.get('mode', 'navigation')  # デフォルトはナビゲーションモード
-    room_id = request.args.get('room_id', '')  # ルームIDがあれば取得
     
     if not is_safe_url(url):
         return "無効なURLです。WikipediaのURLを指定してください。", 400
     try:
-        response = requests.get(url)
-        
-        # HTMLを取得
-        content = response.text
-        
-        # CSSリンクを絶対パスに変換
-        content = content.replace('href="/w/', 'href="https://ja.wikipedia.org/w/')
-        content = content.replace('href="/static/', 'href="https://ja.wikipedia.org/static/')
-        
-        # BeautifulSoupを使用してスクリプトや危険な属性を削除
-        soup = BeautifulSoup(content, 'html.parser')
-
-        # scriptタグとstyleタグを削除
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-
-        # イベントハンドラ属性とjavascript:リンクを削除
-        for tag in soup.find_all(True): # すべてのタグを対象
-            attrs_to_remove = []
-            for attr_name, attr_value in tag.attrs.items():
-                if attr_name.lower().startswith('on'): # on* イベントハンドラ
-                    attrs_to_remove.append(attr_name)
-                elif attr_name.lower() in ['href', 'src', 'action', 'formaction'] and \
-                     isinstance(attr_value, str) and attr_value.lower().startswith('javascript:'): # javascript:プロトコル
-                    attrs_to_remove.append(attr_name)
-            for attr_name in attrs_to_remove:
-                del tag[attr_name]
-        
-        # リンクを絶対パスに変換 (これは安全な操作なので残す)
-        # ただし、soupオブジェクトに対して行う方がより堅牢
-        for a_tag in soup.find_all('a', href=True):
-            if a_tag['href'].startswith('/wiki/'):
-                a_tag['href'] = f"https://ja.wikipedia.org{a_tag['href']}"
-        
-        content = str(soup) # 更新されたHTMLを取得
+        # 加工済みページはURLとモードごとに（圧縮済みの本文と一緒に）キャッシュする
+        cache_key = (canonical_page_url(url), 'guessing' if game_mode == 'guessing' else 'navigation')
+        encoding = negotiate_encoding(request.accept_encodings) if PROXY_COMPRESSION else None
+        page = page_cache.get(cache_key)
+        if page is None:
+            return stream_page(url, game_mode, cache_key, encoding)
+        return send_rendered_page(page, cache_key, encoding)
+    except UpstreamBusy as e:
+        return f"プロキシエラー: {e}", 503, {'Retry-After': '1'}
+    except Exception as e:
+        return f"プロキシエラー: {e}", 500
 
-        # soupオブジェクトをコピーして既存の要素削除処理に使用
-        soup_for_removal = BeautifulSoup(content, 'html.parser')
-        # class属性が'vector-header-container'を持つdivタグを検索して削除
-        for div in soup_for_removal.find_all('div', class_='vector-header-container'):
-            div.decompose()
+@app.route('/api/cache-stats')
+def cache_stats():
+    """プロキシキャッシュの統計情報を取得"""
+    return jsonify({
+        'page_cache': page_cache.stats(),
+        'title_cache': title_cache.stats(),
+        'upstream_validators': upstream_validators.stats(),
+        'upstream': upstream.stats(),
+        'random_page_pool': random_page_pool.stats(),
+        'link_store': link_store.stats(),
+        'answer_index': answer_index.stats(),
+        'state_store': state_store.stats(),
+        'room_sweeper': room_sweeper.stats()
+    })
 
-        for div in soup_for_removal.find_all('div', class_='mw-footer-container'):
-            div.decompose()
-        
-        for div in soup_for_removal.find_all('div', id='p-lang-btn'):
-            div.decompose()
+def cache_metrics(key):
+    """キャッシュごとの統計値（出力時に求める）"""
+    caches = {'page': page_cache, 'title': title_cache, 'shortest_path': path_solver.results}
+    values = {(name,): cache.stats()[key] for name, cache in caches.items()}
+    # ランダムページのプールは、プールから返せた回数をヒットとして扱う
+    pool = random_page_pool.stats()
+    served = pool['served_from_pool'] + pool['served_from_fallback']
+    values[('random_page_pool',)] = {
+        'hits': pool['served_from_pool'],
+        'misses': pool['served_from_fallback'],
+        'hit_ratio': pool['served_from_pool'] / served if served else 0.0
+    }.get(key, 0)
+    return values
 
-        for div in soup_for_removal.find_all('div', class_='vector-page-toolbar'):
-            div.decompose()
+def room_metrics():
+    counts = {(status,): 0 for status in ROOM_TTLS}
+    for _, room in list(rooms.items()):
+        counts[(room.status,)] = counts.get((room.status,), 0) + 1
+    return counts
 
-        for div in soup_for_removal.find_all('div', class_='mw-editsection'):
-            div.decompose()
+def game_metrics():
+    counts = {('playing',): 0, ('finished',): 0}
+    for _, game_state in list(game_states.items()):
+        counts[('finished' if game_state.finished else 'playing',)] += 1
+    return counts
 
-        # ゲームモードが「当てる」モードの場合、タイトルをXで置き換える
-        if game_mode == 'guessing':
-            # タイトル要素を取得（ページ名部分）
-            element = soup_for_removal.select_one("body > div > div > div:nth-child(3) > main > header > h1 > span")
-            
-            if element:
-                original_text = element.text  # 元の文字列を取得
-                replaced_text = "X" * len(original_text)  # 元の文字列の長さ分のXに置き換え
-                element.string = replaced_text  # 要素の内容を置き換え
-                
-                # 括弧付きタイトルの場合、括弧前の部分を抽出
-                aresult = re.match(r"(.+?)_\(.+\)", original_text)
-                if aresult:
-                    extracted_text = aresult.group(1)
-                    original_text = extracted_text
-                
-                # ひらがなとローマ字変換
-                kksresult = kks.convert(original_text)
-                hiratext = ''.join([item['hira'] for item in kksresult])
-                replaced_hiratext = "X" * len(hiratext)
-                romazitext = ' '.join([item['hepburn'] for item in kksresult])
-                replaced_romazitext = "X" * len(romazitext)
-                
-                # ページ内の全てのテキストから元のタイトルを置換
-                modified_html = str(soup_for_removal)
-                modified_html = modified_html.replace(original_text, replaced_text)
-                modified_html = modified_html.replace(hiratext, replaced_hiratext)
-                modified_html = modified_html.replace(romazitext, replaced_romazitext)
-                
-                # ルームIDがある場合、ページタイトルを保存しておく（答え合わせ用）
-                if room_id and room_id in rooms:
-                    if 'current_pages' not in rooms[room_id]:
-                        rooms[room_id]['current_pages'] = {}
-                    # デコードして_を空白に置き換え
-                    from urllib.parse import unquote
-                    page_path = urlparse(url).path
-                    page_title = unquote(page_path.split('/')[-1]).replace('_', ' ')
-                    rooms[room_id]['current_pages'][url] = page_title
-                
-                return modified_html
-        
-        # 通常のナビゲーションモードではそのまま表示
-        modified_html = str(soup_for_removal)
-        return modified_html
-    except Exception as e:
-        return f"プロキシエラー: {e}", 500
+metrics.gauge('rooms', '状態ごとのルーム数', ['status'], collect=room_metrics)
+metrics.gauge('players', 'ルームに参加しているプレイヤー数', collect=lambda: {(): len(player_rooms)})
+metrics.gauge('games', '状態ごとのゲーム数', ['state'], collect=game_metrics)
+metrics.counter('cache_hits_total', 'キャッシュのヒット数', ['cache'], collect=lambda: cache_metrics('hits'))
+metrics.counter('cache_misses_total', 'キャッシュのミス数', ['cache'], collect=lambda: cache_metrics('misses'))
+metrics.gauge('cache_hit_ratio', 'キャッシュのヒット率', ['cache'], collect=lambda: cache_metrics('hit_ratio'))
+metrics.gauge('upstream_in_flight', 'Wikipediaへの送信中のリクエスト数',
+              collect=lambda: {(): upstream.stats()['in_flight']})
+metrics.gauge('upstream_waiting', 'Wikipediaへの同時リクエスト数の空きを待っているリクエスト数',
+              collect=lambda: {(): upstream.stats()['waiting']})
+metrics.counter('upstream_rejected_total', '同時リクエスト数の上限により拒否したリクエスト数',
+                collect=lambda: {(): upstream.stats()['rejected']})
+metrics.counter('upstream_not_modified_total', 'Wikipediaが304を返し、保存した本文を再利用したリクエスト数',
+                collect=lambda: {(): upstream.stats()['not_modified']})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheusのテキスト形式で計測値を返す（ワーカープロセスごとの値）"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 # 新しいルートを追加
 @app.route('/multiplayer')
@@ -339,101 +694,113 @@ def multiplayer():
     return render_template('multiplayer.html')
 
 # WebSocketイベントハンドラ
-@socketio.on('connect')
-def handle_connect():
+@socket_event('connect')
+def handle_connect(auth=None):
     """クライアント接続時の処理"""
     player_id = request.sid
+    CONNECTED_CLIENTS.inc()
     emit('connection_response', {'status': 'connected', 'player_id': player_id})
     print(f"Player connected: {player_id}")
 
-@socketio.on('disconnect')
-def handle_disconnect():
+def depart_room(player_id, room_id):
+    """プレイヤーを部屋から外し、残りのプレイヤーに通知する（切断・退出の共通処理）
+
+    ゲーム中の場合はゲーム状態からも外し、残りの全員が終了していればゲームを終える。
+    """
+    if room_id not in rooms:
+        return
+    room = rooms[room_id]
+    game_state = game_states.get(room_id)
+    
+    # ゲーム中かどうかをチェック
+    is_during_game = room.status == 'playing' and game_state is not None
+    
+    # 部屋から退出
+    leave_room(room_id)
+    # プレイヤー情報も削除
+    room.remove_player(player_id)
+    
+    # 部屋が空になったら削除
+    if len(room.players) == 0:
+        del rooms[room_id]
+        if room_id in game_states:
+            del game_states[room_id]
+        corpus.release(room_id)
+        lobby.remove(room_id)
+        end_spectating(room_id)
+        return
+
+    # ホストが退出した場合は新しいホストを設定
+    if room.host == player_id and room.players:
+        room.host = room.players[0]
+    lobby.update(room)
+    
+    # ゲーム中の場合の特別処理
+    if is_during_game:
+        # ゲーム状態からも離脱したプレーヤーを削除
+        game_state.remove_player(player_id)
+        
+        # 残りのプレイヤーに通知（ゲーム中フラグ付き）
+        emit('player_left', dict(
+            player_delta(room_id, game_state, player_id),
+            room_info=room,
+            during_game=True
+        ), room=room_id)
+
+        # 残りの全員が終了していればゲームを終える
+        finish_game_if_done(room_id, room, game_state)
+    else:
+        # 通常の離脱通知
+        emit('player_left', {
+            'player_id': player_id,
+            'room_info': room
+        }, room=room_id)
+
+@socket_event('disconnect')
+def handle_disconnect(reason=None):
     """クライアント切断時の処理"""
     player_id = request.sid
+    CONNECTED_CLIENTS.dec()
     # プレイヤーが部屋に参加していれば、部屋から削除
     if player_id in player_rooms:
-        room_id = player_rooms[player_id]
-        if room_id in rooms:
-            room = rooms[room_id]
-            game_state = game_states.get(room_id)
-            
-            # ゲーム中かどうかをチェック
-            is_during_game = room['status'] == 'playing' and game_state is not None
-            
-            # 部屋から退出
-            leave_room(room_id)
-            rooms[room_id]['players'].remove(player_id)
-            
-            # プレイヤー情報も削除
-            if player_id in room['player_info']:
-                del room['player_info'][player_id]
-            
-            # 部屋が空になったら削除
-            if len(rooms[room_id]['players']) == 0:
-                del rooms[room_id]
-                if room_id in game_states:
-                    del game_states[room_id]
-            else:
-                # ホストが退出した場合は新しいホストを設定
-                if room['host'] == player_id and room['players']:
-                    room['host'] = room['players'][0]
-                
-                # ゲーム中の場合の特別処理
-                if is_during_game:
-                    # ゲーム状態からも離脱したプレーヤーを削除
-                    if player_id in game_state['player_states']:
-                        del game_state['player_states'][player_id]
-                    
-                    # 残りのプレイヤーに通知（ゲーム中フラグ付き）
-                    emit('player_left', {
-                        'player_id': player_id,
-                        'room_info': room,
-                        'game_state': game_state,
-                        'during_game': True
-                    }, room=room_id)
-                else:
-                    # 通常の離脱通知
-                    emit('player_left', {
-                        'player_id': player_id,
-                        'room_info': room
-                    }, room=room_id)
-        
+        depart_room(player_id, player_rooms[player_id])
         # プレイヤーの部屋情報を削除
         del player_rooms[player_id]
     
     print(f"Player disconnected: {player_id}")
 
-@socketio.on('create_room')
+@socket_event('create_room')
 def handle_create_room(data):
     """新しいゲームルームを作成"""
     player_id = request.sid
     raw_username = data.get('username', f'プレイヤー{random.randint(1000, 9999)}')
     username = html.escape(raw_username)
     
+    # トーナメントルームは定員を指定できる（2人以上、上限は TOURNAMENT_MAX_PLAYERS）
+    tournament = bool(data.get('tournament'))
+    max_players = ROOM_MAX_PLAYERS
+    if tournament:
+        try:
+            max_players = int(data.get('max_players', TOURNAMENT_MAX_PLAYERS))
+        except (TypeError, ValueError):
+            emit('error', {'message': '定員が無効です'})
+            return
+        max_players = min(max(max_players, 2), TOURNAMENT_MAX_PLAYERS)
+    
     # 新しいルームIDを生成
     room_id = str(uuid.uuid4())[:8]
     
-    # ルーム情報を保存
-    rooms[room_id] = {
-        'id': room_id,
-        'name': f"{username}の部屋", # usernameは既にエスケープ済み
-        'host': player_id,
-        'players': [player_id],
-        'player_info': {player_id: {'username': username, 'ready': False}},
-        'status': 'waiting',  # waiting, playing, finished
-        'max_players': 4,
-        'target_url': 'https://ja.wikipedia.org/wiki/日本',  # 初期デフォルト値
-        'settings': {
-            'allow_ctrl_f': True, # デフォルトでCtrl+Fを許可
-            'game_mode': 'navigation',  # デフォルトはナビゲーションモード (navigation/guessing)
-            'difficulty': 'easy'  # デフォルト難易度
-        }
-    }
+    # ルーム情報を保存（設定の既定値: Ctrl+F許可・ナビゲーションモード・easy）
+    room = rooms[room_id] = Room(room_id, f"{username}の部屋", player_id, # usernameは既にエスケープ済み
+                                 max_players=max_players, tournament=tournament)
+    room.add_player(player_id, username)
+    lobby.update(room)
     
     # プレイヤーをルームに紐付け
     player_rooms[player_id] = room_id
     
-    # ルームに参加
+    # ルームに参加（ロビーの更新通知は受け取らない）
+    leave_room(LOBBY_CHANNEL)
     join_room(room_id)
     
     emit('room_created', {
@@ -443,7 +810,7 @@ def handle_create_room(data):
     
     print(f"Room created: {room_id} by {username} ({player_id})")
 
-@socketio.on('join_room')
+@socket_event('join_room')
 def handle_join_room(data):
     """既存のゲームルームに参加"""
     player_id = request.sid
@@ -458,22 +825,23 @@ def handle_join_room(data):
     room = rooms[room_id]
     
     # 部屋が満員かゲーム中の場合は参加できない
-    if len(room['players']) >= room['max_players']:
+    if len(room.players) >= room.max_players:
         emit('error', {'message': '部屋が満員です'})
         return
     
-    if room['status'] != 'waiting':
+    if room.status != 'waiting':
         emit('error', {'message': 'ゲームはすでに始まっています'})
         return
     
     # プレイヤーを部屋に追加
-    room['players'].append(player_id)
-    room['player_info'][player_id] = {'username': username, 'ready': False}
+    room.add_player(player_id, username)
+    lobby.update(room)
     
     # プレイヤーをルームに紐付け
     player_rooms[player_id] = room_id
     
-    # ルームに参加
+    # ルームに参加（ロビーの更新通知は受け取らない）
+    leave_room(LOBBY_CHANNEL)
     join_room(room_id)
     
     # 全プレイヤーに通知
@@ -485,7 +853,7 @@ def handle_join_room(data):
     
     print(f"Player {username} ({player_id}) joined room {room_id}")
 
-@socketio.on('toggle_ready')
+@socket_event('toggle_ready')
 def handle_toggle_ready():
     """プレイヤーの準備状態を切り替え"""
     player_id = request.sid
@@ -498,8 +866,8 @@ def handle_toggle_ready():
     room = rooms[room_id]
     
     # 準備状態を切り替え
-    current_ready = room['player_info'][player_id]['ready']
-    room['player_info'][player_id]['ready'] = not current_ready
+    current_ready = room.player_info[player_id].ready
+    room.player_info[player_id].ready = not current_ready
     
     # 全プレイヤーに通知
     emit('player_ready_changed', {
@@ -509,11 +877,11 @@ def handle_toggle_ready():
     }, room=room_id)
     
     # 全員が準備完了していれば、ゲーム開始可能な状態にする
-    all_ready = all(info['ready'] for info in room['player_info'].values())
-    if all_ready and len(room['players']) >= 2:
+    all_ready = all(info.ready for info in room.player_info.values())
+    if all_ready and len(room.players) >= 2:
         emit('all_players_ready', {'room_info': room}, room=room_id)
 
-@socketio.on('set_target_url')
+@socket_event('set_target_url')
 def handle_set_target_url(data):
     """ホストが目標URLを設定"""
     player_id = request.sid
@@ -526,11 +894,11 @@ def handle_set_target_url(data):
 
     room = rooms[room_id]
 
-    if room['host'] != player_id:
+    if room.host != player_id:
         emit('error', {'message': 'ホストのみが目標URLを設定できます'})
         return
 
-    if room['status'] != 'waiting':
+    if room.status != 'waiting':
         emit('error', {'message': 'ゲーム待機中のみ目標URLを設定できます'})
         return
 
@@ -541,7 +909,7 @@ def handle_set_target_url(data):
         return
 
     escaped_target_url = html.escape(raw_target_url) # WebSocketで送信する前にエスケープ
-    room['target_url'] = raw_target_url # DBには元のURLを保存（表示時にエスケープするため）
+    room.target_url = raw_target_url # DBには元のURLを保存（表示時にエスケープするため）
 
     emit('target_url_updated', {
         'room_id': room_id,
@@ -550,7 +918,7 @@ def handle_set_target_url(data):
     }, room=room_id)
     print(f"Room {room_id} target URL set to: {raw_target_url}")
 
-@socketio.on('update_room_settings')
+@socket_event('update_room_settings')
 def handle_update_room_settings(data):
     """ホストがルーム設定を更新"""
     player_id = request.sid
@@ -563,145 +931,190 @@ def handle_update_room_settings(data):
 
     room = rooms[room_id]
 
-    if room['host'] != player_id:
+    if room.host != player_id:
         emit('error', {'message': 'ホストのみが設定を変更できます'})
         return
 
-    if room['status'] != 'waiting':
+    if room.status != 'waiting':
         emit('error', {'message': 'ゲーム待機中のみ設定を変更できます'})
         return
 
     if settings_data:
-        # 設定が初期化されていない場合は初期化
-        if 'settings' not in room:
-            room['settings'] = {'allow_ctrl_f': True, 'game_mode': 'navigation', 'difficulty': 'easy'}
-            
         # Ctrl+F設定更新
         if 'allow_ctrl_f' in settings_data:
-            room['settings']['allow_ctrl_f'] = bool(settings_data['allow_ctrl_f'])
+            room.settings.allow_ctrl_f = bool(settings_data['allow_ctrl_f'])
             
         # ゲームモード設定更新
         if 'game_mode' in settings_data:
             if settings_data['game_mode'] in ['navigation', 'guessing']:
-                room['settings']['game_mode'] = settings_data['game_mode']
+                room.settings.game_mode = settings_data['game_mode']
                 
         # 難易度設定更新
         if 'difficulty' in settings_data:
             if settings_data['difficulty'] in ['easy', 'medium', 'hard']:
-                room['settings']['difficulty'] = settings_data['difficulty']
+                room.settings.difficulty = settings_data['difficulty']
     
+    lobby.update(room)
+
     # 更新されたルーム情報をブロードキャスト
     # 'room_info' には更新された settings が含まれるようにする
     emit('room_settings_updated', {
         'room_id': room_id,
-        'settings': room['settings'], # 個別の settings も送る
+        'settings': room.settings, # 個別の settings も送る
         'room_info': room # room全体も送る（これに settings が含まれる）
     }, room=room_id)
-    print(f"Room {room_id} settings updated: {room['settings']}")
+    print(f"Room {room_id} settings updated: {room.settings}")
 
-@socketio.on('start_game')
-def handle_start_game():
-    """ゲームを開始"""
-    player_id = request.sid
-    
+def startable_room(player_id):
+    """プレイヤーがゲームを開始できるルームを (ルームID, ルーム, エラーメッセージ) で返す"""
     if player_id not in player_rooms:
-        emit('error', {'message': '部屋に参加していません'})
-        return
+        return None, None, '部屋に参加していません'
     
     room_id = player_rooms[player_id]
     room = rooms[room_id]
     
     # ホストのみがゲームを開始できる
-    if room['host'] != player_id:
-        emit('error', {'message': 'ホストのみがゲームを開始できます'})
-        return
+    if room.host != player_id:
+        return room_id, room, 'ホストのみがゲームを開始できます'
     
     # 全員の準備が完了していない場合はエラー
-    all_ready = all(info['ready'] for info in room['player_info'].values() if player_id != room['host'])
-    if not all_ready and len(room['players']) > 1:
-        emit('error', {'message': '全員の準備が完了していません'})
-        return
+    all_ready = all(info.ready for info in room.player_info.values() if player_id != room.host)
+    if not all_ready and len(room.players) > 1:
+        return room_id, room, '全員の準備が完了していません'
     
     # 最低2人必要
-    if len(room['players']) < 2:
-        emit('error', {'message': '最低2人のプレイヤーが必要です'})
+    if len(room.players) < 2:
+        return room_id, room, '最低2人のプレイヤーが必要です'
+    return room_id, room, None
+
+@socket_event('start_game')
+def handle_start_game():
+    """ゲームを開始"""
+    player_id = request.sid
+    
+    room_id, room, error = startable_room(player_id)
+    if error:
+        emit('error', {'message': error})
         return
     
     # ゲームモードに応じてスタートページを生成
-    game_mode = room.get('settings', {}).get('game_mode', 'navigation')
+    game_mode = room.settings.game_mode
     
     if game_mode == 'guessing':
         # ページ名当てモードの場合は難易度に応じたページを選択
-        difficulty = room.get('settings', {}).get('difficulty', 'easy')
+        difficulty = room.settings.difficulty
         try:
-            # 難易度ファイルのパス
-            file_path = os.path.join('gamedata', f'{difficulty}.txt')
-            
+            urls = corpus.get(difficulty)
+
             # ファイルが存在するかチェック
-            if not os.path.exists(file_path):
+            if urls is None:
                 emit('error', {'message': f'{difficulty}.txtファイルが見つかりません。'})
                 return
-            
-            # ファイルからランダムにURLを選択
-            with open(file_path, 'r', encoding='utf-8') as file:
-                urls = [line.strip() for line in file if line.strip()]
-                
+
             if not urls:
                 emit('error', {'message': f'{difficulty}.txtファイルが空です。'})
                 return
-                
-            # ランダムに1つ選択
-            start_url = random.choice(urls)
-            
-            # URLの安全性チェック
-            if not is_safe_url(start_url):
-                emit('error', {'message': '無効なURLが含まれています。'})
-                return
-                
+
+            # ルーム内で同じページが繰り返し出ないように選択（URLは読み込み時に検証済み）
+            start_url = corpus.sample(difficulty, key=room_id)
+
         except Exception as e:
             emit('error', {'message': f'難易度ファイル読み込みエラー: {str(e)}'})
             return
     else:
-        # ナビゲーションモードの場合は従来通りランダムページ
-        start_url = get_random_wikipedia_page() # これはWikipediaなので安全
-    
-    # room['target_url'] は is_safe_url で検証済み
-    target_url = room.get('target_url', 'https://ja.wikipedia.org/wiki/日本')
-    
-    # ゲーム状態を初期化
-    game_states[room_id] = {
-        'start_url': start_url, # 安全なURL
-        'target_url': target_url, # 安全なURL
-        'player_states': {
-            player_id: {
-                'current_url': start_url, # 安全なURL
-                'moves': 0,
-                'path': [start_url],
-                'finished': False,
-                'finish_time': None,
-                'eliminated': False, # 脱落フラグ
-                'gave_up': False # ギブアップフラグ
-            } for player_id in room['players']
-        },
-        'started_at': time.time(), # ゲーム開始時刻を記録
-        'finished': False
-    }
+        # ナビゲーションモードの場合は従来通りランダムページ（これはWikipediaなので安全）
+        start_url = random_page_pool.pop(fallback=False)
+        if start_url is None:
+            # プールが空の場合はWikipediaから取得する。通信の間ルームのロックを保持しないよう
+            # いったん解放してから取得し、その間に変わっていないか確かめ直す
+            state_store.flush()
+            start_url = random_page_pool.pop()
+            room_id, room, error = startable_room(player_id)
+            if not error and room.settings.game_mode != game_mode:
+                error = 'ゲームモードが変更されました。もう一度開始してください'
+            if error:
+                emit('error', {'message': error})
+                return
+    
+    # room.target_url は is_safe_url で検証済み
+    target_url = room.target_url
+    
+    # ゲーム状態を初期化（URLは検証済み）
+    game_states[room_id] = GameState(start_url, target_url, room.players, started_at=time.time())
     
     # 部屋のステータスを更新
-    room['status'] = 'playing'
+    room.status = 'playing'
+    lobby.remove(room_id)
+
+    # ナビゲーションモードでは最短手数をバックグラウンドで求めておく（結果表示用）
+    if game_mode == 'navigation':
+        socketio.start_background_task(solve_optimal_moves, room_id, game_states[room_id])
     
     # 全プレイヤーに通知
     emit('game_started', {
         'start_url': html.escape(start_url),
         'target_url': html.escape(target_url),
-        'game_state': game_states[room_id], # game_state内のURLも必要に応じてエスケープ
+        'game_state': game_states[room_id],
         'room_info': room,
-        'room_settings': room.get('settings', {'allow_ctrl_f': True}) # ルーム設定も送信
+        'room_settings': room.settings # ルーム設定も送信
     }, room=room_id)
     
+    # 観戦者には別のチャンネルで全体の状態を送る
+    emit('spectator_snapshot', spectator_snapshot(room_id, room, game_states[room_id]),
+         room=spectator_channel(room_id))
+    
     print(f"Game started in room {room_id}")
 
-@socketio.on('player_move')
+def solve_optimal_moves(room_id, game_state):
+    """ゲームのスタートから目標までの最短手数を求め、ゲーム状態に記録する"""
+    start_title = url_to_title(game_state.start_url)
+    target_title = url_to_title(game_state.target_url)
+    if not start_title or not target_title:
+        return
+    try:
+        result = path_solver.solve(start_title, target_title)
+    except Exception as e:
+        print(f"最短経路探索エラー ({room_id}): {e}")
+        return
+    if not result['found']:
+        return
+    # 探索中に保存先の状態が更新されている場合があるので、読み直してから記録する
+    try:
+        current = game_states.get(room_id)
+        if current is not None and current.started_at == game_state.started_at:
+            current.optimal_moves = result['distance']
+    except StateLockTimeout as e:
+        print(f"最短手数を記録できませんでした ({room_id}): {e}")
+    finally:
+        state_store.flush()
+
+def player_delta(room_id, game_state, player_id):
+    """1人分の状態変化をバージョンを進めて返す（離脱したプレイヤーは player が None）
+
+    player はシリアライズ済みのJSONを持つ PlayerState で、変わっていない部分は再エンコードしない。
+    観戦者には次のティックでまとめて送るよう記録する。
+    """
+    game_state.version += 1
+    player_state = game_state.player_states.get(player_id)
+    spectator_feed.mark(room_id, player_id, player_state, game_state.version)
+    return {
+        'version': game_state.version,
+        'player_id': player_id,
+        'player': player_state
+    }
+
+@socket_event('sync_state')
+def handle_sync_state():
+    """差分の抜けを検出したクライアントにゲーム状態の全体を送る"""
+    player_id = request.sid
+    room_id = player_rooms.get(player_id)
+    game_state = game_states.get(room_id) if room_id else None
+    if not game_state:
+        emit('error', {'message': 'ゲームがアクティブではありません'})
+        return
+    emit('state_sync', {'room_id': room_id, 'game_state': game_state})
+
+@socket_event('player_move')
 def handle_player_move(data):
     """プレイヤーの移動を処理"""
     player_id = request.sid
@@ -724,100 +1137,84 @@ def handle_player_move(data):
         return
     
     game_state = game_states[room_id]
-    player_state = game_state['player_states'][player_id]
+    player_state = game_state.player_states[player_id]
     
     # プレイヤーが既にゴールしているか、脱落している場合は何もしない
-    if player_state['finished'] or player_state.get('eliminated', False):
+    if player_state.finished or player_state.eliminated:
         return
     
     # 移動回数を増やす
-    player_state['moves'] += 1
-    player_state['current_url'] = url
-    player_state['path'].append(url)
+    player_state.move_to(url)
     
     # 目標に到達したかチェック
-    target_url = game_state['target_url']
+    target_url = game_state.target_url
     from urllib.parse import urlparse, unquote
     current_path = unquote(urlparse(url).path)
     target_path = unquote(urlparse(target_url).path)
     is_target = current_path.lower() == target_path.lower()
     
+    rank = None
     if is_target:
-        import time
-        player_state['finished'] = True
-        player_state['finish_time'] = time.time()
-        
-        # すべてのプレイヤーがゴールしたかチェック
-        all_finished = all(state['finished'] for state in game_state['player_states'].values())
-        
-        if all_finished:
-            game_state['finished'] = True
-            rooms[room_id]['status'] = 'finished'
+        rank = game_state.finish_player(player_id, time.time())
     
-    # 全プレイヤーに通知
-    emit('player_moved', {
-        'player_id': player_id,
-        'url': html.escape(url),
-        'moves': player_state['moves'],
-        'finished': player_state['finished'],
-        'game_state': game_state
-    }, room=room_id)
+    # 全プレイヤーに変化した分だけを通知
+    delta = player_delta(room_id, game_state, player_id)
+    emit('player_moved', dict(
+        delta,
+        url=html.escape(url),
+        moves=player_state.moves,
+        finished=player_state.finished
+    ), room=room_id)
     
-    # プレイヤーがゴールした場合は追加の通知
     # プレイヤーがゴールした場合は追加の通知
     if is_target:
-        # 順位を計算
-        # ゴールしたプレイヤーのリストを取得
-        finished_player_ids = [p_id for p_id, state in game_state['player_states'].items() if state['finished']]
-        
-        # 移動回数が少ない順、同じ場合はゴール時間が早い順でソート
-        finished_player_ids.sort(key=lambda p_id: (
-            game_state['player_states'][p_id]['moves'],
-            game_state['player_states'][p_id]['finish_time']
-        ))
-        
-        # 現在のプレイヤーの順位を取得
-        try:
-            rank = finished_player_ids.index(player_id) + 1
-        except ValueError:
-            rank = -1 # 万が一リストにない場合（通常はありえない）
-
         emit('player_finished', {
             'player_id': player_id,
             'rank': rank,
-            'moves': player_state['moves'],
-            'finished_players': finished_player_ids, # ソート済みのIDリスト
-            'game_state': game_state
+            'moves': player_state.moves,
+            'finished_players': game_state.leaderboard.top(LEADERBOARD_BROADCAST_SIZE), # 上位のIDリスト（順位順）
+            'finished_count': len(game_state.leaderboard),
+            'version': game_state.version
         }, room=room_id)
         
         # 全員がゴールした場合はゲーム終了の通知
-        if all_finished:
-            # 最終結果を作成
-            results = []
-            for i, p_id in enumerate(finished_player_ids):
-                p_state = game_state['player_states'][p_id]
-                p_info = rooms[room_id]['player_info'][p_id]
-                time_taken = None
-                if p_state['finished'] and p_state['finish_time'] and game_state['started_at']:
-                    time_taken = p_state['finish_time'] - game_state['started_at']
-
-                results.append({
-                    'player_id': p_id,
-                    'username': html.escape(p_info['username']), # usernameをエスケープ
-                    'moves': p_state['moves'],
-                    'path': [html.escape(p) for p in p_state['path']], # path内の各URLをエスケープ
-                    'rank': i + 1, # ソート順に基づいたランク
-                    'time_taken': time_taken,
-                    'eliminated': p_state.get('eliminated', False),
-                    'gave_up': p_state.get('gave_up', False)
-                })
-            
-            emit('game_finished', {
-                'results': results,
-                'game_state': game_state
-            }, room=room_id)
+        finish_game_if_done(room_id, rooms[room_id], game_state)
+
+def finish_game_if_done(room_id, room, game_state):
+    """全員が終了（ゴール・脱落・ギブアップ）していればゲームを終え、最終結果を送る"""
+    if game_state.finished or not game_state.all_finished():
+        return
+    game_state.finished = True
+    room.status = 'finished'
+
+    # 最終結果を作成（順位表の順に並んでいる）
+    results = []
+    for i, p_id in enumerate(game_state.leaderboard.top()):
+        p_state = game_state.player_states[p_id]
+        p_info = room.player_info[p_id]
+        time_taken = None
+        if p_state.finish_time and game_state.started_at:
+            time_taken = p_state.finish_time - game_state.started_at
 
-@socketio.on('ctrl_f_violation')
+        results.append({
+            'player_id': p_id,
+            'username': html.escape(p_info.username), # usernameをエスケープ
+            'moves': p_state.moves,
+            'path': [html.escape(p) for p in p_state.path], # path内の各URLをエスケープ
+            'rank': i + 1,
+            'time_taken': time_taken,
+            'eliminated': p_state.eliminated,
+            'gave_up': p_state.gave_up
+        })
+
+    finished = {
+        'results': results,
+        'optimal_moves': game_state.optimal_moves
+    }
+    emit('game_finished', finished, room=room_id)
+    emit('spectator_finished', dict(finished, room_id=room_id), room=spectator_channel(room_id))
+
+@socket_event('ctrl_f_violation')
 def handle_ctrl_f_violation():
     """Ctrl+F違反を処理し、プレイヤーを脱落させる"""
     player_id = request.sid
@@ -832,70 +1229,29 @@ def handle_ctrl_f_violation():
 
     room = rooms[room_id]
     game_state = game_states[room_id]
-    player_state = game_state['player_states'].get(player_id)
+    player_state = game_state.player_states.get(player_id)
 
     # Ctrl+Fが禁止されているか確認
-    if room.get('settings', {}).get('allow_ctrl_f', True):
+    if room.settings.allow_ctrl_f:
         # 許可されている場合は何もしない（念のため）
         return
 
-    if player_state and not player_state.get('eliminated', False) and not player_state['finished']:
-        player_state['eliminated'] = True
-        player_state['finished'] = True # 脱落もゴール扱いとする
-        player_state['finish_time'] = time.time()
-        # player_state['moves'] はそのまま
+    if player_state and not player_state.eliminated and not player_state.finished:
+        # 脱落もゴール扱いとする（player_state.moves はそのまま）
+        game_state.finish_player(player_id, time.time(), eliminated=True)
 
         print(f"Player {player_id} in room {room_id} was eliminated for Ctrl+F violation.")
 
         # 全プレイヤーに通知 (player_moved と同様の形式でゲーム状態を更新)
-        emit('player_eliminated', { # 新しいイベントタイプ
-            'player_id': player_id,
-            'game_state': game_state,
-            'elimination_reason': 'Ctrl+F violation'
-        }, room=room_id)
+        emit('player_eliminated', dict( # 新しいイベントタイプ
+            player_delta(room_id, game_state, player_id),
+            elimination_reason='Ctrl+F violation'
+        ), room=room_id)
 
-        # 全員が終了（または脱落）したかチェック
-        all_players_done = all(
-            ps.get('finished', False) for ps in game_state['player_states'].values()
-        )
-        if all_players_done:
-            game_state['finished'] = True
-            room['status'] = 'finished'
-            # ここで game_finished イベントを発行することもできるが、
-            # player_finished のロジックと重複するため、
-            # player_eliminated を受け取ったクライアント側で結果表示を促すか、
-            # 共通の終了処理を呼び出す形が良いかもしれない。
-            # 今回は player_eliminated で game_state を送るので、クライアントはそれに基づいて判断する。
-            # 必要であれば、ここで game_finished と同様の結果集計と送信を行う。
-            # 例えば、最後のプレイヤーが脱落してゲームが終わる場合など。
-            # ひとまず、player_eliminated で game_state を送ることで対応。
-            # もし全員が脱落またはゴールしたら、最終結果を送信する
-            if all(state.get('finished') for state in game_state['player_states'].values()):
-                # 最終結果を作成 (handle_player_move からロジックを再利用または共通化)
-                finished_player_ids = [p_id for p_id, state in game_state['player_states'].items() if state['finished']]
-                finished_player_ids.sort(key=lambda p_id: (
-                    game_state['player_states'][p_id]['moves'],
-                    game_state['player_states'][p_id]['finish_time']
-                ))
-                results = []
-                for i, p_id_res in enumerate(finished_player_ids): # p_id だと外側のスコープと被る可能性
-                    p_state_res = game_state['player_states'][p_id_res]
-                    p_info_res = rooms[room_id]['player_info'][p_id_res]
-                    time_taken_res = None
-                    if p_state_res['finished'] and p_state_res['finish_time'] and game_state['started_at']:
-                        time_taken_res = p_state_res['finish_time'] - game_state['started_at']
-                    results.append({
-                        'player_id': p_id_res,
-                        'username': html.escape(p_info_res['username']),
-                        'moves': p_state_res['moves'],
-                        'path': [html.escape(p) for p in p_state_res['path']],
-                        'rank': i + 1,
-                        'time_taken': time_taken_res,
-                        'eliminated': p_state_res.get('eliminated', False)
-                    })
-                emit('game_finished', {'results': results, 'game_state': game_state}, room=room_id)
+        # 全員が終了（または脱落）していれば最終結果を送信する
+        finish_game_if_done(room_id, room, game_state)
 
-@socketio.on('player_give_up')
+@socket_event('player_give_up')
 def handle_player_give_up(data):
     """プレイヤーのギブアップを処理"""
     player_id = request.sid
@@ -911,63 +1267,24 @@ def handle_player_give_up(data):
     
     room = rooms[room_id]
     game_state = game_states[room_id]
-    player_state = game_state['player_states'].get(player_id)
+    player_state = game_state.player_states.get(player_id)
     
-    if not player_state or player_state.get('finished', False):
+    if not player_state or player_state.finished:
         # 既にゴールしているか、脱落している場合は何もしない
         return
     
     # プレイヤーをギブアップ状態に設定
-    player_state['gave_up'] = True
-    player_state['finished'] = True
-    player_state['finish_time'] = time.time()
+    game_state.finish_player(player_id, time.time(), gave_up=True)
     
     print(f"Player {player_id} in room {room_id} gave up.")
     
     # 全プレイヤーに通知
-    emit('player_gave_up', {
-        'player_id': player_id,
-        'game_state': game_state
-    }, room=room_id)
-    
-    # 全員が終了（ゴール、脱落、ギブアップ）したかチェック
-    all_players_done = all(
-        ps.get('finished', False) for ps in game_state['player_states'].values()
-    )
+    emit('player_gave_up', player_delta(room_id, game_state, player_id), room=room_id)
     
-    if all_players_done:
-        game_state['finished'] = True
-        room['status'] = 'finished'
-        
-        # 最終結果を作成
-        finished_player_ids = [p_id for p_id, state in game_state['player_states'].items() if state['finished']]
-        finished_player_ids.sort(key=lambda p_id: (
-            game_state['player_states'][p_id]['moves'],
-            game_state['player_states'][p_id]['finish_time']
-        ))
-        
-        results = []
-        for i, p_id_res in enumerate(finished_player_ids):
-            p_state_res = game_state['player_states'][p_id_res]
-            p_info_res = rooms[room_id]['player_info'][p_id_res]
-            time_taken_res = None
-            if p_state_res['finished'] and p_state_res['finish_time'] and game_state['started_at']:
-                time_taken_res = p_state_res['finish_time'] - game_state['started_at']
-            
-            results.append({
-                'player_id': p_id_res,
-                'username': html.escape(p_info_res['username']),
-                'moves': p_state_res['moves'],
-                'path': [html.escape(p) for p in p_state_res['path']],
-                'rank': i + 1,
-                'time_taken': time_taken_res,
-                'eliminated': p_state_res.get('eliminated', False),
-                'gave_up': p_state_res.get('gave_up', False)
-            })
-        
-        emit('game_finished', {'results': results, 'game_state': game_state}, room=room_id)
+    # 全員が終了（ゴール、脱落、ギブアップ）していれば最終結果を送信する
+    finish_game_if_done(room_id, room, game_state)
 
-@socketio.on('leave_room_request')
+@socket_event('leave_room_request')
 def handle_leave_room():
     """部屋から退出"""
     player_id = request.sid
@@ -975,54 +1292,118 @@ def handle_leave_room():
     if player_id not in player_rooms:
         return
     
-    room_id = player_rooms[player_id]
-    
-    if room_id in rooms:
-        # 部屋から退出
-        leave_room(room_id)
-        rooms[room_id]['players'].remove(player_id)
-        del rooms[room_id]['player_info'][player_id]
-        
-        # 部屋が空になったら削除
-        if len(rooms[room_id]['players']) == 0:
-            del rooms[room_id]
-            if room_id in game_states:
-                del game_states[room_id]
-        else:
-            # ホストが退出した場合は新しいホストを設定
-            if rooms[room_id]['host'] == player_id and rooms[room_id]['players']:
-                rooms[room_id]['host'] = rooms[room_id]['players'][0]
-            
-            # 残りのプレイヤーに通知
-            emit('player_left', {
-                'player_id': player_id,
-                'room_info': rooms[room_id]
-            }, room=room_id)
+    # ゲーム中に退出した場合も、切断した場合と同じくゲーム状態から外す
+    depart_room(player_id, player_rooms[player_id])
     
     # プレイヤーの部屋情報を削除
     del player_rooms[player_id]
     
     emit('left_room')
 
-@socketio.on('get_available_rooms')
-def handle_get_available_rooms():
-    """利用可能な部屋の一覧を取得"""
-    available_rooms = [
-        {
-            'id': room_id,
-            'name': room_info['name'],
-            'host': room_info['host'],
-            'player_count': len(room_info['players']),
-            'max_players': room_info['max_players'],
-            'status': room_info['status']
-        }
-        for room_id, room_info in rooms.items()
-        if room_info['status'] == 'waiting' and len(room_info['players']) < room_info['max_players']
-    ]
-    
-    emit('available_rooms', {'rooms': available_rooms})
+def _lobby_query(data):
+    """一覧の取得条件（ページと絞り込み）を取り出す"""
+    data = data if isinstance(data, dict) else {}
+    try:
+        offset = max(int(data.get('offset', 0)), 0)
+        limit = min(max(int(data.get('limit', LOBBY_PAGE_SIZE)), 1), LOBBY_PAGE_SIZE)
+    except (TypeError, ValueError):
+        offset, limit = 0, LOBBY_PAGE_SIZE
+    game_mode = data.get('game_mode') if data.get('game_mode') in ('navigation', 'guessing') else None
+    difficulty = data.get('difficulty') if data.get('difficulty') in ('easy', 'medium', 'hard') else None
+    return offset, limit, game_mode, difficulty
+
+def emit_available_rooms(data):
+    offset, limit, game_mode, difficulty = _lobby_query(data)
+    total, available_rooms = lobby.list(offset, limit, game_mode=game_mode, difficulty=difficulty)
+    emit('available_rooms', {
+        'rooms': available_rooms,
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    })
 
-@socketio.on('reset_room')
+@socket_event('get_available_rooms')
+def handle_get_available_rooms(data=None):
+    """利用可能な部屋の一覧を取得（offset / limit / game_mode / difficulty で絞り込み可能）"""
+    emit_available_rooms(data)
+
+@socket_event('subscribe_lobby')
+def handle_subscribe_lobby(data=None):
+    """ロビーの一覧を取得し、以降は一定間隔でまとめた差分（lobby_update）を受け取る"""
+    join_room(LOBBY_CHANNEL)
+    emit_available_rooms(data)
+
+@socket_event('unsubscribe_lobby')
+def handle_unsubscribe_lobby():
+    leave_room(LOBBY_CHANNEL)
+
+def end_spectating(room_id):
+    """ルームの削除時に観戦者へ通知し、観戦用のチャンネルを閉じる"""
+    channel = spectator_channel(room_id)
+    spectator_feed.discard(room_id)
+    socketio.emit('spectate_ended', {'room_id': room_id}, room=channel)
+    socketio.close_room(channel)
+
+@socket_event('spectate_room')
+def handle_spectate_room(data):
+    """ルームを観戦する（プレイヤーとしては参加しない）"""
+    room_id = data.get('room_id') if isinstance(data, dict) else None
+    if not room_id or room_id not in rooms:
+        emit('error', {'message': '部屋が見つかりません'})
+        return
+    room = rooms[room_id]
+    join_room(spectator_channel(room_id))
+    emit('spectator_snapshot', spectator_snapshot(room_id, room, game_states.get(room_id)))
+
+@socket_event('stop_spectating')
+def handle_stop_spectating(data):
+    room_id = data.get('room_id') if isinstance(data, dict) else None
+    if room_id:
+        leave_room(spectator_channel(room_id))
+
+def spectator_broadcaster():
+    """観戦者へ、前回のティック以降に変化したプレイヤーの状態をルームごとにまとめて送る"""
+    while True:
+        socketio.sleep(SPECTATOR_TICK)
+        try:
+            for room_id, changes in spectator_feed.take():
+                socketio.emit('spectator_tick', changes, room=spectator_channel(room_id))
+        except Exception as e:
+            print(f"観戦者への送信エラー: {e}")
+
+def expire_room(room_id, room, status):
+    """スイーパーが期限切れのルームを削除する前に、参加者への通知と付随データの片付けを行う"""
+    print(f"Room {room_id} expired ({status})")
+    socketio.emit('room_expired', {'room_id': room_id, 'status': status}, room=room_id)
+    socketio.close_room(room_id)
+    corpus.release(room_id)
+    lobby.remove(room_id)
+    end_spectating(room_id)
+
+room_sweeper = RoomSweeper(rooms, game_states, player_rooms, ROOM_TTLS, expire_room,
+                           flush=state_store.flush, prune=corpus.prune)
+
+def room_sweeper_loop():
+    """期限切れのルームを定期的に削除する"""
+    while True:
+        socketio.sleep(ROOM_SWEEP_INTERVAL)
+        try:
+            room_sweeper.sweep()
+        except Exception as e:
+            print(f"ルーム削除エラー: {e}")
+
+def lobby_broadcaster():
+    """ロビーの差分を一定間隔でまとめて購読中のクライアントに送る"""
+    while True:
+        socketio.sleep(LOBBY_PUSH_INTERVAL)
+        try:
+            changes = lobby.take_changes()
+            if changes:
+                socketio.emit('lobby_update', changes, room=LOBBY_CHANNEL)
+        except Exception as e:
+            print(f"ロビー更新の送信エラー: {e}")
+
+@socket_event('reset_room')
 def handle_reset_room(data):
     """ゲーム終了後、同じルームで新しいゲームを始めるためにルームをリセット"""
     player_id = request.sid
@@ -1039,21 +1420,22 @@ def handle_reset_room(data):
     room = rooms[room_id]
     
     # ホストだけがリセットできる
-    if room['host'] != player_id:
+    if room.host != player_id:
         emit('error', {'message': 'ホストのみがゲームをリセットできます'})
         return
     
     # ゲームが終了している場合のみリセット可能
-    if room['status'] != 'finished':
+    if room.status != 'finished':
         emit('error', {'message': 'ゲームが終了している場合のみリセットできます'})
         return
     
     # ルームをリセット（ウェイティング状態に戻す）
-    room['status'] = 'waiting'
+    room.status = 'waiting'
+    lobby.update(room)
     
     # 全プレイヤーの準備状態をリセット
-    for pid in room['player_info']:
-        room['player_info'][pid]['ready'] = False
+    for pid in room.player_info:
+        room.player_info[pid].ready = False
     
     # ゲーム状態をクリア（必要に応じて）
     if room_id in game_states:
@@ -1064,10 +1446,13 @@ def handle_reset_room(data):
         'room_id': room_id,
         'room_info': room
     }, room=room_id)
+    # 前のゲームの送信待ちの差分がスナップショットの後に届かないように捨てる
+    spectator_feed.discard(room_id)
+    emit('spectator_snapshot', spectator_snapshot(room_id, room, None), room=spectator_channel(room_id))
     
     print(f"Room {room_id} has been reset for a new game")
 
-@socketio.on('submit_answer')
+@socket_event('submit_answer')
 def handle_submit_answer(data):
     """ページ名当てモードでの回答を処理"""
     player_id = request.sid
@@ -1086,15 +1471,15 @@ def handle_submit_answer(data):
     
     room = rooms[room_id]
     game_state = game_states[room_id]
-    player_state = game_state['player_states'].get(player_id)
+    player_state = game_state.player_states.get(player_id)
     
     # ページ名当てモードでない場合は無効
-    if room.get('settings', {}).get('game_mode', 'navigation') != 'guessing':
+    if room.settings.game_mode != 'guessing':
         emit('error', {'message': 'このモードでは回答できません'})
         return
     
     # プレイヤーが既にゴールしているか、脱落している場合は何もしない
-    if player_state['finished'] or player_state.get('eliminated', False):
+    if player_state.finished or player_state.eliminated:
         return
     
     if not answer:
@@ -1103,64 +1488,52 @@ def handle_submit_answer(data):
     # 推測回数を増やす
     guess_count += 1
     
-    # 現在のページの正解タイトルを取得
-    correct_title = ''
-    if current_url and room_id in rooms and 'current_pages' in rooms[room_id]:
-        correct_title = rooms[room_id]['current_pages'].get(current_url, '')
+    # 正解はサーバー側で管理している現在のページから判定する
+    current_url = player_state.current_url or current_url
+    correct_title = answer_index.title_of(current_url) if current_url else ''
     
-    # 回答が正解かチェック（大文字小文字を区別しない）
-    is_correct = answer.lower() == correct_title.lower()
+    # 回答が正解かチェック（表記の揺れ・かな・ローマ字を許容）
+    is_correct = bool(current_url) and answer_index.is_correct(current_url, answer)
     
     if is_correct:
         # 正解の場合、新しい難易度ページを取得
-        difficulty = room.get('settings', {}).get('difficulty', 'easy')
+        difficulty = room.settings.difficulty
         try:
-            # 難易度ファイルのパス
-            file_path = os.path.join('gamedata', f'{difficulty}.txt')
-            
+            urls = corpus.get(difficulty)
+
             # ファイルが存在するかチェック
-            if not os.path.exists(file_path):
+            if urls is None:
                 emit('error', {'message': f'{difficulty}.txtファイルが見つかりません。'})
                 return
-            
-            # ファイルからランダムにURLを選択
-            with open(file_path, 'r', encoding='utf-8') as file:
-                urls = [line.strip() for line in file if line.strip()]
-                
+
             if not urls:
                 emit('error', {'message': f'{difficulty}.txtファイルが空です。'})
                 return
-                
-            # ランダムに1つ選択
-            new_url = random.choice(urls)
-            
-            # URLの安全性チェック
-            if not is_safe_url(new_url):
-                emit('error', {'message': '無効なURLが含まれています。'})
-                return
-            
+
+            # ルーム内で同じページが繰り返し出ないように選択（URLは読み込み時に検証済み）
+            new_url = corpus.sample(difficulty, key=room_id)
+
             # プレイヤー状態を更新
-            player_state['moves'] += 1
-            player_state['current_url'] = new_url
-            player_state['path'].append(new_url)
+            player_state.move_to(new_url)
             
             # 推測回数をリセット
             guess_count = 0
             
-            # 正解通知を送信
-            emit('answer_result', {
-                'is_correct': True,
-                'correct_title': correct_title,
-                'new_url': new_url,
-                'guess_count': guess_count
-            })
+            # 正解通知を送信（自分の状態の差分も含める）
+            delta = player_delta(room_id, game_state, player_id)
+            emit('answer_result', dict(
+                delta,
+                is_correct=True,
+                correct_title=correct_title,
+                new_url=new_url,
+                guess_count=guess_count
+            ))
             
             # 他のプレイヤーに正解通知
-            emit('player_answered_correctly', {
-                'player_id': player_id,
-                'player_name': room['player_info'][player_id]['username'],
-                'game_state': game_state
-            }, room=room_id, include_self=False)
+            emit('player_answered_correctly', dict(
+                delta,
+                player_name=room.player_info[player_id].username
+            ), room=room_id, include_self=False)
             
         except Exception as e:
             emit('error', {'message': f'新しいページ取得エラー: {str(e)}'})
@@ -1174,4 +1547,10 @@ def handle_submit_answer(data):
 
 # アプリケーション起動
 if __name__ == '__main__':
+    random_page_pool.start()
+    socketio.start_background_task(build_answer_index)
+    socketio.start_background_task(link_store_maintenance)
+    socketio.start_background_task(lobby_broadcaster)
+    socketio.start_background_task(room_sweeper_loop)
+    socketio.start_background_task(spectator_broadcaster)
     socketio.run(app, debug=True, port=5500)
\ No newline at end of file
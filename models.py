@@ -0,0 +1,262 @@
+import json
+import time
+
+from leaderboard import Leaderboard
+
+
+class Model:
+    """__slots__ で属性を固定したモデルの基底クラス
+
+    公開属性（先頭が _ でない属性）を書き換えると、自分と親のモデルの
+    シリアライズ済みJSONを破棄する。変更が無い間は to_json() が同じ文字列を返すので、
+    同じルーム情報を何度送信してもエンコードは1回で済む。
+    リストや辞書の中身を書き換えた場合は touch() を呼ぶこと。
+    """
+
+    __slots__ = ('_parent', '_json')
+    _fields = ()  # 配信する属性
+    _transient = ()  # 保存しない属性（読み込み時に _restore() で作り直す）
+    _children = {}  # 子モデルを持つ属性 -> モデルのクラス
+    _child_maps = {}  # 値が子モデルの辞書を持つ属性 -> モデルのクラス
+    _timestamped = False  # True のモデルは変更時刻を updated_at に記録する
+
+    def __init__(self, **values):
+        object.__setattr__(self, '_parent', None)
+        object.__setattr__(self, '_json', None)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith('_'):
+            self._adopt(value)
+            self.touch()
+
+    def _adopt(self, value):
+        if isinstance(value, Model):
+            object.__setattr__(value, '_parent', self)
+        elif isinstance(value, dict):
+            for item in value.values():
+                if isinstance(item, Model):
+                    object.__setattr__(item, '_parent', self)
+
+    def touch(self):
+        """自分と親のシリアライズ済みJSONを破棄する（親の変更時刻も更新する）"""
+        now = None
+        node = self
+        while node is not None:
+            object.__setattr__(node, '_json', None)
+            if node._timestamped:
+                if now is None:
+                    now = time.time()
+                object.__setattr__(node, 'updated_at', now)
+            node = node._parent
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+    def to_json(self):
+        if self._json is None:
+            object.__setattr__(self, '_json', dumps(self.to_dict()))
+        return self._json
+
+    def to_record(self):
+        """状態ストアに保存する辞書（配信しない属性も含む）"""
+        record = {}
+        for name in self.__slots__:
+            if name in self._transient:
+                continue
+            value = getattr(self, name)
+            if name in self._children:
+                value = value.to_record()
+            elif name in self._child_maps:
+                value = {key: item.to_record() for key, item in value.items()}
+            record[name] = value
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """to_record() で保存した辞書からモデルを作り直す"""
+        obj = cls.__new__(cls)
+        Model.__init__(obj)
+        for name in cls.__slots__:
+            if name in cls._transient:
+                continue
+            value = record.get(name)
+            if name in cls._children:
+                value = cls._children[name].from_record(value)
+            elif name in cls._child_maps:
+                child_cls = cls._child_maps[name]
+                value = {key: child_cls.from_record(item) for key, item in value.items()}
+            # 読み込みでは変更時刻を更新しないよう、touch() を通さずに設定する
+            object.__setattr__(obj, name, value)
+            obj._adopt(value)
+        obj._restore()
+        return obj
+
+    def _restore(self):
+        pass
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+def dumps(obj, separators=(',', ':'), **kwargs):
+    """Modelを含むデータをJSONにする。Modelはキャッシュ済みのJSONをそのまま埋め込む
+
+    辞書・リストは自前で組み立て、それ以外の値だけを json.dumps に任せる。
+    """
+    if isinstance(obj, Model):
+        return obj.to_json()
+    item_separator, key_separator = separators
+    if isinstance(obj, dict):
+        return '{' + item_separator.join(
+            _dumps_key(key) + key_separator + dumps(value, separators, **kwargs)
+            for key, value in obj.items()
+        ) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + item_separator.join(dumps(value, separators, **kwargs) for value in obj) + ']'
+    return json.dumps(obj, separators=separators, **kwargs)
+
+
+def _dumps_key(key):
+    # json.dumps と同じく、文字列以外のキーはJSONでの表記を文字列にする
+    return json.dumps(key if isinstance(key, str) else json.dumps(key))
+
+
+class WireJSON:
+    """SocketIO(json=...) に渡すJSONモジュール"""
+
+    dumps = staticmethod(dumps)
+    loads = staticmethod(json.loads)
+
+
+class RoomSettings(Model):
+    __slots__ = ('allow_ctrl_f', 'game_mode', 'difficulty')
+    _fields = __slots__
+
+    def __init__(self, allow_ctrl_f=True, game_mode='navigation', difficulty='easy'):
+        super().__init__(allow_ctrl_f=allow_ctrl_f, game_mode=game_mode, difficulty=difficulty)
+
+
+class PlayerInfo(Model):
+    __slots__ = ('username', 'ready')
+    _fields = __slots__
+
+    def __init__(self, username, ready=False):
+        super().__init__(username=username, ready=ready)
+
+
+class Room(Model):
+    """ルーム（待機中の設定と参加者）"""
+
+    __slots__ = ('id', 'name', 'host', 'players', 'player_info', 'status', 'max_players', 'target_url',
+                 'settings', 'tournament', 'updated_at')
+    _fields = ('id', 'name', 'host', 'players', 'player_info', 'status', 'max_players', 'target_url',
+               'settings', 'tournament')
+    _timestamped = True
+    _children = {'settings': RoomSettings}
+    _child_maps = {'player_info': PlayerInfo}
+
+    def __init__(self, room_id, name, host, max_players=4, target_url='https://ja.wikipedia.org/wiki/日本',
+                 tournament=False):
+        super().__init__(
+            id=room_id,
+            name=name,
+            host=host,
+            players=[],
+            player_info={},
+            status='waiting',  # waiting, playing, finished
+            max_players=max_players,
+            target_url=target_url,
+            settings=RoomSettings(),
+            tournament=tournament  # 大人数で遊ぶトーナメントルームか
+        )
+
+    def add_player(self, player_id, username):
+        self.players.append(player_id)
+        info = self.player_info[player_id] = PlayerInfo(username)
+        object.__setattr__(info, '_parent', self)
+        self.touch()
+
+    def remove_player(self, player_id):
+        if player_id in self.players:
+            self.players.remove(player_id)
+        self.player_info.pop(player_id, None)
+        self.touch()
+
+
+class PlayerState(Model):
+    """ゲーム中のプレイヤーの状態。経路（path）は結果表示時にだけ送るので配信しない"""
+
+    __slots__ = ('current_url', 'moves', 'path', 'finished', 'finish_time', 'eliminated', 'gave_up')
+    _fields = ('current_url', 'moves', 'finished', 'finish_time', 'eliminated', 'gave_up')
+
+    def __init__(self, start_url):
+        super().__init__(
+            current_url=start_url,
+            moves=0,
+            path=[start_url],
+            finished=False,
+            finish_time=None,
+            eliminated=False,  # 脱落フラグ
+            gave_up=False  # ギブアップフラグ
+        )
+
+    max_path_length = 1000  # 保持する経路の長さの上限（超えた分はスタートの次から捨てる）
+
+    def move_to(self, url):
+        self.moves += 1
+        self.current_url = url
+        self.path.append(url)
+        if len(self.path) > self.max_path_length:
+            del self.path[1]
+
+
+class GameState(Model):
+    """ルームで進行中のゲームの状態"""
+
+    __slots__ = ('start_url', 'target_url', 'player_states', 'started_at', 'finished', 'optimal_moves',
+                 'version', 'leaderboard', 'updated_at')
+    _fields = ('version', 'start_url', 'target_url', 'started_at', 'finished', 'player_states')
+    _transient = ('leaderboard',)
+    _child_maps = {'player_states': PlayerState}
+    _timestamped = True
+
+    def __init__(self, start_url, target_url, player_ids, started_at):
+        super().__init__(
+            start_url=start_url,
+            target_url=target_url,
+            player_states={player_id: PlayerState(start_url) for player_id in player_ids},
+            started_at=started_at,
+            finished=False,
+            optimal_moves=None,  # 最短手数（バックグラウンドで計算）
+            version=0,  # 状態が変わるたびに1ずつ増やす（クライアントは差分の抜けをこれで検出する）
+            leaderboard=Leaderboard()  # ゴールしたプレイヤーの順位表（配信しない）
+        )
+
+    def _restore(self):
+        self.leaderboard = Leaderboard()
+        for player_id, state in self.player_states.items():
+            if state.finished:
+                self.leaderboard.add(player_id, state.moves, state.finish_time)
+
+    def finish_player(self, player_id, finish_time, eliminated=False, gave_up=False):
+        """プレイヤーをゴール（脱落・ギブアップを含む）させ、順位（1始まり）を返す"""
+        state = self.player_states[player_id]
+        state.finished = True
+        state.finish_time = finish_time
+        if eliminated:
+            state.eliminated = True
+        if gave_up:
+            state.gave_up = True
+        return self.leaderboard.add(player_id, state.moves, finish_time)
+
+    def remove_player(self, player_id):
+        self.player_states.pop(player_id, None)
+        self.leaderboard.remove(player_id)
+        self.touch()
+
+    def all_finished(self):
+        # ゴールしたプレイヤーは必ず順位表にいるので、人数の比較だけで判定できる
+        return len(self.leaderboard) >= len(self.player_states)
@@ -0,0 +1,137 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote, quote
+
+# パス中でエンコードしない文字（Wikipediaが生成するURLに合わせる）
+_PATH_SAFE_CHARS = "/:()_,-.~!$&'*+;=@"
+
+
+def canonical_page_url(url):
+    """キャッシュキー用にWikipediaのURLを正規化する
+
+    スキームをhttpsに揃え、ホスト名を小文字にし、パスのパーセントエンコードと
+    '_'/空白の揺れを統一する。フラグメントは無視する。
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    path = unquote(parsed.path).replace(' ', '_')
+    canonical = f"https://{host}{quote(path, safe=_PATH_SAFE_CHARS)}"
+    if parsed.query:
+        canonical += '?' + '&'.join(sorted(parsed.query.split('&')))
+    return canonical
+
+
+def content_etag(data):
+    """レスポンス本文（バイト列）の強いETagの値（引用符は付けない）"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PageCache:
+    """LRU + TTL + メモリ上限付きのスレッドセーフなキャッシュ
+
+    値のサイズは呼び出し側から渡すか、省略時は sys.getsizeof で見積もる。
+    合計サイズが max_bytes を超えると古いエントリから追い出す。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=600, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # 1エントリがキャッシュ全体を押し流さないように上限を設ける
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """キーに対応する値を返す。存在しないか期限切れの場合は None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None, ttl=None):
+        """値を保存する。大きすぎる値は保存しない"""
+        if size is None:
+            size = sys.getsizeof(value)
+        if size > self.max_entry_bytes:
+            return False
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+        return True
+
+    def resize(self, key, value, size):
+        """保存済みの value の大きさを size に数え直す（有効期限は変えない）
+
+        key に value が保存されていない場合や、size が1エントリの上限を超える場合は何もせず False を返す。
+        """
+        if size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return False
+            self.current_bytes += size - entry[1]
+            self._entries[key] = (value, size, entry[2])
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest_key = next(iter(self._entries))
+                if oldest_key == key:
+                    self._entries.move_to_end(key)
+                    continue
+                self._remove(oldest_key)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self):
+        """ヒット数・ミス数などの統計情報を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
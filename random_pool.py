@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+
+
+class RandomPagePool:
+    """事前に取得したランダムページURLのプール
+
+    pop() はプールから1件取り出すだけなのでネットワーク待ちが発生しない。
+    残りが low_water 以下になるとバックグラウンドで size 件まで補充する。
+    プールが空の場合のみ fallback を同期的に呼び出す。
+    """
+
+    def __init__(self, fetch_batch, fallback, size=50, low_water=10, spawn=None, retry_interval=5,
+                 max_failures=3):
+        self.fetch_batch = fetch_batch  # fetch_batch(n) -> URLのリスト
+        self.fallback = fallback  # fallback() -> URL
+        self.size = size
+        self.low_water = low_water
+        self.retry_interval = retry_interval
+        self.max_failures = max_failures  # 連続で失敗したら補充を諦め、次のpop()で再開する
+        self._spawn = spawn or self._spawn_thread
+        self._urls = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self.served_from_pool = 0
+        self.served_from_fallback = 0
+
+    @staticmethod
+    def _spawn_thread(target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def __len__(self):
+        return len(self._urls)
+
+    def start(self):
+        """プールの補充を開始する"""
+        self._maybe_refill(force=True)
+
+    def pop(self, fallback=True):
+        """ランダムページのURLを1件取り出す（fallback=False の場合、プールが空なら None を返す）"""
+        try:
+            url = self._urls.popleft()
+        except IndexError:
+            url = None
+        self._maybe_refill()
+        if url is None:
+            if not fallback:
+                return None
+            self.served_from_fallback += 1
+            return self.fallback()
+        self.served_from_pool += 1
+        return url
+
+    def _maybe_refill(self, force=False):
+        with self._lock:
+            if self._refilling or (not force and len(self._urls) > self.low_water):
+                return
+            self._refilling = True
+        self._spawn(self._refill)
+
+    def _refill(self):
+        failures = 0
+        try:
+            while len(self._urls) < self.size and failures < self.max_failures:
+                try:
+                    urls = self.fetch_batch(self.size - len(self._urls))
+                except Exception as e:
+                    print(f"ランダムページ補充エラー: {e}")
+                    failures += 1
+                    time.sleep(self.retry_interval)
+                    continue
+                if not urls:
+                    # 全件がフィルタで除外された場合は待たずに再取得する
+                    failures += 1
+                    continue
+                failures = 0
+                self._urls.extend(urls)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def stats(self):
+        return {
+            'available': len(self._urls),
+            'size': self.size,
+            'low_water': self.low_water,
+            'served_from_pool': self.served_from_pool,
+            'served_from_fallback': self.served_from_fallback
+        }
@@ -0,0 +1,268 @@
+import re
+from html import escape, unescape
+from html.parser import HTMLParser
+
+from masking import title_mask
+
+WIKI_ORIGIN = 'https://ja.wikipedia.org'
+
+# 中身ごと削除するタグ
+DROP_TAGS = frozenset(['script', 'style'])
+# 値が javascript: で始まる場合に削除する属性
+URL_ATTRS = frozenset(['href', 'src', 'action', 'formaction'])
+# ゲーム画面に不要なWikipediaのUI部品（divのclass / id）
+CHROME_DIV_CLASSES = frozenset(['vector-header-container', 'mw-footer-container', 'vector-page-toolbar', 'mw-editsection'])
+CHROME_DIV_IDS = frozenset(['p-lang-btn'])
+# 終了タグを持たない要素
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+                       'link', 'meta', 'param', 'source', 'track', 'wbr'])
+# タイトルを隠す場合に、本文テキストと同様に置き換える属性（ツールチップなどに表示されるもの）
+MASKED_ATTRS = frozenset(['title', 'alt', 'aria-label', 'content'])
+
+# 走査の前にページタイトルを取り出すためのパターン（見出し → <title> の順に探す）
+TITLE_SPAN_RE = re.compile(r'<span class="mw-page-title-main">([^<]+)</span>')
+TITLE_TAG_RE = re.compile(r'<title>([^<]+?) - Wikipedia</title>')
+# テキストノードをまとめて隠すときの区切り（本文にもタイトルにもまず現れない文字）
+TEXT_SEPARATOR = '\x00'
+
+
+def _escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def mask_text_nodes(texts, title_mask):
+    """テキストノードのリストをまとめてタイトルを隠し、エスケープして返す
+
+    区切りで連結した1つの文字列に置換とエスケープをかけてから分け直すので、ノードの数によらず
+    表記ごとの検索・置換が1回ずつで済む。区切りを含む表記は無いのでノードをまたいで一致することはない
+    （ノード自体に区切りの文字が含まれていて数が合わない場合は、1つずつ隠し直す）。
+    """
+    parts = _escape_text(title_mask.mask(TEXT_SEPARATOR.join(texts))).split(TEXT_SEPARATOR)
+    if len(parts) != len(texts):
+        return [_escape_text(title_mask.mask(text)) for text in texts]
+    return parts
+
+
+class PageSanitizer(HTMLParser):
+    """WikipediaのHTMLを1回の走査で安全なゲーム表示用HTMLに変換する
+
+    以下の処理をトークン単位でまとめて行う:
+    - script/styleタグを中身ごと削除
+    - on*属性と javascript: URLを削除
+    - /w/, /static/ へのhrefと /wiki/ リンクを絶対URLに変換
+    - ヘッダー・フッター・ツールバー・言語ボタン・編集リンクのdivを削除
+    - mask_title=True の場合、ページタイトル(h1内のspan)をXで隠す
+    - title_mask を指定した場合、テキストと MASKED_ATTRS の属性値でタイトルに一致した部分をXで隠す
+      （URLやclassなどの属性値は変更しない）
+    """
+
+    def __init__(self, mask_title=False, title_mask=None):
+        super().__init__(convert_charrefs=True)
+        self.mask_title = mask_title
+        self.title_mask = title_mask
+        self.title_text = None  # 見つかったページタイトル
+        self._out = []
+        self._stack = []  # 開いている要素のタグ名
+        self._drop_tag = None  # 削除中のscript/style
+        self._skip_depth = 0  # 削除中のdivのネスト数
+        self._in_title = False
+        self._title_depth = 0
+        self._title_parts = []
+        self._text = []  # まだ出力していないテキストノード（feed() の区切りで分かれた断片）
+        self._masked_slots = []  # まだ隠していないテキストノードの _out での位置
+        self._masked_texts = []  # まだ隠していないテキストノード
+
+    def sanitize(self, content):
+        self.feed(content)
+        self.close()
+        return ''.join(self._out)
+
+    def iter_sanitize(self, content, chunk_size=64 * 1024):
+        """content を chunk_size 文字ずつ走査し、それまでの出力を順に返す（最初の部分を早く送るため）
+
+        区切りをまたぐテキストノードは、ノードの終わりまで読んでから隠して出力するため、
+        出力は chunk_size によらず sanitize() と同じになる。
+        """
+        for start in range(0, len(content), chunk_size):
+            self.feed(content[start:start + chunk_size])
+            if self._out:
+                yield self._take_output()
+        self.close()
+        if self._out:
+            yield self._take_output()
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        self._mask_pending_text()
+
+    def _take_output(self):
+        """ここまでの出力を返して空にする"""
+        self._mask_pending_text()
+        html = ''.join(self._out)
+        self._out.clear()
+        return html
+
+    def _flush_text(self):
+        """テキストノードの終わり（次のタグ・コメントか入力の終わり）で、断片をつなげてから出力する"""
+        if not self._text:
+            return
+        data = ''.join(self._text)
+        self._text.clear()
+        if self._in_title:
+            self._title_parts.append(data)
+            if self.mask_title:
+                data = 'X' * len(data)
+        elif self.title_mask and len(data) >= self.title_mask.min_length:
+            # テキストノードごとには隠さず、出力する前に _mask_pending_text() でまとめて隠す
+            self._masked_slots.append(len(self._out))
+            self._masked_texts.append(data)
+            self._out.append('')
+            return
+        self._out.append(_escape_text(data))
+
+    def _mask_pending_text(self):
+        """まだ隠していないテキストノードをまとめて隠し、エスケープして _out の元の位置に戻す"""
+        slots = self._masked_slots
+        if not slots:
+            return
+        out = self._out
+        for slot, html in zip(slots, mask_text_nodes(self._masked_texts, self.title_mask)):
+            out[slot] = html
+        slots.clear()
+        self._masked_texts.clear()
+
+    def _clean_attrs(self, tag, attrs):
+        parts = []
+        for name, value in attrs:
+            if name.startswith('on'):
+                continue
+            if value is None:
+                parts.append(f' {name}=""')
+                continue
+            if name in URL_ATTRS and value.lower().startswith('javascript:'):
+                continue
+            if self.title_mask and name in MASKED_ATTRS:
+                value = self.title_mask.mask(value)
+            elif name == 'href':
+                if value.startswith('/w/') or value.startswith('/static/') or \
+                   (tag == 'a' and value.startswith('/wiki/')):
+                    value = WIKI_ORIGIN + value
+            parts.append(f' {name}="{escape(value)}"')
+        return ''.join(parts)
+
+    def _is_chrome(self, attrs):
+        for name, value in attrs:
+            if name == 'class' and value and not CHROME_DIV_CLASSES.isdisjoint(value.split()):
+                return True
+            if name == 'id' and value in CHROME_DIV_IDS:
+                return True
+        return False
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if self._drop_tag:
+            return
+        if self._skip_depth:
+            if tag == 'div':
+                self._skip_depth += 1
+            return
+        if tag in DROP_TAGS:
+            self._drop_tag = tag
+            return
+        if tag == 'div' and self._is_chrome(attrs):
+            self._skip_depth = 1
+            return
+        if tag in VOID_TAGS:
+            self._out.append(f'<{tag}{self._clean_attrs(tag, attrs)}/>')
+            return
+        if tag == 'span' and self.title_text is None and not self._in_title and \
+           self._stack[-3:] == ['main', 'header', 'h1']:
+            self._in_title = True
+            self._title_depth = len(self._stack)
+        self._stack.append(tag)
+        self._out.append(f'<{tag}{self._clean_attrs(tag, attrs)}>')
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush_text()
+        if self._drop_tag or self._skip_depth or tag in DROP_TAGS:
+            return
+        if tag == 'div' and self._is_chrome(attrs):
+            return
+        self._out.append(f'<{tag}{self._clean_attrs(tag, attrs)}/>')
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if self._drop_tag:
+            if tag == self._drop_tag:
+                self._drop_tag = None
+            return
+        if self._skip_depth:
+            if tag == 'div':
+                self._skip_depth -= 1
+            return
+        if tag in VOID_TAGS or tag not in self._stack:
+            return
+        # 閉じ忘れの要素はここでまとめて閉じる
+        while self._stack:
+            open_tag = self._stack.pop()
+            if self._in_title and len(self._stack) == self._title_depth:
+                self._finish_title()
+            self._out.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def _finish_title(self):
+        self._in_title = False
+        self.title_text = ''.join(self._title_parts)
+
+    def handle_data(self, data):
+        if not (self._drop_tag or self._skip_depth):
+            self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+        if not (self._drop_tag or self._skip_depth):
+            self._out.append(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self._flush_text()
+        if not (self._drop_tag or self._skip_depth):
+            self._out.append(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self._flush_text()
+        if not (self._drop_tag or self._skip_depth):
+            self._out.append(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        self._flush_text()
+        if not (self._drop_tag or self._skip_depth):
+            self._out.append(f'<![{data}]>')
+
+
+def find_title(content):
+    """HTMLからページタイトルを取り出す（見つからない場合は None）"""
+    match = TITLE_SPAN_RE.search(content) or TITLE_TAG_RE.search(content)
+    return unescape(match.group(1)) if match else None
+
+
+def create_sanitizer(content, mask_title=False):
+    """content 用のサニタイザを作る
+
+    mask_title=True の場合は、見出しのタイトルに加えて本文中のタイトル
+    （括弧を除いた表記・ひらがな・ローマ字を含む）も同じ走査の中で隠す。
+    """
+    mask = None
+    if mask_title:
+        title = find_title(content)
+        if title:
+            mask = title_mask(title)
+    return PageSanitizer(mask_title=mask_title, title_mask=mask)
+
+
+def sanitize_html(content, mask_title=False):
+    """HTMLを1回の走査で無害化し、(HTML, ページタイトル) を返す"""
+    sanitizer = create_sanitizer(content, mask_title=mask_title)
+    html = sanitizer.sanitize(content)
+    return html, sanitizer.title_text
@@ -0,0 +1,68 @@
+import threading
+
+
+def spectator_channel(room_id):
+    """観戦者だけが入るSocketIOのルーム名（プレイヤーのルームとは別）"""
+    return f'{room_id}:spectators'
+
+
+def compact_player(state):
+    """観戦者に送るプレイヤーの状態 [移動回数, 終了, 脱落, ギブアップ, 現在のURL]（離脱した場合は None）"""
+    if state is None:
+        return None
+    return [state.moves, state.finished, state.eliminated, state.gave_up, state.current_url]
+
+
+def spectator_snapshot(room_id, room, game_state):
+    """観戦を始めたとき・ゲームの開始時やリセット時に送る全体の状態"""
+    snapshot = {
+        'room_id': room_id,
+        'room_info': room,
+        'version': None,
+        'started_at': None,
+        'target_url': room.target_url,
+        'players': {}
+    }
+    if game_state is not None:
+        snapshot.update(
+            version=game_state.version,
+            started_at=game_state.started_at,
+            target_url=game_state.target_url,
+            players={player_id: compact_player(state) for player_id, state in game_state.player_states.items()}
+        )
+    return snapshot
+
+
+class SpectatorFeed:
+    """観戦者向けに、ルームごとのプレイヤーの変化を一定間隔でまとめる
+
+    イベントのたびに mark() で変化したプレイヤーを記録し、take() で前回以降の変化を
+    ルームごとに1つのペイロードとして取り出す。同じプレイヤーが間隔内に何度動いても送るのは最後の状態だけなので、
+    移動1回あたりの処理は観戦者の人数によらない。
+    """
+
+    def __init__(self):
+        self._pending = {}  # ルームID -> {'version': 最新のバージョン, 'players': {プレイヤーID: 状態}}
+        self._lock = threading.Lock()
+
+    def mark(self, room_id, player_id, state, version):
+        compact = compact_player(state)
+        with self._lock:
+            pending = self._pending.get(room_id)
+            if pending is None:
+                pending = self._pending[room_id] = {'version': version, 'players': {}}
+            pending['version'] = max(pending['version'], version)
+            pending['players'][player_id] = compact
+
+    def discard(self, room_id):
+        with self._lock:
+            self._pending.pop(room_id, None)
+
+    def take(self):
+        """前回以降に変化のあったルームの (ルームID, ペイロード) のリストを返す"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [(room_id, dict(changes, room_id=room_id)) for room_id, changes in pending.items()]
+
+    def __len__(self):
+        return len(self._pending)
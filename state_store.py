@@ -0,0 +1,370 @@
+import json
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+def _encode(value):
+    if hasattr(value, 'to_record'):
+        value = value.to_record()
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _decode(raw, model):
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    value = json.loads(raw)
+    return model.from_record(value) if model else value
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class StateLockTimeout(Exception):
+    """キー（ルーム）のロックを lock_timeout 秒待っても取得できなかった
+
+    ロック無しで続けると同じルームのイベントが同時に適用されてしまうため、イベントの処理を中断する。
+    呼び出し側は discard() で変更を書き戻さずにロックを解放する。
+    """
+
+    def __init__(self, key):
+        super().__init__(f'ロック待ちがタイムアウトしました: {key}')
+        self.key = key
+
+
+class MemoryStore:
+    """ルーム・ゲーム状態をプロセス内の辞書に置く（既定。1プロセスでのみ動作する）
+
+    locked=True のマッピングは、キーを最初に参照した時点でキーのハッシュで選んだロック（ストライプ）を取り、
+    flush()（イベントの終了時）まで保持する。同じルームのイベントは1つずつ適用され、
+    別のルームのイベントは（ストライプが衝突しない限り）並行して処理される。
+    lock_timeout 秒待ってもロックを取れない場合は StateLockTimeout を送出する。
+    """
+
+    backend = 'memory'
+
+    def __init__(self, lock_stripes=64, lock_timeout=5):
+        self._mappings = {}
+        self._stripes = [threading.RLock() for _ in range(lock_stripes)]
+        self.lock_timeout = lock_timeout  # ロックの取得を待つ時間（秒）
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+
+    def mapping(self, name, model=None, locked=False):
+        if not locked or not self._stripes:
+            return self._mappings.setdefault(name, {})
+        return self._mappings.setdefault(name, LockedDict(self))
+
+    def _lock(self, key):
+        """キーのストライプのロックを取る（同じスレッドで取得済みなら何もしない）"""
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = []
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+        if stripe in held:
+            return
+        if not stripe.acquire(blocking=False):
+            with self._stats_lock:
+                self.lock_waits += 1
+            if not stripe.acquire(timeout=self.lock_timeout):
+                with self._stats_lock:
+                    self.lock_timeouts += 1
+                raise StateLockTimeout(key)
+        held.append(stripe)
+
+    def flush(self):
+        """このスレッドで取得したロックを解放する"""
+        held = getattr(self._local, 'held', None)
+        if not held:
+            return
+        self._local.held = None
+        for stripe in reversed(held):
+            stripe.release()
+
+    def discard(self):
+        """中断したイベントのロックを解放する
+
+        値はその場で変更されているため取り消せないが、ロックはキーを最初に参照した時点
+        （そのキーの値を変更する前）に取るので、取得に失敗したキーの値は変更されていない。
+        """
+        self.flush()
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'lock_stripes': len(self._stripes),
+            'lock_waits': self.lock_waits,
+            'lock_timeouts': self.lock_timeouts
+        }
+
+
+class LockedDict(dict):
+    """キーを参照するたびにそのキーのロックを取る辞書（MemoryStore.mapping() で作成する）
+
+    一覧の取得（items() / values() / 反復）はロックを取らない。
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self._store = store
+
+    def __getitem__(self, key):
+        self._store._lock(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._store._lock(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._store._lock(key)
+        super().__delitem__(key)
+
+    def __contains__(self, key):
+        self._store._lock(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self._store._lock(key)
+        return super().get(key, default)
+
+    def pop(self, key, *default):
+        self._store._lock(key)
+        return super().pop(key, *default)
+
+
+class RedisStore:
+    """ルーム・ゲーム状態をRedisのハッシュに置く
+
+    複数のワーカープロセスで同じルームを扱えるよう、値は1件ずつJSONで保存する。
+    イベントの処理中に読み込んだ値はスレッドごとに保持して同じオブジェクトを返し、
+    flush() で変更があったものだけを書き戻す（Flaskのリクエスト・SocketIOのイベントの終了時に呼ぶ）。
+    locked=True のマッピングはキーごとにRedisのロックを取り、同じキーを扱うイベントを
+    プロセスをまたいで直列化する（ロックは flush() で解放する）。
+    lock_timeout 秒待ってもロックを取れない場合は StateLockTimeout を送出する。
+
+    lock_ttl はイベントの処理にかかる最長の時間（ロック待ち lock_timeout × 取得するキーの数と
+    処理そのものの時間の合計）より長くする。それでも処理中に有効期間が切れた場合は、
+    flush() はロックを保持しているかを確かめてから書き込むので、他のワーカーの書き込みを上書きせずに
+    このイベントの変更を捨てる。
+    """
+
+    backend = 'redis'
+
+    def __init__(self, url=None, client=None, prefix='wikigame', lock_ttl=30, lock_timeout=5):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError('Redisを状態ストアに使うには redis パッケージをインストールしてください'
+                                   '（pip install redis）') from e
+            client = redis.Redis.from_url(url)
+        from redis.exceptions import WatchError
+        self._watch_error = WatchError
+        self.client = client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl  # ロックの有効期間（秒）。ワーカーが落ちてもこの時間で解放される
+        self.lock_timeout = lock_timeout  # ロックの取得を待つ時間（秒）
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.writes = 0
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+        self.locks_expired = 0
+
+    def mapping(self, name, model=None, locked=False):
+        return RedisMapping(self, f'{self.prefix}:{name}', model, locked)
+
+    def _loaded(self):
+        # (ハッシュ名, キー) -> [読み込んだJSON, 値, 書き戻してよいか]
+        loaded = getattr(self._local, 'loaded', None)
+        if loaded is None:
+            loaded = self._local.loaded = {}
+            self._local.locks = {}
+        return loaded
+
+    def _lock(self, key):
+        """キーのロックを取る（同じスレッドで取得済みなら何もしない）"""
+        self._loaded()
+        locks = self._local.locks
+        if key in locks:
+            return
+        lock_key = f'{self.prefix}:lock:{key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        waited = False
+        while not self.client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)):
+            waited = True
+            if time.monotonic() >= deadline:
+                with self._stats_lock:
+                    self.lock_timeouts += 1
+                raise StateLockTimeout(key)
+            time.sleep(0.005)
+        if waited:
+            with self._stats_lock:
+                self.lock_waits += 1
+        locks[key] = (lock_key, token)
+
+    def flush(self):
+        """このスレッドで読み込んだ値のうち変更があったものを書き戻し、ロックを解放する"""
+        loaded = getattr(self._local, 'loaded', None)
+        if loaded is None:
+            return
+        locks = self._local.locks
+        self._local.loaded = None
+        self._local.locks = None
+        try:
+            writes = []
+            for (hash_key, key), (raw, value, writable) in loaded.items():
+                if value is _MISSING or not writable:
+                    continue
+                new_raw = _encode(value)
+                if new_raw != raw:
+                    writes.append((hash_key, key, new_raw))
+            if writes:
+                self._write(writes, locks)
+        finally:
+            for lock_key, token in locks.values():
+                self._unlock(lock_key, token)
+
+    def _write(self, writes, locks):
+        """ロックをすべて保持している場合だけ、変更をまとめて書き込む
+
+        ロックのキーをWATCHしてから保持しているかを確かめ、MULTI/EXECで書き込むので、
+        確認と書き込みの間に有効期間が切れて他のワーカーがロックを取った場合も書き込まない。
+        """
+        expired = False
+        with self.client.pipeline() as pipe:
+            try:
+                if locks:
+                    pipe.watch(*(lock_key for lock_key, _ in locks.values()))
+                    expired = any(_text(pipe.get(lock_key)) != token for lock_key, token in locks.values())
+                if not expired:
+                    pipe.multi()
+                    for hash_key, key, raw in writes:
+                        pipe.hset(hash_key, key, raw)
+                    pipe.execute()
+            except self._watch_error:
+                expired = True
+        if expired:
+            with self._stats_lock:
+                self.locks_expired += 1
+            print(f"処理中にロックの有効期間が切れたため、変更を書き戻しませんでした: {', '.join(locks)}")
+            return
+        with self._stats_lock:
+            self.writes += len(writes)
+
+    def discard(self):
+        """中断したイベントの変更を書き戻さずに捨て、ロックを解放する
+
+        値の置き換え・削除（mapping[key] = value / del mapping[key]）はその場で書き込まれるため取り消せないが、
+        ロックはキーを最初に参照した時点で取るので、取得に失敗したキーの値は変更されていない。
+        """
+        loaded = getattr(self._local, 'loaded', None)
+        if loaded is None:
+            return
+        locks = self._local.locks
+        self._local.loaded = None
+        self._local.locks = None
+        for lock_key, token in locks.values():
+            self._unlock(lock_key, token)
+
+    def _unlock(self, lock_key, token):
+        # 有効期間が切れて他のワーカーが取得したロックは消さない
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(lock_key)
+                if _text(pipe.get(lock_key)) == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+            except self._watch_error:
+                pass
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'writes': self.writes,
+            'lock_waits': self.lock_waits,
+            'lock_timeouts': self.lock_timeouts,
+            'locks_expired': self.locks_expired
+        }
+
+
+class RedisMapping(MutableMapping):
+    """Redisのハッシュ1つを辞書として扱う（RedisStore.mapping() で作成する）"""
+
+    def __init__(self, store, hash_key, model=None, locked=False):
+        self.store = store
+        self.hash_key = hash_key
+        self.model = model
+        self.locked = locked
+
+    def _cache_key(self, key):
+        if self.locked:
+            self.store._lock(key)
+        return self.hash_key, key
+
+    def __getitem__(self, key):
+        loaded = self.store._loaded()
+        cache_key = self._cache_key(key)
+        entry = loaded.get(cache_key)
+        if entry is None or not entry[2]:
+            # ロックを取る前に items() で読み込んだ値は古い可能性があるので読み直す
+            raw = self.store.client.hget(self.hash_key, key)
+            value = _MISSING if raw is None else _decode(raw, self.model)
+            entry = loaded[cache_key] = [_text(raw), value, True]
+        if entry[1] is _MISSING:
+            raise KeyError(key)
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        loaded = self.store._loaded()
+        cache_key = self._cache_key(key)
+        raw = _encode(value)
+        self.store.client.hset(self.hash_key, key, raw)
+        loaded[cache_key] = [raw, value, True]
+
+    def __delitem__(self, key):
+        self[key]  # 無ければ KeyError
+        self.store.client.hdel(self.hash_key, key)
+        self.store._loaded()[(self.hash_key, key)] = [None, _MISSING, True]
+
+    def __iter__(self):
+        return (_text(key) for key in self.store.client.hkeys(self.hash_key))
+
+    def __len__(self):
+        return self.store.client.hlen(self.hash_key)
+
+    def items(self):
+        """全件を1回の通信で読み込む
+
+        ロックは取らないので、locked=True のマッピングでは読み取り専用として扱い書き戻さない。
+        """
+        loaded = self.store._loaded()
+        items = []
+        for key, raw in self.store.client.hgetall(self.hash_key).items():
+            key = _text(key)
+            entry = loaded.get((self.hash_key, key))
+            if entry is None:
+                entry = loaded[(self.hash_key, key)] = [_text(raw), _decode(raw, self.model), not self.locked]
+            if entry[1] is not _MISSING:
+                items.append((key, entry[1]))
+        return items
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+
+def create_state_store(url, lock_stripes=64, lock_ttl=30):
+    """WIKIGAME_STATE_STORE の値から状態ストアを作る（memory または redis://...）"""
+    if not url or url == 'memory':
+        return MemoryStore(lock_stripes=lock_stripes)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url, lock_ttl=lock_ttl)
+    raise ValueError(f'未対応の状態ストアです: {url}')
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from state_store import StateLockTimeout
+
+
+class RoomSweeper:
+    """一定時間操作の無いルームとゲーム状態を削除するスイーパー
+
+    ルームの状態（waiting / playing / finished）ごとに有効期間を設定する。
+    最終操作時刻はルームとゲーム状態の新しい方（updated_at）を使う。
+    ルームを削除するときは expire(room_id, room, status) を呼び、通知や付随データの片付けは呼び出し側で行う。
+    prune(存在するルームIDの集合) にはルームごとの付随データ（山札など）から削除済みのルームの分を
+    捨てて件数を返す関数を渡す（他のワーカーで削除されたルームの分もここで回収される）。
+    """
+
+    def __init__(self, rooms, game_states, player_rooms, ttls, expire, flush=None, prune=None):
+        self.rooms = rooms
+        self.game_states = game_states
+        self.player_rooms = player_rooms
+        self.ttls = ttls  # 状態 -> 有効期間（秒）。0 以下の状態は削除しない
+        self.expire = expire
+        self.flush = flush or (lambda: None)
+        self.prune = prune
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.expired = {status: 0 for status in ttls}
+        self.orphan_players = 0
+        self.pruned = 0
+        self.last_duration = 0.0
+
+    def _is_idle(self, room, game_state, now):
+        ttl = self.ttls.get(room.status, 0)
+        if ttl <= 0:
+            return False
+        last_active = room.updated_at or 0
+        if game_state is not None and game_state.updated_at:
+            last_active = max(last_active, game_state.updated_at)
+        return now - last_active > ttl
+
+    def sweep(self, now=None):
+        """期限切れのルームを削除し、削除した件数を返す"""
+        now = time.time() if now is None else now
+        start = time.perf_counter()
+        expired = 0
+        # 一覧はロックを取らずに読み、候補だけをロックを取って読み直してから削除する
+        candidates = [
+            room_id for room_id, room in list(self.rooms.items())
+            if self._is_idle(room, None, now)
+        ]
+        self.flush()
+        for room_id in candidates:
+            try:
+                room = self.rooms.get(room_id)
+                if room is None:
+                    continue
+                game_state = self.game_states.get(room_id)
+                if not self._is_idle(room, game_state, now):
+                    continue
+                status = room.status
+                self.expire(room_id, room, status)
+                for player_id in list(room.players):
+                    if self.player_rooms.get(player_id) == room_id:
+                        del self.player_rooms[player_id]
+                del self.rooms[room_id]
+                if game_state is not None:
+                    del self.game_states[room_id]
+                expired += 1
+                with self._lock:
+                    self.expired[status] = self.expired.get(status, 0) + 1
+            except StateLockTimeout:
+                # イベントの処理中のルームは使われているので、次の確認に回す
+                continue
+            finally:
+                self.flush()
+        orphans = self._sweep_orphan_players()
+        pruned = self.prune(set(self.rooms)) if self.prune else 0
+        with self._lock:
+            self.runs += 1
+            self.orphan_players += orphans
+            self.pruned += pruned
+            self.last_duration = time.perf_counter() - start
+        return expired
+
+    def _sweep_orphan_players(self):
+        """存在しないルームを指しているプレイヤーの対応付けを削除する（落ちたワーカーの残骸など）"""
+        removed = 0
+        try:
+            # 先にプレイヤーを読むことで、その後に作られたルームを存在しないと誤判定しない
+            players = list(self.player_rooms.items())
+            live_rooms = set(self.rooms)
+            for player_id, room_id in players:
+                if room_id not in live_rooms:
+                    self.player_rooms.pop(player_id, None)
+                    removed += 1
+        finally:
+            self.flush()
+        return removed
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'expired': dict(self.expired),
+            'orphan_players': self.orphan_players,
+            'pruned': self.pruned,
+            'last_duration': self.last_duration,
+            'rooms': len(self.rooms),
+            'game_states': len(self.game_states),
+            'players': len(self.player_rooms)
+        }
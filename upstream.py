@@ -0,0 +1,203 @@
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_USER_AGENT = 'WikiGame/1.0 (https://github.com/choko510/wikigame) python-requests'
+
+
+class UpstreamBusy(requests.exceptions.RequestException):
+    """同時リクエスト数の上限に達し、待ち時間内に空きが出なかった"""
+
+
+class StoredResponse:
+    """条件付きリクエストで再利用するために保存した応答（検証子と本文）"""
+
+    __slots__ = ('etag', 'last_modified', 'content', 'headers', 'encoding', 'url')
+
+    def __init__(self, response):
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.content = response.content
+        self.headers = dict(response.headers)
+        self.encoding = response.encoding
+        self.url = response.url
+
+    @property
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def replay(self, not_modified):
+        """304応答を、保存しておいた本文を持つ200応答に置き換える"""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response._content = self.content
+        response.headers.update(self.headers)
+        # 304に含まれる新しい検証子・有効期限で更新する
+        for name in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Date'):
+            if name in not_modified.headers:
+                response.headers[name] = not_modified.headers[name]
+        response.encoding = self.encoding
+        response.url = self.url
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        response.revalidated = True
+        return response
+
+
+class UpstreamClient:
+    """Wikipediaへのリクエストをまとめて扱うHTTPクライアント
+
+    Keep-Aliveの接続プールを共有し、全リクエストにタイムアウト・リトライ・
+    User-Agentを設定する。同時に送信するリクエストは max_concurrency 件までに制限し、
+    空きを queue_timeout 秒待っても得られない場合は UpstreamBusy を送出する。
+    eventlet・geventでモンキーパッチ済みの場合、待機はグリーンスレッド単位になる。
+    base_url を指定すると、リクエスト先のスキームとホストをそのURLに置き換える
+    （ベンチマーク用のスタブサーバーなど、パスとクエリはそのまま送る）。
+    observe を指定すると、リクエストごとに observe(呼び出し元, 秒数, 成否) を呼び出す
+    （秒数は同時リクエスト数の空き待ちを除いた送受信の時間）。
+    validators にキャッシュ（PageCache）を渡すと、revalidate=True のリクエストでは
+    ETag / Last-Modified 付きの応答を保存し、次回は If-None-Match / If-Modified-Since を送って
+    304のときは保存した本文を返す。
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=32, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff_factor=0.3, user_agent=DEFAULT_USER_AGENT, max_concurrency=None,
+                 queue_timeout=10, base_url=None, observe=None, validators=None):
+        self.observe = observe
+        self.validators = validators  # URL -> StoredResponse
+        self.conditional_requests = 0
+        self.not_modified = 0
+        self.bytes_reused = 0
+        self.base_url = urlsplit(base_url) if base_url else None
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency or pool_maxsize
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.rejected = 0
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=retry, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, params=None, timeout=None, allow_redirects=True, headers=None, site='other',
+            revalidate=False):
+        """GETリクエストを送信する。timeoutを省略した場合は既定値を使う
+
+        site は計測用の呼び出し元の名前（proxy, search など）。
+        revalidate=True の場合は保存済みの応答を条件付きリクエストで再検証する（params 無しのみ）。
+        """
+        stored = None
+        revalidate = revalidate and self.validators is not None and params is None
+        if revalidate:
+            stored = self.validators.get(url)
+            if stored is not None:
+                headers = dict(headers or {}, **stored.conditional_headers())
+        self._acquire()
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.get(
+                self._resolve(url),
+                params=params,
+                timeout=timeout or self.timeout,
+                allow_redirects=allow_redirects,
+                headers=headers
+            )
+            ok = response.status_code < 500
+        finally:
+            self._release()
+            if self.observe is not None:
+                self.observe(site, time.perf_counter() - start, ok)
+        if not revalidate:
+            return response
+        if stored is not None:
+            with self._lock:
+                self.conditional_requests += 1
+            if response.status_code == 304:
+                with self._lock:
+                    self.not_modified += 1
+                    self.bytes_reused += len(stored.content)
+                return stored.replay(response)
+        if response.status_code == 200:
+            fresh = StoredResponse(response)
+            if fresh.has_validators:
+                self.validators.set(url, fresh, size=len(fresh.content))
+        return response
+
+    def _resolve(self, url):
+        if self.base_url is None:
+            return url
+        parts = urlsplit(url)
+        return urlunsplit((self.base_url.scheme, self.base_url.netloc, parts.path, parts.query, parts.fragment))
+
+    def _acquire(self):
+        if self._slots.acquire(blocking=False):
+            self._enter()
+            return
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise UpstreamBusy(f'Wikipediaへの同時リクエスト数が上限（{self.max_concurrency}）に達しています')
+        self._enter()
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'peak_in_flight': self.peak_in_flight,
+            'rejected': self.rejected,
+            'conditional_requests': self.conditional_requests,
+            'not_modified': self.not_modified,
+            'bytes_reused': self.bytes_reused
+        }
+
+    def close(self):
+        self.session.close()